@@ -0,0 +1,81 @@
+import logging
+
+import numpy as np
+
+from history import read_records
+
+logger = logging.getLogger(__name__)
+
+# Latencies recorded for every evaluation (see Benchmark)
+QUERY_METRICS = ['Q%d' % k for k in range(1, 23)] + ['RF1', 'RF2']
+
+
+def latency_table(records, metrics=QUERY_METRICS):
+    '''
+        Returns the individuals as a (n, state_size) matrix and their
+        latencies as a (n, len(metrics)) matrix, NaN where not measured.
+        The power test latencies (Q1..Q22) are taken first, those of the
+        stand-alone query stream (stream_Q1..) otherwise.
+    '''
+    X, Y = [], []
+    for individual, values in records:
+        latencies = [values.get(metric, values.get(f'stream_{metric}', np.nan)) for metric in metrics]
+        if np.isnan(latencies).all():
+            continue
+        X.append(individual)
+        Y.append([float(latency) for latency in latencies])
+    return np.asarray(X, dtype=np.float64), np.asarray(Y, dtype=np.float64)
+
+
+def column_effects(records, columns=None, metrics=QUERY_METRICS):
+    '''
+        Estimates the marginal effect (in seconds) of indexing each column
+        on each query latency, as the coefficients of a least squares fit
+        of the latency on the index bitvector.
+
+        Returns {metric: {column: effect}}, negative effects mean the
+        index makes the query faster.
+    '''
+    X, Y = latency_table(records, metrics)
+    if len(X) == 0:
+        return dict()
+    if columns is None:
+        columns = ['x%d' % k for k in range(X.shape[1])]
+
+    effects = dict()
+    for j, metric in enumerate(metrics):
+        measured = ~np.isnan(Y[:, j])
+        if measured.sum() < 2:
+            continue
+        A = np.hstack([np.ones((measured.sum(), 1)), X[measured]])
+        coefficients = np.linalg.lstsq(A, Y[measured, j], rcond=None)[0]
+        effects[metric] = dict(zip(columns, coefficients[1:].tolist()))
+    return effects
+
+
+def prunable_columns(effects, threshold=0.01):
+    '''
+        Columns whose index changes no query latency by more than
+        threshold seconds, candidates to leave out of the search space
+    '''
+    if not effects:
+        return []
+    columns = next(iter(effects.values())).keys()
+    return [
+        column for column in columns
+        if all(abs(effect[column]) < threshold for effect in effects.values())
+    ]
+
+
+def report(effects, top=3):
+    for metric, effect in effects.items():
+        best = sorted(effect.items(), key=lambda item: item[1])[:top]
+        logger.info(f'{metric}: ' + ', '.join(f'{column} {value:+.3f}s' for column, value in best))
+
+
+if __name__ == '__main__':
+    import sys
+    logging.basicConfig(format='%(message)s', level=logging.INFO)
+    effects = column_effects(read_records(sys.argv[1]))
+    report(effects)
+    logger.info(f'Prunable columns: {prunable_columns(effects)}')
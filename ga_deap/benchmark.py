@@ -1,16 +1,19 @@
 import logging
-import os
+import subprocess
+import threading
 import time
 from collections import namedtuple
-from multiprocessing import Process, Queue
-
-import mysql
+from queue import Queue
 
 import config
 import numpy as np
-import utils
+from connection import driver_error
 from database import Database
+from explain import fingerprint, parse_plan, query_cost
+from refresh import RefreshAllocator, RefreshPipeline
 from scipy import stats  # FOR GEOMETRIC MEAN
+from streams import (StreamWorkerPool, default_num_streams, mark_truncated,
+                     read_profiles)
 
 logger = logging.getLogger(__name__)
 
@@ -29,24 +32,63 @@ Metrics = namedtuple(
 
 
 class Benchmark:
+
+    # Session settings of the connections that profile the query stream
+    PROFILING_SETUP = [
+        "SET PROFILING_HISTORY_SIZE = 22",
+        "SET PROFILING = 1",
+    ]
+
+    # Views called by the QUERY_STREAM procedure, in order
+    QUERIES = ['query%d' % k for k in range(1, 23)]
+
+    # ER_QUERY_TIMEOUT, raised when MAX_EXECUTION_TIME is exceeded
+    QUERY_TIMEOUT_ERRNO = 3024
     
-    def __init__(self, database):
-        self.DB_CONFIG = utils.get_conn_dict()
-        # IT IS NOT BEING USED
+    def __init__(self, database, max_query_time=None, prestage_depth=2,
+                 scale_factor=None, num_streams=None, refresh_path=None):
         self.db = database        
+        # Connections are shared with the database through its pool
+        self.pool = database.pool
+
+        '''
+            Bounded evaluation: when time_budget (seconds) is set, query
+            streams run query by query and are aborted once the budget
+            is exceeded. max_query_time (seconds) caps each single query
+            of the power test and query stream, with or without a budget.
+        '''
+        self.time_budget = None
+        self.max_query_time = max_query_time
 
         '''
         SCALE_FACTOR    1   10  30  100
         NUM_STREAMS     2   3   4   5
+        (defaults from config.py, NUM_STREAMS follows SCALE_FACTOR if unset)
+        '''
+        self.SCALE_FACTOR = scale_factor or config.SCALE_FACTOR
+        self.NUM_STREAMS = (
+            num_streams or config.NUM_STREAMS or default_num_streams(self.SCALE_FACTOR)
+        )
+
+        '''
+            Query streams of the throughput test run in persistent
+            worker processes, started on the first throughput test
         '''
-        self.SCALE_FACTOR = 1
-        self.NUM_STREAMS = 2
+        self.stream_workers = None
 
         '''
             Global configuration
         '''
         
-        self.REFRESH_FILES_PATH = config.DBGEN
+        # Refresh files generated for this database's scale factor
+        self.REFRESH_FILES_PATH = refresh_path or config.DBGEN
+
+        '''
+            Refresh sets are staged prestage_depth sets ahead by the
+            RefreshPipeline, created on first use
+        '''
+        self.prestage_depth = prestage_depth
+        self.refresh_pipeline = None
 
         '''
             Refresh stream sequence number (leave it at 1)
@@ -54,45 +96,43 @@ class Benchmark:
         self.refresh_stream_number = 1
 
         '''
-            Keeps track of refresh files order by storing sequence number in a .txt file
-            If the file does not exist, it will create and start from number 1
+            Refresh stream numbers are allocated to each test by the
+            RefreshAllocator (a ledger next to the refresh files, shared
+            with concurrent benchmarks), tagged with the evaluation label
         '''
+        self.refresh_allocator = None
+        self.evaluation = None
 
-    def __get_refresh_stream_number(self):
-        if os.path.exists("%s/refresh_stream_number.txt" % self.REFRESH_FILES_PATH):
-            with open("%s/refresh_stream_number.txt" % self.REFRESH_FILES_PATH, "r+") as f:
-                self.refresh_stream_number = int(f.read())
-        else:
-            with open("%s/refresh_stream_number.txt" % self.REFRESH_FILES_PATH, "w+") as f:
-                f.write("%d" % self.refresh_stream_number)
-
-    def __set_refresh_stream_number(self):
-        with open("%s/refresh_stream_number.txt" % self.REFRESH_FILES_PATH, "w+") as f:
-            f.write("%d" % self.refresh_stream_number)
-        logging.debug('Set refresh stream number {}'.format(self.refresh_stream_number))
+        '''
+            Plans of the query views, kept for the index configuration
+            they were explained for (plan cost and fingerprint share them)
+        '''
+        self.__plans = None
+
+    def __allocate_refresh_sets(self, n_sets):
+        if self.refresh_allocator is None:
+            self.refresh_allocator = RefreshAllocator(self.REFRESH_FILES_PATH)
+        self.refresh_stream_number = self.refresh_allocator.allocate(n_sets, self.evaluation)
+
+    def restore_refresh_stream_number(self, number):
+        # Never goes back, the sets consumed after a checkpoint
+        # may have been left half applied
+        if self.refresh_allocator is None:
+            self.refresh_allocator = RefreshAllocator(self.REFRESH_FILES_PATH)
+        self.refresh_allocator.skip_to(number)
+        self.refresh_stream_number = max(self.refresh_stream_number, number)
     '''
         Loads data from refresh files to temporary tables in the database
     '''
 
     def __load_refresh_stream_data(self):
-        # print("*** Load refresh stream number:", self.refresh_stream_number)
-
-        # STRINGS TO BE EXECUTED BY CURSOR
-        delete = "load data local infile '{}/delete.{}' into table rfdelete fields terminated by '|' " \
-                 "lines terminated by '\n';".format(self.REFRESH_FILES_PATH, self.refresh_stream_number)
-        orders = "load data local infile '{}/orders.tbl.u{}' into table orders_temp fields terminated by '|' " \
-                 "lines terminated by '\n';".format(self.REFRESH_FILES_PATH, self.refresh_stream_number)
-        lineitem = "load data local infile '{}/lineitem.tbl.u{}' into table lineitem_temp fields terminated by '|' " \
-                   "lines terminated by '\n';".format(self.REFRESH_FILES_PATH, self.refresh_stream_number)
-
-        # OPEN DB CONNECTION, EXECUTE LOADS AND CLOSE CONNECTION
-        conn = mysql.connector.connect(**self.DB_CONFIG)
-        mysql.connector.connect()
-        cursor = conn.cursor()
-        cursor.execute(delete)
-        cursor.execute(orders)
-        cursor.execute(lineitem)
-        conn.close()
+        if self.refresh_pipeline is None:
+            self.refresh_pipeline = RefreshPipeline(
+                self.pool, self.REFRESH_FILES_PATH, depth=self.prestage_depth
+            )
+
+        # SWAP THE STAGED SET IN (OR LOAD IT) AND STAGE THE NEXT ONES
+        self.refresh_pipeline.activate(self.refresh_stream_number)
 
         # INCREMENT REFRESH STREAM NUMBER FOR NEXT STREAM
         self.refresh_stream_number += 1
@@ -103,14 +143,14 @@ class Benchmark:
     '''
 
     def __insert_refresh_function(self):
-        # OPENS CONNECTION, EXECUTES PROCEDURE AND CLOSES CONNECTION
-        conn = mysql.connector.connect(**self.DB_CONFIG)
-        cursor = conn.cursor()
-        cursor.execute("SET PROFILING = 1")
-        cursor.callproc("INSERT_REFRESH_FUNCTION")
-        cursor.execute("SHOW PROFILES")
-        results = cursor.fetchall()
-        conn.close()
+        # ACQUIRES CONNECTION, EXECUTES PROCEDURE AND RELEASES CONNECTION
+        with self.pool.connection(["SET PROFILING = 1"]) as conn:
+            cursor = conn.cursor()
+            cursor.callproc("INSERT_REFRESH_FUNCTION")
+            cursor.execute("SHOW PROFILES")
+            results = cursor.fetchall()
+            conn.commit()
+            cursor.close()
 
         # SUM AND RETURN TOTAL EXECUTION TIME FROM FETCHED RESULTS
         duration = 0
@@ -119,14 +159,14 @@ class Benchmark:
         return duration
 
     def __delete_refresh_function(self):
-        # OPENS CONNECTION, EXECUTES PROCEDURE AND CLOSES CONNECTION
-        conn = mysql.connector.connect(**self.DB_CONFIG)
-        cursor = conn.cursor()
-        cursor.execute("SET PROFILING = 1")
-        cursor.callproc("DELETE_REFRESH_FUNCTION")
-        cursor.execute("SHOW PROFILES")
-        results = cursor.fetchall()
-        conn.close()
+        # ACQUIRES CONNECTION, EXECUTES PROCEDURE AND RELEASES CONNECTION
+        with self.pool.connection(["SET PROFILING = 1"]) as conn:
+            cursor = conn.cursor()
+            cursor.callproc("DELETE_REFRESH_FUNCTION")
+            cursor.execute("SHOW PROFILES")
+            results = cursor.fetchall()
+            conn.commit()
+            cursor.close()
 
         # SUM AND RETURN TOTAL EXECUTION TIME FROM FETCHED RESULTS
         duration = 0
@@ -139,181 +179,318 @@ class Benchmark:
     '''
 
     def __run_refresh_streams(self, results_queue):
+        begin = time.time()
         # LIST FOR STORING REFRESH FUNCTIONS DURATION
         refresh_streams_duration = []
 
         # RUNS A NUMBER OF REFRESH STREAMS ACCORDING TO SCALE FACTOR
-        for _ in range(self.NUM_STREAMS):
-            self.__load_refresh_stream_data()
-            refresh_streams_duration.append(self.__insert_refresh_function())
-            refresh_streams_duration.append(self.__delete_refresh_function())
-
-        # RETURNS TOTAL REFRESH STREAMS EXECUTION TIME
-        results_queue.put(refresh_streams_duration)
+        try:
+            for _ in range(self.NUM_STREAMS):
+                self.__load_refresh_stream_data()
+                refresh_streams_duration.append(self.__insert_refresh_function())
+                refresh_streams_duration.append(self.__delete_refresh_function())
+        except Exception as ex:
+            # The test waits for this thread, it must always answer
+            logger.exception('Refresh stream failed')
+            results_queue.put((None, repr(ex)))
+            return
+
+        # RETURNS THE REFRESH FUNCTIONS DURATIONS AND THE STREAM ELAPSED TIME
+        results_queue.put((refresh_streams_duration, time.time() - begin))
 
     '''
         Query stream called from power test and throughput test (NUM_STREAMS in parallel)
     '''
 
-    def __run_query_stream(self, results_queue):
-        # START DB CONNECTION
-        conn = mysql.connector.connect(**self.DB_CONFIG)
-        cursor = conn.cursor()
-
-        # SET PROFILING
-        cursor.execute("SET PROFILING_HISTORY_SIZE = 22")
-        cursor.execute("SET PROFILING = 1")
-
-        # CALL QUERY STREAM PROCEDURE
-        cursor.callproc("QUERY_STREAM")
-
-        # SHOW PROFILES
-        cursor.execute("SHOW PROFILES")
-
-        # TRANSFORM FETCHED PROFILES INTO DICT OF (QUERY NUM: DURATION)
-        profiles = dict()
-        for row in cursor.fetchall():
-            profiles[row[0]] = row[1]
-
-        # CLOSE DB CONNECTION
-        conn.close()
-
-        # RETURN PROFILES RESULT
-        results_queue.put(profiles)  # IF RUNNING IN A PROCESS
-        return profiles
+    def __run_bounded_queries(self, cursor):
+        '''
+            Runs the views of QUERY_STREAM one by one, stopping as soon as
+            the elapsed time exceeds the time budget (if any) or a query
+            exceeds max_query_time.
+            Returns the number of executed queries, whether it aborted
+            and whether the last one was interrupted.
+        '''
+        begin = time.time()
+        n_executed = 0
+        for query in self.QUERIES:
+            remaining = float('inf')
+            if self.time_budget is not None:
+                remaining = self.time_budget - (time.time() - begin)
+                if remaining <= 0:
+                    return n_executed, True, False
+            if self.max_query_time is not None:
+                remaining = min(remaining, self.max_query_time)
+            n_executed += 1
+            try:
+                cursor.execute(
+                    "SELECT /*+ MAX_EXECUTION_TIME(%d) */ * FROM %s"
+                    % (max(1, int(remaining * 1000)), query)
+                )
+                cursor.fetchall()
+            except driver_error() as ex:
+                if ex.errno != self.QUERY_TIMEOUT_ERRNO:
+                    raise
+                logger.info(f'Aborted the query stream at {query}, time limit exceeded')
+                return n_executed, True, True
+        return n_executed, False, False
+
+    def __run_stream(self, cursor, bounded=False):
+        # RUN THE QUERIES, QUERY BY QUERY IF THERE IS A TIME LIMIT
+        aborted, truncated = False, False
+        n_executed = len(self.QUERIES)
+        if bounded and (self.time_budget is not None or self.max_query_time is not None):
+            n_executed, aborted, truncated = self.__run_bounded_queries(cursor)
+        else:
+            # CALL QUERY STREAM PROCEDURE
+            cursor.callproc("QUERY_STREAM")
+
+        # SHOW PROFILES AND TRANSFORM THEM INTO DICT OF (Q1..Q22: DURATION),
+        # THE LAST PROFILED STATEMENTS ARE THE QUERIES OF THE STREAM
+        profiles = read_profiles(cursor, n_executed)
+        if truncated:
+            mark_truncated(profiles)
+        return profiles, aborted
+
+    def __run_query_stream(self, bounded=False):
+        # ACQUIRE DB CONNECTION WITH PROFILING SET
+        with self.pool.connection(self.PROFILING_SETUP) as conn:
+            cursor = conn.cursor()
+            profiles, aborted = self.__run_stream(cursor, bounded)
+            cursor.close()
+        return profiles, aborted
 
     def __run_power_test(self):
         logger.debug('Running power test')
-        # LOAD REFRESH STREAM DATA
+        # RESERVE AND LOAD REFRESH STREAM DATA
+        self.__allocate_refresh_sets(1)
         self.__load_refresh_stream_data()
 
         # INSERT REFRESH FUNCTION
         insert_refresh_profile = self.__insert_refresh_function()
 
         # RUN QUERY STREAM
-        query_stream_profiles = self.__run_query_stream(Queue())
+        query_stream_profiles, aborted = self.__run_query_stream(bounded=True)
         # print("*** Query stream duration:", sum(query_stream_profiles.values()))
 
         # DELETE REFRESH FUNCTION
         delete_refresh_profile = self.__delete_refresh_function()
 
         # CREATES LIST OF DUsRATIONS OF THE 22 QUERIES AND REFRESH FUNCTIONS
-        power_test_profiles = list(query_stream_profiles.values())
-        power_test_profiles.append(insert_refresh_profile)
-        power_test_profiles.append(delete_refresh_profile)
+        power_test_profiles = dict(query_stream_profiles)
+        power_test_profiles['RF1'] = float(insert_refresh_profile)
+        power_test_profiles['RF2'] = float(delete_refresh_profile)
 
         # CALCULATES GEOMETRIC MEAN
-        geo_mean = stats.gmean(power_test_profiles)
+        geo_mean = stats.gmean(list(power_test_profiles.values()))
         power = (3600 / geo_mean) * self.SCALE_FACTOR
 
-        # RETURN POWER@SIZE METRIC
-        return power
+        # RETURN POWER@SIZE METRIC, WHETHER THE STREAM WAS ABORTED
+        # AND THE DURATION OF EACH QUERY AND REFRESH FUNCTION
+        return power, aborted, power_test_profiles
 
     '''
-        Runs the whole throughput test, composed of # processes for # query streams and one process for # refresh streams
+        Runs the whole throughput test, composed of # query streams (in the stream workers) and one thread for # refresh streams
     '''
 
     def __run_throughput_test(self):
         logging.debug('Running throughput Test')
-        # DECLARING PROCESSES
+        # START THE QUERY STREAM WORKERS ONCE, THEY ARE REUSED AFTERWARDS
+        if self.stream_workers is None:
+            # No staging thread may be running while the workers fork
+            self.suspend_refresh_staging()
+            self.stream_workers = StreamWorkerPool(
+                conn_config=self.pool.conn_config,
+                n_workers=self.NUM_STREAMS,
+                session_setup=self.PROFILING_SETUP,
+                n_queries=len(self.QUERIES)
+            )
+
+        # The refresh stream is a thread, it shares the staged refresh
+        # sets and the refresh stream number with this process, and
+        # hands its result over through a thread-safe queue
         results_queue = Queue()
-        throughput_test_profiles = []
-        streams = []
-        for _ in range(self.NUM_STREAMS):
-            streams.append(Process(target=self.__run_query_stream, args=(results_queue,)))
-        streams.append(Process(target=self.__run_refresh_streams, args=(results_queue,)))
+        refresh_stream = threading.Thread(target=self.__run_refresh_streams, args=(results_queue,))
+        self.__allocate_refresh_sets(self.NUM_STREAMS)
 
         # START TIMING EXECUTION
         start_time = time.time()
 
-        # START PROCESSES
-        for p in streams:
-            p.start()
-
-        for p in streams:
-            throughput_test_profiles.append(results_queue.get())
-
-        # JOIN PROCESSES
-        for p in streams:
-            p.join()
+        # START STREAMS
+        self.stream_workers.start()
+        refresh_stream.start()
+
+        # WAIT FOR ALL OF THEM
+        try:
+            query_streams = self.stream_workers.wait()
+        except RuntimeError:
+            # Fresh workers are started by the next throughput test
+            self.stream_workers.close()
+            self.stream_workers = None
+            raise
+        finally:
+            refresh_durations, refresh_time = results_queue.get()
+            refresh_stream.join()
+        if refresh_durations is None:
+            raise RuntimeError(f'Throughput test refresh stream failed: {refresh_time}')
 
         # FINISH TIMING EXECUTION
         elapsed_time = time.time() - start_time
 
-        return ((2 * 22) / elapsed_time) * 3600 * self.SCALE_FACTOR
-    
+        timings = {'throughput_time': elapsed_time, 'refresh_stream_time': refresh_time}
+        for k, (_, stream_time) in enumerate(query_streams, 1):
+            timings['stream%d_time' % k] = stream_time
+
+        throughput = ((self.NUM_STREAMS * 22) / elapsed_time) * 3600 * self.SCALE_FACTOR
+        return throughput, timings
+
+    def suspend_refresh_staging(self):
+        # Called before forking, the next refresh set restarts the staging
+        if self.refresh_pipeline is not None:
+            self.refresh_pipeline.suspend()
+
+    def close(self):
+        # Stops the background workers
+        if self.stream_workers is not None:
+            self.stream_workers.close()
+            self.stream_workers = None
+        if self.refresh_pipeline is not None:
+            self.refresh_pipeline.close()
+            self.refresh_pipeline = None
+
+    def run_unmeasured_stream(self):
+        # Warm-up query stream, only fills the buffer pool
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.callproc("QUERY_STREAM")
+            cursor.close()
+
+    def prepare_cache(self, state):
+        '''
+            Brings the buffer pool to the given state before a measurement:
+            keep (as it is), warm (after a query stream) or cold
+        '''
+        if state == 'warm':
+            self.run_unmeasured_stream()
+        elif state == 'cold':
+            if not config.COLD_CACHE_COMMAND:
+                # FLUSH TABLES alone leaves the buffer pool warm
+                raise ValueError('The cold cache state needs config.COLD_CACHE_COMMAND')
+            # e.g. restarts the server, the pool reconnects on acquire
+            subprocess.run(config.COLD_CACHE_COMMAND, shell=True, check=True)
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("FLUSH TABLES")
+                cursor.close()
+
     def get_cost(self):
         raise NotImplementedError('Not implemented yet.')
 
+    def explain_queries(self):
+        '''
+            Optimizer plans of the query stream views, {'Q1': plan, ...},
+            without executing them
+        '''
+        state = self.db.current_vector.tobytes()
+        if self.__plans is not None and self.__plans[0] == state:
+            return self.__plans[1]
+
+        plans = dict()
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            for k, query in enumerate(self.QUERIES, 1):
+                cursor.execute("EXPLAIN FORMAT=JSON SELECT * FROM %s" % query)
+                plans['Q%d' % k] = parse_plan(cursor.fetchall())
+            cursor.close()
+        self.__plans = (state, plans)
+        return plans
+
+    def get_plan_fingerprint(self):
+        # Same fingerprint, same plans for every query of the stream
+        return fingerprint(self.explain_queries())
+
+    def get_plan_cost(self):
+        '''
+            Sum of the optimizer's query_cost over the query stream,
+            a cheap proxy of its runtime
+        '''
+        logging.debug('Getting plan costs')
+        costs = {
+            f'{query}_cost': query_cost(plan)
+            for query, plan in self.explain_queries().items()
+        }
+        metrics = {'plan_cost': float(sum(costs.values()))}
+        metrics.update(costs)
+        return metrics
+
     def get_runtime(self):
         logging.debug('Getting workload runtime')
-        # START DB CONNECTION
-        conn = mysql.connector.connect(**self.DB_CONFIG)
-        cursor = conn.cursor()
-
-        # SET PROFILING
-        cursor.execute("SET PROFILING_HISTORY_SIZE = 22")
-        cursor.execute("SET PROFILING = 1")
+        # ACQUIRE DB CONNECTION WITH PROFILING SET
+        with self.pool.connection(self.PROFILING_SETUP) as conn:
+            cursor = conn.cursor()
 
-        # CALL QUERY STREAM PROCEDURE
-        cursor.callproc("QUERY_STREAM")
+            # RUN THE QUERY STREAM AND FETCH ITS PROFILES
+            profiles, aborted = self.__run_stream(cursor, bounded=True)
 
-        # SHOW PROFILES
-        cursor.execute("SHOW PROFILES")
+            cursor.close()
 
-        # TRANSFORM FETCHED PROFILES INTO DICT OF (QUERY NUM: DURATION)
-        # profiles = dict()
-        v = []
-        for row in cursor.fetchall():
-            # profiles[row[0]] = row[1]
-            v.append(row[1])        
+        result = np.sum(list(profiles.values()))
 
-        result = np.sum(v)
+        # RETURN TOTAL AND PER-QUERY PROFILES RESULT, THE LATTER PREFIXED
+        # SO THEY NEVER MIX WITH THOSE OF THE POWER TEST (Q1..Q22)
+        metrics = {'time': result, 'aborted': int(aborted)}
+        metrics.update({f'stream_{query}': value for query, value in profiles.items()})
+        return metrics
 
-        # CLOSE DB CONNECTION
-        conn.close()
-
-        # RETURN PROFILES RESULT
-        return {'time': result}
+    def get_index_sizes(self):
+        '''
+            Updates the statistics and returns the data size and the size
+            of each visible secondary index as {(table, index name): MB}
+        '''
+        logging.debug('Getting index sizes')
+        # ACQUIRE DB CONNECTION
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+
+            # UPDATE STATISTICS
+            operations = [
+                'ANALYZE TABLE region;', 
+                'ANALYZE TABLE nation;',
+                'ANALYZE TABLE customer;',
+                'ANALYZE TABLE orders;',                 
+                'ANALYZE TABLE part;',
+                'ANALYZE TABLE supplier;',
+                'ANALYZE TABLE lineitem;',
+                'ANALYZE TABLE partsupp;',
+            ]
+                    
+            for operation in operations:
+                cursor.execute(operation)
+                cursor.fetchall()
+            
+            # SIZE OF EACH SECONDARY INDEX
+            cursor.execute("SELECT table_name, index_name, sum(round(stat_value*@@innodb_page_size/1024/1024, 2)) size_in_mb FROM mysql.innodb_index_stats WHERE stat_name = 'size' AND index_name != 'PRIMARY' and database_name=DATABASE() GROUP BY table_name, index_name;")
+            # Hidden indexes (visibility strategy) take space but are not used
+            invisible = self.db.get_invisible_indexes()
+            index_sizes = {
+                (table, index): float(size) for table, index, size in cursor.fetchall()
+                if (table, index) not in invisible
+            }
+            logging.debug(f'Index sizes: {index_sizes}')
+
+            cursor.execute("SELECT sum(DATA_LENGTH)/1024/1024 from information_schema.tables where table_schema = DATABASE();")
+            data_size = float(np.array(list(cursor.fetchall())).sum())
+            logging.debug(f'Database size: {data_size}')
+            
+            cursor.close()
+
+        return data_size, index_sizes
 
     def get_storage_size(self):
         logging.debug('Getting storage size')
-        # START DB CONNECTION
-        conn = mysql.connector.connect(**self.DB_CONFIG)
-        cursor = conn.cursor()
-
-        # UPDATE STATISTICS
-        operations = [
-            'ANALYZE TABLE region;', 
-            'ANALYZE TABLE nation;',
-            'ANALYZE TABLE customer;',
-            'ANALYZE TABLE orders;',                 
-            'ANALYZE TABLE part;',
-            'ANALYZE TABLE supplier;',
-            'ANALYZE TABLE lineitem;',
-            'ANALYZE TABLE partsupp;',
-        ]
-                
-        for operation in operations:
-            cursor.execute(operation)
-            cursor.fetchall()
-        
-        # VERIFY THE DATABASE SIZE FOR ALL TABLES
-        # cursor.execute("SHOW TABLE STATUS WHERE Row_format LIKE 'Dynamic'")
-        cursor.execute("SELECT sum(round(stat_value*@@innodb_page_size/1024/1024, 2)) size_in_mb FROM mysql.innodb_index_stats WHERE stat_name = 'size' AND index_name != 'PRIMARY' and database_name='tpch';")
-        index_size = float(np.array(list(cursor.fetchall())).sum())
-        logging.debug(f'Database size: {index_size}')
-
-        cursor.execute("SELECT sum(DATA_LENGTH)/1024/1024 from information_schema.tables where table_schema = 'tpch';")
-        data_size = float(np.array(list(cursor.fetchall())).sum())
-        logging.debug(f'Database size: {data_size}')
-        # TRANSFORM FETCHED QUERY INTO DICT OF (TABLE: SIZE) AND A LIST SUM OF SIZES
-        
-        conn.close()
-
+        data_size, index_sizes = self.get_index_sizes()
         return {
             'data_size': data_size, 
-            'index_size': index_size
+            'index_size': float(sum(index_sizes.values()))
         }
 
     def get_qphh(self):
@@ -326,31 +503,36 @@ class Benchmark:
         from timeit import default_timer as dt
         begin = dt()
         logging.debug('Run QPHH benchmark')
-        # READ LAST REFRESH STREAM NUMBER
-        self.__get_refresh_stream_number()
-
-        power = self.__run_power_test()
+        power, aborted, profiles = self.__run_power_test()
 
-        throughput = self.__run_throughput_test()
-        
-        logging.debug('Calculating qphh')
-        qphh = np.sqrt(power * throughput)
-                
-        self.refresh_stream_number += self.NUM_STREAMS
+        stream_timings = dict()
+        if aborted:
+            # Hopeless configuration, skip the throughput test
+            throughput, qphh = 0., 0.
+        else:
+            throughput, stream_timings = self.__run_throughput_test()
+            
+            logging.debug('Calculating qphh')
+            qphh = np.sqrt(power * throughput)
 
-        # WRITE LAST REFRESH STREAM NUMBER
-        self.__set_refresh_stream_number()
-        
         # Record time required to run the whole benchmark
         end = dt()
         benchmark_time = end-begin
 
-        return {
+        metrics = {
             'power': power, 
             'throughput': throughput, 
             'qphh': qphh, 
-            'benchmark_time': benchmark_time
+            # Query stream of the power test, no need to run another one
+            'time': float(sum(profiles[query] for query in profiles if query.startswith('Q'))),
+            'benchmark_time': benchmark_time,
+            'aborted': int(aborted)
         }
+        # Per-query latencies of the power test
+        metrics.update(profiles)
+        # Elapsed time of each stream of the throughput test
+        metrics.update(stream_timings)
+        return metrics
 
 
 if __name__ == '__main__':
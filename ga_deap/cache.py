@@ -0,0 +1,254 @@
+import json
+import logging
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+import utils
+from history import History, read_records
+
+logger = logging.getLogger(__name__)
+
+
+def pack_individual(individual):
+    '''
+        Packs a binary individual into a compact hashable string
+        e.g. [0, 1, 1, 0, ...] -> '14:6000'
+    '''
+    bits = np.asarray(individual, dtype=np.float64).astype(np.uint8)
+    return f'{len(bits)}:{np.packbits(bits).tobytes().hex()}'
+
+
+def settings_key(settings):
+    '''
+        Measurement settings as part of a cache key, so metrics measured
+        under other settings never match
+        e.g. {'scale_factor': 1, 'repetitions': 3} -> 'repetitions=3,scale_factor=1'
+    '''
+    return ','.join(f'{name}={value}' for name, value in sorted((settings or {}).items()))
+
+
+class EvaluationCache:
+    '''
+        Caches the benchmark metrics of already evaluated individuals,
+        so that duplicated genomes never touch the database again.
+
+        Entries are kept in an in-memory LRU and appended to a
+        json-lines file on disk (one entry per line), which is indexed
+        by file offset so evicted entries can still be recovered.
+
+        Only complete measurements are kept: aborted ones, or those
+        lacking one of the required metrics (e.g. of an individual the
+        proxy did not promote) are never stored, and are skipped if
+        found on disk.
+    '''
+
+    def __init__(self, fitness_name, path=None,
+                 file_name='eval_cache.jsonl', max_size=1024, required=(),
+                 settings=None):
+        self.fitness_name = fitness_name
+        # Settings the metrics depend on (scale factor, streams, ...)
+        self.settings = settings_key(settings)
+        # Metrics the fitness is computed from
+        self.required = list(required)
+        self.max_size = max_size
+        self.memory = OrderedDict()
+        # Maps cache keys to their line offset in the disk store
+        self.offsets = dict()
+        self.hits = 0
+        self.misses = 0
+
+        self.filepath = None
+        if path is not None:
+            utils.ensure_dir(path)
+            self.filepath = os.path.join(path, file_name)
+            self.load()
+            logger.info(f'Evaluation cache stored at {self.filepath}')
+
+    def key(self, individual):
+        if self.settings:
+            return f'{self.fitness_name}/{self.settings}/{pack_individual(individual)}'
+        return f'{self.fitness_name}/{pack_individual(individual)}'
+
+    def __len__(self):
+        return len(self.offsets) if self.filepath else len(self.memory)
+
+    def __contains__(self, individual):
+        key = self.key(individual)
+        return key in self.memory or key in self.offsets
+
+    def is_complete(self, metrics):
+        if metrics.get('promoted') == 0:
+            # Only the proxy metrics were measured
+            return False
+        if metrics.get('aborted'):
+            # Cut short by the time limits of the moment
+            return False
+        return all(metric in metrics for metric in self.required)
+
+    def load(self):
+        if not os.path.exists(self.filepath):
+            return
+        with open(self.filepath, 'r') as f:
+            offset = f.tell()
+            line = f.readline()
+            while line:
+                entry = json.loads(line)
+                if self.is_complete(entry['metrics']):
+                    self.offsets[entry['key']] = offset
+                offset = f.tell()
+                line = f.readline()
+        logger.info(f'Loaded {len(self.offsets)} cached evaluations')
+
+    def __read_disk(self, key):
+        if self.filepath is None or key not in self.offsets:
+            return None
+        with open(self.filepath, 'r') as f:
+            f.seek(self.offsets[key])
+            return json.loads(f.readline())['metrics']
+
+    def __write_disk(self, key, metrics):
+        if self.filepath is None:
+            return
+        with open(self.filepath, 'a') as f:
+            self.offsets[key] = f.tell()
+            f.write(json.dumps({'key': key, 'metrics': metrics}) + '\n')
+
+    def __remember(self, key, metrics):
+        self.memory[key] = metrics
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_size:
+            self.memory.popitem(last=False)
+
+    def get(self, individual):
+        key = self.key(individual)
+        metrics = self.memory.get(key)
+        if metrics is None:
+            metrics = self.__read_disk(key)
+        if metrics is None or not self.is_complete(metrics):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.__remember(key, metrics)
+        logger.debug(f'Cache hit for {key}')
+        # Callers add the fitness to the returned dict
+        return dict(metrics)
+
+    def put(self, individual, metrics):
+        if not self.is_complete(metrics):
+            return
+        key = self.key(individual)
+        # Fitness depends on the baseline, so only raw metrics are kept
+        metrics = {
+            metric: float(value) for metric, value in metrics.items()
+            if metric != 'fitness'
+        }
+        if key not in self.offsets:
+            self.__write_disk(key, metrics)
+        self.__remember(key, metrics)
+
+    def warm_start(self, history_path):
+        '''
+            Fills the cache with the individuals recorded by an earlier
+            run (its history.json export or its history.bin store), if it
+            was measured with the same settings. The export does not hold
+            them, it is assumed to be.
+        '''
+        if history_path.endswith('.json'):
+            logger.warning(f'{history_path} holds no measurement settings, assuming they are the current ones')
+        else:
+            settings = History.read(history_path).settings
+            if settings is not None and settings_key(settings) != self.settings:
+                logger.warning(
+                    f'Not warm-starting from {history_path}, '
+                    f'measured with other settings ({settings_key(settings)})'
+                )
+                return 0
+        n_loaded = 0
+        for individual, metrics in read_records(history_path):
+            if self.is_complete(metrics):
+                self.put(individual, metrics)
+                n_loaded += 1
+        logger.info(f'Warm-started cache with {n_loaded} evaluations from {history_path}')
+        return n_loaded
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.,
+            'size': len(self),
+        }
+
+
+class PlanCache:
+    '''
+        Runtime metrics of the configurations measured so far, keyed by
+        the fingerprint of their query plans (see explain.fingerprint).
+        A configuration leaving every plan as in a measured one (e.g. an
+        extra index the optimizer never picks) reuses its metrics instead
+        of running the benchmark again, only the storage is measured.
+
+        The refresh functions maintain the indexes of the tables they
+        modify whatever the plans, so the fingerprints of the power and
+        throughput tests also hold those indexes (see Objective.plan_key).
+        Entries are appended to plan_cache.jsonl and reloaded on start,
+        keyed by the measurement settings too (see EvaluationCache).
+    '''
+
+    def __init__(self, path=None, file_name='plan_cache.jsonl', settings=None):
+        self.settings = settings_key(settings)
+        self.entries = dict()
+        self.hits = 0
+        self.misses = 0
+
+        self.filepath = None
+        if path is not None:
+            utils.ensure_dir(path)
+            self.filepath = os.path.join(path, file_name)
+            self.load()
+
+    def key(self, fingerprint, measurements):
+        # Entries only hold the metrics of the measurements that made them
+        key = f'{"+".join(sorted(measurements))}/{fingerprint}'
+        return f'{self.settings}/{key}' if self.settings else key
+
+    def __len__(self):
+        return len(self.entries)
+
+    def load(self):
+        if not os.path.exists(self.filepath):
+            return
+        with open(self.filepath, 'r') as f:
+            for line in f:
+                entry = json.loads(line)
+                self.entries[entry['key']] = entry['metrics']
+        logger.info(f'Loaded {len(self.entries)} query plan fingerprints')
+
+    def get(self, fingerprint, measurements):
+        metrics = self.entries.get(self.key(fingerprint, measurements))
+        if metrics is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return dict(metrics)
+
+    def put(self, fingerprint, measurements, metrics):
+        key = self.key(fingerprint, measurements)
+        if key in self.entries:
+            return
+        metrics = {metric: float(value) for metric, value in metrics.items()}
+        self.entries[key] = metrics
+        if self.filepath is not None:
+            with open(self.filepath, 'a') as f:
+                f.write(json.dumps({'key': key, 'metrics': metrics}) + '\n')
+
+    def stats(self):
+        return {
+            'benchmarks_avoided': self.hits,
+            'benchmarks_run': self.misses,
+            'plans': len(self),
+        }
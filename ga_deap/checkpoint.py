@@ -0,0 +1,82 @@
+import logging
+import os
+import pickle
+import random
+
+import numpy as np
+
+import utils
+
+logger = logging.getLogger(__name__)
+
+
+class Checkpoint:
+    '''
+        Periodic snapshot of a training run, so it can be resumed exactly
+        where it stopped: population with fitnesses, generation counter,
+        random/numpy RNG states, history position, refresh stream counter
+        and the objective state (baseline metrics, time budget).
+
+        Individuals are pickled, so the DEAP creator classes must exist
+        before a checkpoint is loaded.
+    '''
+
+    def __init__(self, path, file_name='checkpoint.pkl', frequency=1):
+        utils.ensure_dir(path)
+        self.filepath = os.path.join(path, file_name)
+        # Number of generations between checkpoints
+        self.frequency = frequency
+
+    def exists(self):
+        return os.path.exists(self.filepath)
+
+    def save(self, population, generation, history, objective, extra=None):
+        state = {
+            'population': population,
+            'generation': generation,
+            'random_state': random.getstate(),
+            'numpy_state': np.random.get_state(),
+            'history_records': len(history),
+            'history_generation': history.generation,
+            'refresh_stream_number': objective.benchmark.refresh_stream_number,
+            'baseline_metrics': objective.baseline_metrics,
+            'best_time': objective.best_time,
+            'worst_fitness': objective.worst_fitness,
+            'best_fitness': objective.best_fitness,
+            'extra': extra or {},
+        }
+        history.serialize()
+        # Written aside and renamed, a crash never leaves a broken checkpoint
+        tmp_path = self.filepath + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(state, f)
+        os.replace(tmp_path, self.filepath)
+        logger.info(f'Saved checkpoint of generation {generation} to {self.filepath}')
+
+    def maybe_save(self, population, generation, history, objective, extra=None):
+        if generation % self.frequency == 0:
+            self.save(population, generation, history, objective, extra)
+
+    def load(self, history, objective):
+        '''
+            Restores the run state and returns (population, generation, extra)
+        '''
+        with open(self.filepath, 'rb') as f:
+            state = pickle.load(f)
+
+        random.setstate(state['random_state'])
+        np.random.set_state(state['numpy_state'])
+
+        # Evaluations recorded after the checkpoint will be redone
+        history.truncate(state['history_records'])
+        history.generation = state['history_generation']
+
+        objective.baseline_metrics = state['baseline_metrics']
+        objective.worst_fitness = state['worst_fitness']
+        objective.best_fitness = state.get('best_fitness')
+        if state['best_time'] is not None:
+            objective.update_time_budget({'time': state['best_time']})
+        objective.benchmark.restore_refresh_stream_number(state['refresh_stream_number'])
+
+        logger.info(f'Resuming from generation {state["generation"]} of {self.filepath}')
+        return state['population'], state['generation'], state['extra']
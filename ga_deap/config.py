@@ -10,3 +10,21 @@ UID = 'root'
 PWD = 'sudoadmin'
 
 DBGEN = '../dbgen/'
+
+# Replicas of the database used to evaluate individuals in parallel,
+# e.g. [{'host': '127.0.0.1', 'port': 3307}, {'host': '127.0.0.1', 'port': 3308}]
+REPLICAS = []
+
+# Shell command run before cold-cache measurements (see MeasurementPolicy),
+# e.g. 'sudo systemctl restart mysql && sync && echo 3 | sudo tee /proc/sys/vm/drop_caches'
+COLD_CACHE_COMMAND = None
+
+# TPC-H scale factor of the database and number of query streams of the
+# throughput test (None uses the minimum for the scale factor)
+SCALE_FACTOR = 1
+NUM_STREAMS = None
+
+# Down-scaled copies of the database for multi-fidelity evaluation, each
+# in its own schema with the refresh files of its scale factor, e.g.
+# [{'scale_factor': 0.1, 'database': 'tpch_sf0_1', 'dbgen': '../dbgen_sf0_1/'}]
+FIDELITIES = []
@@ -0,0 +1,120 @@
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+def driver_error():
+    '''
+        mysql.connector.Error for except clauses, imported when an
+        exception is raised so the simulated backend runs without the
+        MySQL driver (nothing can come from it then)
+    '''
+    try:
+        from mysql.connector import Error
+    except ImportError:
+        return ()
+    return Error
+
+
+class ConnectionPool:
+    '''
+        Pool of MySQL connections shared by Database and Benchmark.
+
+        Every acquired connection is health-checked (ping with reconnect)
+        and gets the session setup statements executed, since the pool
+        resets the session whenever a connection is given back.
+        The pool is rebuilt lazily in forked processes, so child processes
+        (e.g. throughput streams) never share sockets with their parent.
+    '''
+
+    # MySQLConnectionPool does not allow more connections than this
+    MAX_SIZE = 32
+
+    def __init__(self, conn_config, size=4, name='ga_deap',
+                 session_setup=(), acquire_timeout=60., health_check=True):
+        self.conn_config = dict(conn_config)
+        self.size = min(size, self.MAX_SIZE)
+        self.name = name
+        self.session_setup = list(session_setup)
+        self.acquire_timeout = acquire_timeout
+        self.health_check = health_check
+
+        # Connection acquisition latency since the last consume_metrics()
+        self.acquire_time = 0.
+        self.n_acquired = 0
+
+        self.__pool = None
+        self.__pid = None
+
+    def __getstate__(self):
+        # Connections cannot be pickled, processes build their own pool
+        state = self.__dict__.copy()
+        state['_ConnectionPool__pool'] = None
+        state['_ConnectionPool__pid'] = None
+        return state
+
+    def __get_pool(self):
+        if self.__pool is None or self.__pid != os.getpid():
+            # Imported here, only a real server needs the driver
+            from mysql.connector.pooling import MySQLConnectionPool
+            self.__pid = os.getpid()
+            self.__pool = MySQLConnectionPool(
+                pool_name=f'{self.name}_{self.__pid}',
+                pool_size=self.size,
+                **self.conn_config
+            )
+            logger.debug(f'Created connection pool {self.name} with {self.size} connections')
+        return self.__pool
+
+    def acquire(self, setup=()):
+        from mysql.connector import errors
+
+        begin = time.time()
+        pool = self.__get_pool()
+        while True:
+            try:
+                conn = pool.get_connection()
+                break
+            except errors.PoolError:
+                # Every connection is in use, wait for one to be released
+                if time.time() - begin > self.acquire_timeout:
+                    raise
+                time.sleep(0.05)
+
+        if self.health_check:
+            conn.ping(reconnect=True, attempts=3, delay=1)
+        # Waiting time only, the session setup below is not part of it
+        self.acquire_time += time.time() - begin
+        self.n_acquired += 1
+
+        cursor = conn.cursor()
+        for statement in self.session_setup + list(setup):
+            cursor.execute(statement)
+        cursor.close()
+        return conn
+
+    @contextmanager
+    def connection(self, setup=()):
+        '''
+            with pool.connection(['SET PROFILING = 1']) as conn:
+                cursor = conn.cursor()
+        '''
+        conn = self.acquire(setup)
+        try:
+            yield conn
+        finally:
+            # Gives the connection back to the pool
+            conn.close()
+
+    def consume_metrics(self):
+        metrics = {
+            'conn_acquire_time': self.acquire_time,
+            'conn_acquire_count': self.n_acquired,
+        }
+        self.acquire_time = 0.
+        self.n_acquired = 0
+        return metrics
+
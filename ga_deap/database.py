@@ -1,22 +1,33 @@
 import sys 
-import pyodbc
-import mysql.connector
-from mysql.connector.pooling import MySQLConnectionPool
 import os
+import time
 import utils
 import numpy as np
-import copy
 import logging
+from connection import driver_error
 
 logger = logging.getLogger(__name__)
 
-pyodbc.pooling = None
-
 
 class Database:    
 
-    def __init__(self, connection_string, reset_indexes=True):
+    def __init__(self, pool, reset_indexes=True,
+                 alter_algorithm=None, alter_lock=None, apply_strategy='ddl'):
         
+        # How states are applied:
+        #   ddl: idx_ indexes are built and dropped by ALTER TABLE
+        #   visibility: all the idx_ indexes are built once and switched
+        #   with ALTER INDEX ... VISIBLE/INVISIBLE (MySQL 8, metadata only)
+        if apply_strategy not in ('ddl', 'visibility'):
+            raise ValueError(f'Unknown apply strategy {apply_strategy}')
+        self.apply_strategy = apply_strategy
+        # Optional ALGORITHM and LOCK clauses of the ALTER TABLE statements
+        # (e.g. INPLACE and NONE), None leaves the server defaults
+        self.alter_algorithm = alter_algorithm
+        self.alter_lock = alter_lock
+        # Average seconds to build or drop one index, per table
+        self.build_cost = dict()
+
         # Columns with PK and FK
         self.keys = {
             'customer': ['c_custkey', 'c_nationkey'],
@@ -43,15 +54,29 @@ class Database:
             'supplier': ['s_name', 's_address', 's_phone', 's_acctbal']
         }                    
 
-        self.connection_string = connection_string
+        # ConnectionPool shared with the Benchmark
+        self.pool = pool
+        # Cached index map, see get_catalog()
+        self.__catalog = None
+        # (table, index name) of the invisible indexes, read with the catalog
+        self.__invisible = set()
         self.flat_state = self.get_column_list()        
         self.state_size = len(self.flat_state)
+        # Position of each optimized column in the individual vector
+        self.column_position = {
+            column: k for k, column in enumerate(self.flat_state)
+        }
         self.initial_state = self.get_current_state()
         logger.debug(f'Initial State: {self.initial_state}')
         logger.debug(f'Current state size: {self.state_size}')
 
         if reset_indexes:
             self.reset_indexes()            
+        else:
+            if apply_strategy == 'visibility':
+                self.build_hidden_indexes()
+            # Bitvector of the idx_ indexes currently built in the database
+            self.current_vector = self.get_materialized_vector()
     
     def get_column_list(self):
         flat_columns = []
@@ -71,52 +96,95 @@ class Database:
         return vector
 
     def vector_to_state(self, vector):
+        # Only the optimized columns are needed to apply a state
         k = 0
-        state = copy.deepcopy(self.initial_state)
+        state = dict()
         for table, columns in sorted(self.tables.items()):
+            state[table] = dict()
             for j, column in enumerate(columns):
                 state[table][column] = vector[k]
                 k += 1
 
         return state
 
+    def get_catalog(self):
+        '''
+            Snapshot of {table: {column: set of index names}} for all
+            TPC-H tables, read in a single round trip and cached until
+            the Database issues DDL. Invisible indexes are listed too,
+            see get_invisible_indexes()
+        '''
+        if self.__catalog is not None:
+            return self.__catalog
+
+        tables = sorted(self.tables.keys())
+        # IS_VISIBLE only exists from MySQL 8 on
+        visible = 's.IS_VISIBLE' if self.apply_strategy == 'visibility' else "'YES'"
+        query = (
+            'SELECT c.TABLE_NAME, c.COLUMN_NAME, s.INDEX_NAME, %s '
+            'FROM information_schema.COLUMNS c '
+            'LEFT JOIN information_schema.STATISTICS s '
+            'ON s.TABLE_SCHEMA = c.TABLE_SCHEMA '
+            'AND s.TABLE_NAME = c.TABLE_NAME '
+            'AND s.COLUMN_NAME = c.COLUMN_NAME '
+            'WHERE c.TABLE_SCHEMA = DATABASE() '
+            'AND c.TABLE_NAME IN (%s) '
+            'ORDER BY c.TABLE_NAME, c.ORDINAL_POSITION;'
+        ) % (visible, ', '.join(['%s'] * len(tables)))
+
+        catalog = {table: dict() for table in tables}
+        invisible = set()
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, tables)
+            for table, column, index, is_visible in cursor.fetchall():
+                indexes = catalog[table].setdefault(column, set())
+                if index is not None:
+                    indexes.add(index)
+                    if is_visible == 'NO':
+                        invisible.add((table, index))
+            cursor.close()
+
+        self.__catalog = catalog
+        self.__invisible = invisible
+        return catalog
+
+    def invalidate_catalog(self):
+        self.__catalog = None
+
+    def get_invisible_indexes(self):
+        '''
+            (table, index name) of the indexes the optimizer ignores
+        '''
+        if self.apply_strategy != 'visibility':
+            return set()
+        self.get_catalog()
+        return self.__invisible
+
     def get_table_indexed_columns(self, table):
-        self.conn = pyodbc.connect(self.connection_string)
-        self.cur = self.conn.cursor()
-        self.cur.execute('SHOW INDEXES FROM %s;' % table)
         table_indexes = list()
-        for index in self.cur.fetchall():
-            table_indexes.append(index[4])
-        self.conn.commit()
-        self.cur.close()
-        self.conn.close()
+        for column, indexes in self.get_catalog()[table].items():
+            # One entry per index covering the column
+            table_indexes += [column] * len(indexes)
         return sorted(table_indexes)
 
     def get_table_columns(self, table):
-        self.conn = pyodbc.connect(self.connection_string)
-        self.cur = self.conn.cursor()
-        self.cur.execute('SHOW COLUMNS FROM %s;' % table)
         table_columns = list()
-        for row in self.cur.fetchall():
-            if row[0] not in self.tables:
-                table_columns.append(row[0])
-        self.conn.commit()
-        self.cur.close()
-        self.conn.close()
+        for column in self.get_catalog()[table]:
+            if column not in self.tables:
+                table_columns.append(column)
         return sorted(table_columns)
 
     # USE THIS FUNCTION FOR ALL TABLES OF TPC-H
     def get_current_state(self):
+        # Invisible indexes are built but not used, so they do not count
+        invisible = self.get_invisible_indexes()
         indexes_map = dict()
-        for table in self.tables.keys():
+        for table, columns in self.get_catalog().items():
             indexes_map[table] = dict()
-            indexed_columns = self.get_table_indexed_columns(table)
-            table_columns = self.get_table_columns(table)
-            for column in table_columns:
-                indexes_map[table][column] = 0
-                for index in indexed_columns:
-                    if column == index:
-                        indexes_map[table][column] = 1
+            for column, indexes in columns.items():
+                visible = [index for index in indexes if (table, index) not in invisible]
+                indexes_map[table][column] = 1 if visible else 0
 
         return indexes_map
     
@@ -124,19 +192,25 @@ class Database:
         state = self.get_current_state()
         return self.state_to_vector(state)
 
+    def get_materialized_vector(self):
+        '''
+            Bitvector of the optimized columns that have a visible idx_
+            index. Unlike get_current_state_vector, columns covered only by
+            PK/FK indexes are reported as 0, since they have no idx_ to drop.
+        '''
+        vector = np.zeros(self.state_size, dtype=np.int8)
+        catalog = self.get_catalog()
+        invisible = self.get_invisible_indexes()
+        for table, columns in self.tables.items():
+            for column in columns:
+                if f'idx_{column}' in catalog[table].get(column, ()) \
+                        and (table, f'idx_{column}') not in invisible:
+                    vector[self.column_position[f'{table}.{column}']] = 1
+        return vector
+
     # RETURN COLUMNS OF SOME TABLE
     def get_columns(self, table):
-        columns = list()
-        self.conn = pyodbc.connect(self.connection_string)
-        self.cur = self.conn.cursor()
-        self.cur.execute('SHOW COLUMNS FROM %s;' % table)
-        for row in self.cur.fetchall():
-            # if row[0] not in self.lineitem:
-            columns.append(row[0])
-        self.conn.commit()
-        self.cur.close()
-        self.conn.close()
-        return columns
+        return list(self.get_catalog()[table].keys())
 
     # RETURN LIST OF THE COLUMNS OF ALL TABLES
     def get_list_columns(self):
@@ -149,35 +223,40 @@ class Database:
                 columns.append(column)
         return columns    
 
-    def drop_index(self, column, table):
+    def __execute_ddl(self, command, cursor=None):
+        self.invalidate_catalog()
+        # Reuses the caller's cursor when applying a batch of changes
+        if cursor is not None:
+            cursor.execute(command)
+            return
+        with self.pool.connection() as conn:
+            cur = conn.cursor()
+            cur.execute(command)
+            conn.commit()
+            cur.close()
+
+    def drop_index(self, column, table, cursor=None):
         command = ("DROP INDEX idx_%s ON %s;" % (column, table))
         logger.debug(command)
 
         try:
-            self.conn = pyodbc.connect(self.connection_string)
-            self.cur = self.conn.cursor()
-            self.cur.execute(command)
-            self.conn.commit()
-            self.cur.close()
-            self.conn.close()
-
-        except pyodbc.Error as ex:
-            logger.debug("Didn't drop index on %s, error %s" % (column, ex))
+            self.__execute_ddl(command, cursor)
+            return True
+        except driver_error() as ex:
+            logger.warning("Didn't drop index on %s, error %s" % (column, ex))
+            return False
 
-    def create_index(self, column, table):
+    def create_index(self, column, table, cursor=None):
         command = "CREATE INDEX idx_%s ON %s (%s);" % (column, table, column)
         logger.debug(command)
 
         try:
-            self.conn = pyodbc.connect(self.connection_string)
-            self.cur = self.conn.cursor()
-            self.cur.execute(command)
-            self.conn.commit()
-            self.cur.close()
-            self.conn.close()
+            self.__execute_ddl(command, cursor)
             logger.debug('Created index on (%s) %s' % (table, column))
-        except pyodbc.Error as ex:
-            logger.debug("Didn't create index on %s, error %s" % (column, ex))
+            return True
+        except driver_error() as ex:
+            logger.warning("Didn't create index on %s, error %s" % (column, ex))
+            return False
 
     """
         Environment-related methods
@@ -185,25 +264,69 @@ class Database:
 
     def reset_indexes(self):
         logger.info('Reset Indexes')
+        if self.apply_strategy == 'visibility':
+            return self.build_hidden_indexes(hide_all=True)
+
         # FETCH INDEX NAMES
-        self.conn = pyodbc.connect(self.connection_string)
-        self.cur = self.conn.cursor()
+        catalog = self.get_catalog()
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
 
-        for table in self.tables.keys():
-            self.cur.execute('SHOW INDEXES FROM %s;' % table)            
-            index_names = list()
+            for table in self.tables.keys():
+                index_names = set()
+                for indexes in catalog[table].values():
+                    index_names.update(indexes)
 
-            for index in self.cur.fetchall():
-                index_names.append(index[2])
+                for index in sorted(index_names):
+                    if "idx_" in index:
+                        cursor.execute("DROP INDEX %s ON %s;" % (index, table))
 
-            for index in index_names:
-                if "idx_" in index:
-                    self.cur.execute("DROP INDEX %s ON %s;" % (index, table))
+            conn.commit()
+            cursor.close()
 
-        self.conn.commit()
-        self.cur.close()
-        self.conn.close()
+        self.invalidate_catalog()
+        self.current_vector = np.zeros(self.state_size, dtype=np.int8)
+        return True
 
+    def build_hidden_indexes(self, hide_all=False):
+        '''
+            Visibility strategy: builds the missing idx_ index of every
+            optimized column as INVISIBLE, in one ALTER TABLE per table.
+            With hide_all the existing ones are made invisible too and the
+            idx_ indexes of the other columns are dropped (empty state).
+        '''
+        catalog = self.get_catalog()
+        invisible = self.get_invisible_indexes()
+        logger.info('Building the hidden candidate indexes')
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            for table, columns in self.tables.items():
+                built = set()
+                for indexes in catalog[table].values():
+                    built.update(index for index in indexes if index.startswith('idx_'))
+                candidates = {f'idx_{column}': column for column in columns}
+
+                clauses = []
+                if hide_all:
+                    clauses += ['DROP INDEX %s' % index for index in sorted(built - set(candidates))]
+                for index, column in sorted(candidates.items()):
+                    if index not in built:
+                        clauses.append('ADD INDEX %s (%s) INVISIBLE' % (index, column))
+                    elif hide_all and (table, index) not in invisible:
+                        clauses.append('ALTER INDEX %s INVISIBLE' % index)
+                if not clauses:
+                    continue
+                command = 'ALTER TABLE %s %s;' % (table, ', '.join(clauses))
+                logger.debug(command)
+                cursor.execute(command)
+            conn.commit()
+            cursor.close()
+
+        self.invalidate_catalog()
+        self.current_vector = (
+            np.zeros(self.state_size, dtype=np.int8) if hide_all
+            else self.get_materialized_vector()
+        )
         return True
 
     def get_table_name(self, column):
@@ -213,28 +336,120 @@ class Database:
                 if column == col:
                     return tab
     
+    def alter_table(self, table, add=(), drop=(), cursor=None):
+        '''
+            Adds and drops idx_ indexes of a table in a single ALTER TABLE,
+            so the table is scanned once regardless of the number of changes.
+            With the visibility strategy they are shown and hidden instead.
+        '''
+        if self.apply_strategy == 'visibility':
+            clauses = ['ALTER INDEX idx_%s VISIBLE' % column for column in add]
+            clauses += ['ALTER INDEX idx_%s INVISIBLE' % column for column in drop]
+        else:
+            clauses = ['ADD INDEX idx_%s (%s)' % (column, column) for column in add]
+            clauses += ['DROP INDEX idx_%s' % column for column in drop]
+            if self.alter_algorithm is not None:
+                clauses.append('ALGORITHM=%s' % self.alter_algorithm)
+            if self.alter_lock is not None:
+                clauses.append('LOCK=%s' % self.alter_lock)
+        command = 'ALTER TABLE %s %s;' % (table, ', '.join(clauses))
+        logger.debug(command)
+
+        try:
+            self.__execute_ddl(command, cursor)
+            return True
+        except driver_error() as ex:
+            logger.warning("Didn't alter indexes of %s, error %s" % (table, ex))
+            return False
+
+    def __update_build_cost(self, table, seconds, smoothing=0.5):
+        if table not in self.build_cost:
+            self.build_cost[table] = seconds
+        else:
+            self.build_cost[table] += smoothing * (seconds - self.build_cost[table])
+
     def apply_state(self, state, only_optimized=True):
         logger.info('Apply state to the database')
+        # Group the index changes by table
+        changes = dict()
+        requested = dict()
         for table, columns in state.items():
             for column, indexed in columns.items():
-                if only_optimized:
-                    if column not in self.tables[table]:
+                position = self.column_position.get(f'{table}.{column}')
+                if position is None:
+                    if only_optimized:
                         logger.debug(
                             f'Skipping {column} once we are not optimizing it.'
                         )
                         continue
+                elif self.current_vector[position] == indexed:
+                    # Index is already materialized as requested
+                    continue
+                else:
+                    requested[position] = indexed
+                add, drop = changes.setdefault(table, ([], []))
                 if indexed == 1:
-                    self.create_index(column, table)
+                    add.append(column)
                 elif indexed == 0:
-                    self.drop_index(column, table)
+                    drop.append(column)
+
+        # Time spent on DDL, per table and in total
+        timings = {f'ddl_time_{table}': 0. for table in self.tables}
+        n_failures = 0
+        # Single connection for all the changes of this state
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            for table, (add, drop) in changes.items():
+                if not add and not drop:
+                    continue
+                begin = time.time()
+                applied = self.alter_table(table, add, drop, cursor)
+                if not applied and len(add) + len(drop) > 1:
+                    # One failing clause fails the whole batch,
+                    # apply the changes of the table one by one
+                    applied = all([
+                        self.alter_table(table, *change, cursor=cursor)
+                        for change in [([c], []) for c in add] + [([], [c]) for c in drop]
+                    ])
+                timings[f'ddl_time_{table}'] = time.time() - begin
+                logger.debug(
+                    f'Altered {table} (+{len(add)}/-{len(drop)}) '
+                    f'in {timings[f"ddl_time_{table}"]:.2f}s'
+                )
+                if not applied:
+                    n_failures += 1
+                    continue
+                self.__update_build_cost(
+                    table, timings[f'ddl_time_{table}'] / (len(add) + len(drop))
+                )
+                for column, indexed in [(c, 1) for c in add] + [(c, 0) for c in drop]:
+                    position = self.column_position.get(f'{table}.{column}')
+                    if position is not None:
+                        self.current_vector[position] = indexed
+            cursor.close()
+
+        if n_failures:
+            # Something changed the indexes behind our back, read them again
+            self.current_vector = self.get_materialized_vector()
+            missing = [
+                self.flat_state[position] for position, indexed in requested.items()
+                if self.current_vector[position] != indexed
+            ]
+            if missing:
+                # Never measure another configuration than the requested one
+                raise RuntimeError(f'Could not apply the indexes of {", ".join(missing)}')
+
+        timings['ddl_time'] = sum(timings.values())
+        return timings
     
     def apply_vector(self, vector):
         state = self.vector_to_state(vector)
-        self.apply_state(state)                
+        return self.apply_state(state)
 
 
 if __name__ == '__main__':
-    db = Database()
+    from connection import ConnectionPool
+    db = Database(ConnectionPool(utils.get_conn_dict()))
     # cstate = db.get_current_state()
     # c = db.state_to_vector(cstate)
     # print
@@ -0,0 +1,165 @@
+import json
+import logging
+import os
+
+import numpy as np
+
+import utils
+
+logger = logging.getLogger(__name__)
+
+
+class IndexSizeEstimator:
+    '''
+        Predicts the storage metrics of any index configuration without
+        running ANALYZE TABLE, since index sizes are close to additive:
+
+            index_size = base_size + sum(size(column))
+
+        over the columns with an idx_ index, where base_size is the size
+        of the PK/FK secondary indexes. Every real measurement gives the
+        size of each built index, so the catalog fills itself as the run
+        goes; calibrate() measures all the columns (and their build time)
+        up front, and fit() learns from the totals of an earlier history.
+
+        Configurations with an unknown column are measured for real, and
+        with verify_every=N one in N predictions is measured to recalibrate.
+        The catalog is saved as json, it only depends on the database.
+    '''
+
+    def __init__(self, benchmark, filepath=None, verify_every=0):
+        self.benchmark = benchmark
+        self.columns = benchmark.db.flat_state
+        self.filepath = filepath
+        self.verify_every = verify_every
+
+        # 'table.column' -> MB of its idx_ index / seconds to build it
+        self.sizes = dict()
+        self.build_time = dict()
+        self.base_size = None
+        self.data_size = None
+
+        self.n_predicted = 0
+        self.n_measured = 0
+        # Predictions since the last real measurement
+        self.n_unverified = 0
+
+        if filepath is not None and os.path.exists(filepath):
+            self.load()
+
+    def load(self):
+        with open(self.filepath, 'r') as f:
+            catalog = json.load(f)
+        self.sizes = catalog['sizes']
+        self.build_time = catalog['build_time']
+        self.base_size = catalog['base_size']
+        self.data_size = catalog['data_size']
+        logger.info(f'Loaded index sizes of {len(self.sizes)} columns from {self.filepath}')
+
+    def save(self):
+        if self.filepath is None:
+            return
+        utils.ensure_dir(os.path.dirname(self.filepath) or '.')
+        utils.save_json(self.filepath, {
+            'sizes': self.sizes,
+            'build_time': self.build_time,
+            'base_size': self.base_size,
+            'data_size': self.data_size,
+        })
+
+    def observe(self, data_size, index_sizes):
+        # Sizes of a real measurement, {(table, index name): MB}
+        base_size = 0.
+        for (table, index), size in index_sizes.items():
+            if index.startswith('idx_'):
+                self.sizes[f'{table}.{index[len("idx_"):]}'] = size
+            else:
+                base_size += size
+        self.base_size = base_size
+        self.data_size = data_size
+        self.save()
+
+    def predict(self, vector):
+        indexed = [column for column, bit in zip(self.columns, vector) if bit]
+        if self.base_size is None or any(column not in self.sizes for column in indexed):
+            return None
+        return {
+            'data_size': self.data_size,
+            'index_size': self.base_size + sum(self.sizes[column] for column in indexed),
+        }
+
+    def measure(self):
+        data_size, index_sizes = self.benchmark.get_index_sizes()
+        self.observe(data_size, index_sizes)
+        self.n_measured += 1
+        self.n_unverified = 0
+        return {
+            'data_size': data_size,
+            'index_size': float(sum(index_sizes.values())),
+        }
+
+    def get_storage_size(self):
+        '''
+            Drop-in replacement of Benchmark.get_storage_size
+        '''
+        predicted = self.predict(self.benchmark.db.current_vector)
+        if predicted is not None and not (
+            self.verify_every and self.n_unverified >= self.verify_every
+        ):
+            self.n_predicted += 1
+            self.n_unverified += 1
+            predicted['index_size_estimated'] = 1
+            return predicted
+
+        metrics = self.measure()
+        if predicted is not None:
+            metrics['index_size_error'] = predicted['index_size'] - metrics['index_size']
+            logger.info(f'Index size verified, prediction error {metrics["index_size_error"]:+.2f}MB')
+        return metrics
+
+    def calibrate(self):
+        '''
+            Builds each index alone once, recording its size and build time
+            (not with the visibility strategy, which only toggles them)
+        '''
+        db = self.benchmark.db
+        record_build_time = db.apply_strategy != 'visibility'
+        if not record_build_time:
+            logger.info('Index build times are not calibrated, indexes are only made visible')
+        logger.info(f'Calibrating the index sizes of {len(self.columns)} columns')
+        for k, column in enumerate(self.columns):
+            table = column.split('.')[0]
+            vector = np.zeros(len(self.columns), dtype=np.int8)
+            vector[k] = 1
+            db.apply_vector(np.zeros(len(self.columns), dtype=np.int8))
+            timings = db.apply_vector(vector)
+            if record_build_time:
+                self.build_time[column] = timings[f'ddl_time_{table}']
+            self.measure()
+        db.apply_vector(np.zeros(len(self.columns), dtype=np.int8))
+        self.save()
+
+    def fit(self, records):
+        '''
+            Least squares fit of the unknown column sizes on the index_size
+            totals of (individual, metrics) records of an earlier run
+        '''
+        records = [(ind, m) for ind, m in records if 'index_size' in m]
+        if len(records) <= len(self.columns):
+            logger.info(f'Not enough records ({len(records)}) to fit the index sizes')
+            return
+        X = np.asarray([ind for ind, _ in records], dtype=np.float64)
+        A = np.hstack([np.ones((len(X), 1)), X])
+        y = np.asarray([m['index_size'] for _, m in records], dtype=np.float64)
+        coefficients = np.linalg.lstsq(A, y, rcond=None)[0]
+        if self.base_size is None:
+            self.base_size = max(float(coefficients[0]), 0.)
+        for column, size in zip(self.columns, coefficients[1:]):
+            self.sizes.setdefault(column, max(float(size), 0.))
+        if self.data_size is None:
+            self.data_size = float(np.mean([m['data_size'] for _, m in records if 'data_size' in m] or [0.]))
+        self.save()
+        logger.info(f'Fitted index sizes on {len(records)} evaluations')
+
+    def stats(self):
+        return {'predicted': self.n_predicted, 'measured': self.n_measured}
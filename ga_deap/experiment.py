@@ -0,0 +1,339 @@
+'''
+    Command line arguments and setup shared by train.py and randsearch.py:
+    backend, objective (cache, storage estimator, measurement policy)
+    and evaluator (serial, replicas or multi-fidelity)
+'''
+
+import logging
+import os
+
+import config
+import utils
+from cache import EvaluationCache, PlanCache
+from estimator import IndexSizeEstimator
+from fidelity import MultiFidelityEvaluator, build_levels
+from fitness import Objective, get_available_fitness, get_fitness_fn
+from history import read_records
+from measurement import MeasurementPolicy
+from replicas import ReplicaEvaluator, SerialEvaluator, parse_replica
+
+logger = logging.getLogger(__name__)
+
+
+def add_arguments(parser):
+    parser.add_argument('-p', '--pop_size', type=int, default=50)
+    parser.add_argument('-g', '--generations', type=int, default=100)
+    parser.add_argument('-o', '--outpath', type=str, default='runs/')
+    parser.add_argument('-f', '--fitness', type=str,
+        default='qphh', choices=get_available_fitness())
+    # Hybrid mode: the proxy fitness ranks the individuals and only
+    # the best --promote fraction is measured by the benchmark
+    parser.add_argument('--proxy', type=str, default=None,
+        choices=get_available_fitness())
+    parser.add_argument('--promote', type=float, default=0.25)
+    # Only the measurements the fitness reads are run, plus these metrics
+    parser.add_argument('--record_metrics', type=str, nargs='*', default=[],
+        help='metrics measured for the history only, e.g. index_size')
+    parser.add_argument('--debug', action='store_true')
+    parser.add_argument('--pool_size', type=int, default=4)
+    # Database replicas (host:port) evaluating individuals in parallel,
+    # defaults to config.REPLICAS
+    parser.add_argument('--replicas', type=str, nargs='*', default=None)
+    # ALGORITHM and LOCK clauses of the batched ALTER TABLE statements
+    # (MySQL has no INSTANT algorithm for ADD/DROP INDEX)
+    parser.add_argument('--alter_algorithm', type=str, default=None,
+        choices=['DEFAULT', 'INPLACE', 'COPY'])
+    parser.add_argument('--alter_lock', type=str, default=None,
+        choices=['DEFAULT', 'NONE', 'SHARED', 'EXCLUSIVE'])
+    # Build and drop indexes, or build them all once and toggle their visibility
+    parser.add_argument('--apply_strategy', type=str, default='ddl',
+        choices=['ddl', 'visibility'])
+    # Order of evaluation inside a generation to minimize index changes
+    parser.add_argument('--schedule', type=str, default='2opt',
+        choices=['none', 'nearest', '2opt'])
+    # Bounded evaluation: abort query streams slower than
+    # budget_slack times the best one and penalize their fitness
+    parser.add_argument('--bounded_eval', action='store_true')
+    parser.add_argument('--budget_slack', type=float, default=1.5)
+    parser.add_argument('--max_query_time', type=float, default=None,
+        help='seconds allowed to each query of the stream')
+    # Measurement policy: warm-up streams, buffer pool state before each
+    # measurement and repetitions aggregated with confidence intervals
+    parser.add_argument('--warmup_runs', type=int, default=0)
+    parser.add_argument('--cache_state', type=str, default='keep',
+        choices=['keep', 'warm', 'cold'])
+    parser.add_argument('--repetitions', type=int, default=1)
+    parser.add_argument('--aggregate', type=str, default='median',
+        choices=['median', 'trimmed_mean', 'mean'])
+    parser.add_argument('--adaptive_repeats', action='store_true',
+        help='only repeat measurements close to the best fitness so far')
+    parser.add_argument('--elite_margin', type=float, default=0.05)
+    # TPC-H scale factor and query streams of the throughput test
+    parser.add_argument('--scale_factor', type=float, default=config.SCALE_FACTOR)
+    parser.add_argument('--num_streams', type=int, default=config.NUM_STREAMS,
+        help='defaults to the TPC-H minimum for the scale factor')
+    # Successive halving over the down-scaled copies of config.FIDELITIES
+    parser.add_argument('--multi_fidelity', action='store_true')
+    parser.add_argument('--eta', type=int, default=3,
+        help='only the best 1/eta of each level move on to the next one')
+    # Index sizes predicted from a per-column catalog instead of ANALYZE TABLE
+    parser.add_argument('--estimate_index_size', action='store_true')
+    parser.add_argument('--verify_every', type=int, default=0,
+        help='measure the real index size once every N predictions')
+    parser.add_argument('--index_catalog', type=str, default=None,
+        help='catalog json, defaults to <outpath>/index_catalog.json')
+    parser.add_argument('--calibrate_indexes', action='store_true',
+        help='build and measure each index alone before training')
+    # Refresh sets bulk-loaded in the background ahead of the power tests
+    parser.add_argument('--prestage_depth', type=int, default=2)
+    # The simulated backend evaluates individuals with a cost model,
+    # loaded from --cost_model, fit from --fit_history or synthetic
+    parser.add_argument('--backend', type=str, default='mysql',
+        choices=['mysql', 'simulated'])
+    parser.add_argument('--cost_model', type=str, default=None,
+        help='cost model json saved by simulator.py')
+    parser.add_argument('--fit_history', type=str, default=None,
+        help='history.json or history.bin to fit the cost model on')
+    parser.add_argument('--sim_noise', type=float, default=None,
+        help='relative measurement noise of the simulated backend')
+    parser.add_argument('--sim_seed', type=int, default=None)
+    # WARNING: use this only for debugging fast
+    parser.add_argument('--use_fake_eval', action='store_true')
+    parser.add_argument('--use_tensorboard', action='store_true')
+    # Evaluation cache (LRU in memory + eval_cache.jsonl in the outpath)
+    parser.add_argument('--no_cache', action='store_true')
+    parser.add_argument('--cache_size', type=int, default=1024)
+    # Configurations with the same query plans as a measured one reuse its
+    # runtime metrics (plan_cache.jsonl in the outpath)
+    parser.add_argument('--plan_cache', action='store_true')
+    parser.add_argument('--warm_start', type=str, default=None,
+        help='history.json or history.bin of an earlier run used to fill the cache')
+
+
+def check_arguments(parser, args):
+    '''
+        Rejects or completes the combinations of shared arguments
+        that would not do what they say
+    '''
+    if args.cache_state == 'cold' and args.backend == 'mysql' and not config.COLD_CACHE_COMMAND:
+        parser.error('--cache_state cold needs config.COLD_CACHE_COMMAND (e.g. a server restart)')
+    # Invisible indexes are still maintained by the refresh functions
+    refreshed = {'qphh', 'power', 'throughput', 'RF1', 'RF2'}
+    measured = set(get_fitness_fn(args.fitness)[1]) | set(args.record_metrics)
+    if args.apply_strategy == 'visibility' and refreshed & measured:
+        logger.warning(
+            '--apply_strategy visibility keeps every candidate index built, RF1 and RF2 '
+            'maintain the invisible ones too: the refresh functions, power, throughput '
+            'and qphh do not reflect the indexes of each individual'
+        )
+    # Replica workers only measure the raw metrics of the fitness and
+    # --record_metrics, the features below run in this process
+    replicas = args.replicas if args.replicas is not None else config.REPLICAS
+    if replicas and args.backend == 'mysql' and not args.use_fake_eval:
+        for option, enabled in [
+            ('--multi_fidelity', args.multi_fidelity),
+            ('--proxy', args.proxy is not None),
+            ('--plan_cache', args.plan_cache),
+            ('--estimate_index_size', args.estimate_index_size),
+        ]:
+            if enabled:
+                parser.error(
+                    f'{option} does not run on replicas (--replicas or config.REPLICAS, '
+                    f'pass --replicas without hosts to disable them)'
+                )
+    # The estimator only predicts index_size, so it has to be measured
+    if args.estimate_index_size and 'index_size' not in args.record_metrics:
+        args.record_metrics.append('index_size')
+    return args
+
+
+def database_kwargs(args):
+    return {
+        'alter_algorithm': args.alter_algorithm,
+        'alter_lock': args.alter_lock,
+        'apply_strategy': args.apply_strategy,
+    }
+
+
+def benchmark_kwargs(args):
+    return {
+        'max_query_time': args.max_query_time,
+        'prestage_depth': args.prestage_depth,
+        'scale_factor': args.scale_factor,
+        'num_streams': args.num_streams,
+    }
+
+
+def measurement_settings(args, benchmark):
+    '''
+        Settings that change what the measured metrics mean, part of
+        the evaluation and plan cache keys
+    '''
+    return {
+        'backend': args.backend,
+        'scale_factor': benchmark.SCALE_FACTOR,
+        'num_streams': benchmark.NUM_STREAMS,
+        'apply_strategy': args.apply_strategy,
+        'cache_state': args.cache_state,
+        'repetitions': args.repetitions,
+        'aggregate': args.aggregate,
+    }
+
+
+def build_backend(args):
+    '''
+        Database and Benchmark of the MySQL server in config.py,
+        or of the simulated backend
+    '''
+    if args.backend == 'simulated':
+        from simulator import simulated_backend
+
+        # No MySQL server, index changes and benchmarks are simulated
+        return simulated_backend(
+            cost_model=args.cost_model,
+            fit_history=args.fit_history,
+            noise=args.sim_noise,
+            seed=args.sim_seed,
+            max_query_time=args.max_query_time,
+            scale_factor=args.scale_factor,
+            num_streams=args.num_streams
+        )
+
+    from benchmark import Benchmark
+    from connection import ConnectionPool
+    from database import Database
+
+    # Pool of connections to the server defined in config.py file,
+    # shared by the database and the benchmark
+    pool = ConnectionPool(
+        conn_config=utils.get_conn_dict(),
+        size=args.pool_size
+    )
+
+    # Creates a database object for handling db connections
+    # Queries and index creation
+    database = Database(pool=pool, reset_indexes=True, **database_kwargs(args))
+
+    # Benchmark object allows running power testes, get storage size
+    # query time and other performance metrics on the database
+    benchmark = Benchmark(database, **benchmark_kwargs(args))
+    return database, benchmark
+
+
+def build_objective(args, benchmark, history):
+    '''
+        Objective of the run, with its evaluation cache, index size
+        estimator, measurement policy and plan cache
+    '''
+    # Already evaluated individuals are restored from the cache
+    # instead of being benchmarked again (fake metrics never are cached)
+    settings = measurement_settings(args, benchmark)
+    cache = None
+    if not args.no_cache and not args.use_fake_eval:
+        cache = EvaluationCache(
+            fitness_name=args.fitness,
+            path=args.outpath,
+            max_size=args.cache_size,
+            required=get_fitness_fn(args.fitness)[1],
+            settings=settings
+        )
+        if args.warm_start is not None:
+            cache.warm_start(args.warm_start)
+
+    # Storage metrics predicted from the size of each index
+    storage = None
+    if args.estimate_index_size:
+        storage = IndexSizeEstimator(
+            benchmark=benchmark,
+            filepath=args.index_catalog or os.path.join(args.outpath, 'index_catalog.json'),
+            verify_every=args.verify_every
+        )
+        if args.calibrate_indexes:
+            storage.calibrate()
+        elif args.warm_start is not None:
+            storage.fit(read_records(args.warm_start))
+
+    # Objective allows the fitness evaluation
+    # by using the benchmark metrics
+    return Objective(
+        benchmark=benchmark,
+        fitness_name=args.fitness,
+        history=history,
+        cache=cache,
+        bounded=args.bounded_eval,
+        budget_slack=args.budget_slack,
+        policy=MeasurementPolicy(
+            warmup=args.warmup_runs,
+            repetitions=args.repetitions,
+            cache_state=args.cache_state,
+            aggregate=args.aggregate,
+            adaptive=args.adaptive_repeats,
+            elite_margin=args.elite_margin
+        ),
+        storage=storage,
+        proxy=args.proxy,
+        promote=args.promote,
+        record=args.record_metrics,
+        plan_cache=(
+            PlanCache(path=args.outpath, settings=settings)
+            if args.plan_cache and not args.use_fake_eval else None
+        )
+    )
+
+
+def build_evaluator(args, objective, database):
+    '''
+        Evaluations run in this process, spread over the replicas or
+        through the down-scaled databases first (multi-fidelity)
+    '''
+    replicas = config.REPLICAS
+    if args.replicas is not None:
+        replicas = [parse_replica(replica) for replica in args.replicas]
+
+    if args.multi_fidelity and not args.use_fake_eval:
+        # Each batch goes through the down-scaled databases first
+        levels = build_levels(
+            fidelities=config.FIDELITIES,
+            fitness_name=args.fitness,
+            policy=objective.policy,
+            pool_size=args.pool_size,
+            database_kwargs=database_kwargs(args),
+            benchmark_kwargs={
+                key: value for key, value in benchmark_kwargs(args).items()
+                if key != 'scale_factor'
+            },
+            model=database.model if args.backend == 'simulated' else None,
+            model_scale_factor=args.scale_factor
+        )
+        evaluator = MultiFidelityEvaluator(
+            objective=objective,
+            levels=levels,
+            scale_factor=args.scale_factor,
+            eta=args.eta
+        )
+        evaluator.eval_level_baselines([0] * database.state_size)
+        return evaluator
+
+    if replicas and not args.use_fake_eval and args.backend == 'mysql':
+        return ReplicaEvaluator(
+            objective=objective,
+            replicas=replicas,
+            pool_size=args.pool_size,
+            database_kwargs=database_kwargs(args),
+            benchmark_kwargs=benchmark_kwargs(args)
+        )
+
+    return SerialEvaluator(objective)
+
+
+def log_stats(objective, evaluator):
+    # Benchmark runs made and saved by the measurement policy
+    logger.info(f'Measurements: {objective.policy.stats()}')
+    if isinstance(evaluator, MultiFidelityEvaluator):
+        logger.info(f'Measurements per scale factor: {evaluator.stats()}')
+    if objective.proxy is not None:
+        logger.info(f'Proxy correlation: {objective.proxy_correlation()}')
+    if objective.storage is not None:
+        logger.info(f'Index sizes: {objective.storage.stats()}')
+    if objective.plan_cache is not None:
+        logger.info(f'Plan cache: {objective.plan_cache.stats()}')
@@ -0,0 +1,61 @@
+import hashlib
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def parse_plan(explain_output):
+    '''
+        Plan dict of the result of an EXPLAIN FORMAT=JSON statement
+    '''
+    rows = list(explain_output)
+    return json.loads(rows[0][0])
+
+
+def query_cost(plan):
+    '''
+        Optimizer's estimated cost of a plan: the query_cost of its
+        outer query block or, for blocks without one (e.g. UNION
+        results), the sum over the nested blocks
+    '''
+    if isinstance(plan, dict):
+        cost = plan.get('cost_info', {}).get('query_cost')
+        if cost is not None:
+            return float(cost)
+        return sum(query_cost(value) for value in plan.values())
+    if isinstance(plan, list):
+        return sum(query_cost(value) for value in plan)
+    return 0.
+
+
+# Plan attributes that are estimates rather than choices of the optimizer,
+# or candidate indexes it did not pick
+VOLATILE_KEYS = {'cost_info', 'filtered', 'possible_keys'}
+
+
+def is_volatile(key):
+    return key in VOLATILE_KEYS or key.startswith('rows_') or key.endswith('_cost')
+
+
+def normalize_plan(plan):
+    '''
+        Plan without its cost and cardinality estimates, so that two
+        plans only differ when the optimizer chose differently
+    '''
+    if isinstance(plan, dict):
+        return {
+            key: normalize_plan(value) for key, value in plan.items()
+            if not is_volatile(key)
+        }
+    if isinstance(plan, list):
+        return [normalize_plan(value) for value in plan]
+    return plan
+
+
+def fingerprint(plans):
+    '''
+        Hash of the normalized plans of {'Q1': plan, ...}
+    '''
+    normalized = {query: normalize_plan(plan) for query, plan in plans.items()}
+    return hashlib.sha1(json.dumps(normalized, sort_keys=True).encode()).hexdigest()
@@ -0,0 +1,237 @@
+import logging
+import math
+
+import numpy as np
+
+from cache import pack_individual
+from replicas import SerialEvaluator
+
+logger = logging.getLogger(__name__)
+
+
+class FidelityLevel:
+    '''
+        A down-scaled copy of the database (its own schema, Benchmark and
+        Objective) and the fitness of the individuals measured on it
+    '''
+
+    def __init__(self, scale_factor, objective):
+        self.scale_factor = scale_factor
+        self.objective = objective
+        # Packed genome -> fitness at this level
+        self.fitness = dict()
+        # (fitness here, full fidelity fitness) of the promoted individuals
+        self.pairs = []
+        # Packed genomes whose stream was aborted at this level
+        self.aborted = set()
+
+    def eval_baseline(self, baseline_individual):
+        metrics = self.objective.get_state_metrics(baseline_individual)
+        if metrics.get('aborted'):
+            # Every fitness at this level is relative to the baseline,
+            # which is measured again without max_query_time
+            logger.warning(
+                f'Baseline aborted at scale factor {self.scale_factor}, measuring it unbounded'
+            )
+            benchmark = self.objective.benchmark
+            max_query_time, benchmark.max_query_time = benchmark.max_query_time, None
+            try:
+                metrics = self.objective.get_state_metrics(baseline_individual)
+            finally:
+                benchmark.max_query_time = max_query_time
+        self.objective.baseline_metrics = metrics
+
+    def measure(self, individual):
+        metrics = self.objective.get_state_metrics(individual)
+        key = pack_individual(individual)
+        if metrics.get('aborted'):
+            # A truncated stream ranks with the worst complete one
+            fitness = self.objective.penalized_fitness()
+            self.aborted.add(key)
+        else:
+            fitness = self.objective.fitness_fn(metrics, self.objective.baseline_metrics)
+            if self.objective.worst_fitness is None or fitness < self.objective.worst_fitness:
+                self.objective.worst_fitness = fitness
+            # Best fitness at this level, for the adaptive repetitions
+            if self.objective.best_fitness is None or fitness > self.objective.best_fitness:
+                self.objective.best_fitness = fitness
+        self.fitness[key] = fitness
+        return metrics, fitness
+
+    def estimate(self, fitness):
+        '''
+            Full fidelity fitness of an individual eliminated at this level,
+            from a linear fit over the individuals measured at both
+        '''
+        if len(self.pairs) < 3:
+            return None
+        low, full = np.asarray(self.pairs, dtype=np.float64).T
+        if np.ptp(low) == 0:
+            return None
+        slope, intercept = np.polyfit(low, full, 1)
+        return float(slope * fitness + intercept)
+
+
+def build_levels(fidelities, fitness_name, policy=None, pool_size=4,
+                 database_kwargs=None, benchmark_kwargs=None, model=None,
+                 model_scale_factor=1.):
+    '''
+        FidelityLevel of each down-scaled database in fidelities (see
+        config.FIDELITIES). With a cost model (of the database at
+        model_scale_factor) the levels are simulated on scaled copies of it.
+    '''
+    # Imported here, like the replica workers, so only the backend in use is needed
+    from fitness import Objective
+
+    levels = []
+    for fidelity in fidelities:
+        scale_factor = fidelity['scale_factor']
+        if model is not None:
+            from simulator import SimulatedBenchmark, SimulatedDatabase
+            database = SimulatedDatabase(
+                model=model.scaled(scale_factor / model_scale_factor),
+                seed=fidelity.get('seed')
+            )
+            benchmark = SimulatedBenchmark(
+                database,
+                scale_factor=scale_factor,
+                **(benchmark_kwargs or {})
+            )
+        else:
+            from benchmark import Benchmark
+            from connection import ConnectionPool
+            from database import Database
+            import utils
+            pool = ConnectionPool(
+                conn_config=utils.get_conn_dict(database=fidelity['database']),
+                size=pool_size,
+                name=f'sf_{scale_factor}'
+            )
+            database = Database(pool=pool, reset_indexes=True, **(database_kwargs or {}))
+            benchmark = Benchmark(
+                database,
+                scale_factor=scale_factor,
+                refresh_path=fidelity.get('dbgen'),
+                **(benchmark_kwargs or {})
+            )
+        objective = Objective(benchmark=benchmark, fitness_name=fitness_name, policy=policy)
+        levels.append(FidelityLevel(scale_factor, objective))
+        logger.info(f'Fidelity level at scale factor {scale_factor} ready')
+    return levels
+
+
+class MultiFidelityEvaluator(SerialEvaluator):
+    '''
+        Successive halving over down-scaled copies of the database.
+
+        Each batch of new individuals is measured on the cheapest level
+        first, and only the best 1/eta of them move on to the next one,
+        up to the full size database of the objective. Individuals
+        eliminated on the way get a fitness extrapolated from the ones
+        measured at both levels, never above the promoted ones.
+
+        History records are tagged with the scale factor they were
+        measured at (fidelity), those of the lower levels also with
+        low_fidelity, so History.records() leaves them out by default.
+    '''
+
+    def __init__(self, objective, levels, scale_factor, eta=3):
+        super().__init__(objective)
+        # Cheapest first
+        self.levels = sorted(levels, key=lambda level: level.scale_factor)
+        self.scale_factor = scale_factor
+        self.eta = eta
+        # Measurements made on each level, the full one last
+        self.n_measured = [0] * (len(self.levels) + 1)
+
+    def eval_level_baselines(self, baseline_individual):
+        for level in self.levels:
+            level.eval_baseline(baseline_individual)
+
+    def collect(self):
+        ticket, metrics = super().collect()
+        metrics['fidelity'] = self.scale_factor
+        return ticket, metrics
+
+    def measure(self, individuals):
+        measured = super().measure(individuals)
+        for metrics in measured:
+            metrics['fidelity'] = self.scale_factor
+        self.n_measured[-1] += len(measured)
+        return measured
+
+    def map(self, func, individuals):
+        '''
+            Drop-in replacement of toolbox.map for objective.evaluate
+        '''
+        individuals = list(individuals)
+        cache = self.objective.cache
+
+        # Distinct genomes not measured at full fidelity yet
+        candidates = dict()
+        for individual in individuals:
+            key = pack_individual(individual)
+            if cache is not None and individual in cache:
+                continue
+            candidates.setdefault(key, individual)
+
+        # Genomes dropped at each level, with their fitness there
+        eliminated = []
+        for k, level in enumerate(self.levels):
+            if len(candidates) <= 1:
+                break
+            ranked = []
+            for key, individual in candidates.items():
+                fitness = level.fitness.get(key)
+                if fitness is None:
+                    metrics, fitness = level.measure(individual)
+                    self.n_measured[k] += 1
+                    metrics.update({
+                        'fitness': fitness,
+                        'fidelity': level.scale_factor,
+                        'low_fidelity': 1,
+                    })
+                    self.objective.history.update(individual, metrics)
+                ranked.append((fitness, key))
+            ranked.sort(reverse=True)
+            n_promoted = max(1, math.ceil(len(ranked) / self.eta))
+            eliminated += [(level, key, fitness) for fitness, key in ranked[n_promoted:]]
+            candidates = {key: candidates[key] for _, key in ranked[:n_promoted]}
+            logger.info(
+                f'Scale factor {level.scale_factor}: promoted {n_promoted} of {len(ranked)}'
+            )
+
+        measured = dict(zip(candidates.keys(), self.measure(list(candidates.values()))))
+        dropped = {key for _, key, _ in eliminated}
+        fitness_of = dict()
+        for individual in individuals:
+            key = pack_individual(individual)
+            if key in fitness_of or key in dropped:
+                continue
+            fitness_of[key] = func(individual, metrics=measured.get(key))
+            if key not in measured or measured[key].get('aborted'):
+                continue
+            for level in self.levels:
+                if key in level.fitness and key not in level.aborted:
+                    level.pairs.append((level.fitness[key], fitness_of[key][0]))
+
+        # The eliminated ones rank below the individuals promoted past them
+        floor = min((fitness_of[key][0] for key in measured), default=None)
+        for level, key, fitness in eliminated:
+            estimate = None if key in level.aborted else level.estimate(fitness)
+            if estimate is None:
+                estimate = self.objective.penalized_fitness()
+            if floor is not None:
+                estimate = min(estimate, floor)
+            fitness_of[key] = (estimate,)
+        self.objective.history.serialize()
+
+        return [fitness_of[pack_individual(individual)] for individual in individuals]
+
+    def close(self):
+        for level in self.levels:
+            level.objective.benchmark.close()
+
+    def stats(self):
+        scales = [level.scale_factor for level in self.levels] + [self.scale_factor]
+        return dict(zip(scales, self.n_measured))
@@ -1,69 +1,270 @@
 import logging
 
 import numpy as np
+from scipy import stats
+
+from cache import pack_individual
+from measurement import MeasurementPolicy
+from planner import RUNTIME, MetricPlanner
+from refresh import REFRESHED_TABLES
 
 logger = logging.getLogger(__name__)
 
 
 class Objective:
 
-    def __init__(self, benchmark, fitness_name, history=None):
+    # Individuals evaluated for real before the proxy starts ranking
+    MIN_PROXY_SAMPLES = 5
+
+    def __init__(self, benchmark, fitness_name, history=None, cache=None,
+                 bounded=False, budget_slack=1.5, policy=None, storage=None,
+                 proxy=None, promote=0.25, record=(), plan_cache=None):
         # Gets the fitness funciton as defined in fitness.py
         self.benchmark = benchmark
         self.history = history
+        self.fitness_name = fitness_name
+        # Optional EvaluationCache shared across generations
+        self.cache = cache
+        # Bounded evaluation: query streams slower than budget_slack times
+        # the best stream so far are aborted and get a penalized fitness
+        self.bounded = bounded
+        self.budget_slack = budget_slack
+        self.best_time = None
+        self.worst_fitness = None
+        self.best_fitness = None
+        # Optional IndexSizeEstimator predicting the storage metrics
+        self.storage = storage
+        # Optional PlanCache reusing the runtime metrics of the
+        # configurations with the same query plans
+        self.plan_cache = plan_cache
+        # Warm-up, cache state and repetitions of the measurements
+        self.policy = policy if policy is not None else MeasurementPolicy()
+        # Raw measurements run once per evaluation for the needed metrics,
+        # plus the ones recorded for the history only (e.g. index_size)
+        self.planner = MetricPlanner(benchmark, storage)
+        self.record = list(record)
         self.fitness_fn, metrics_needed = get_fitness_fn(fitness_name)
         self.setup_metrics(metrics_needed)        
+        # Hybrid mode: a cheap proxy fitness (e.g. plan_cost) ranks the
+        # individuals and only the top promote fraction gets measured
+        self.proxy = proxy
+        self.promote = promote
+        self.proxy_fitnesses = []
+        # (proxy, measured) fitness of the promoted individuals
+        self.proxy_pairs = []
+        if proxy is not None:
+            self.proxy_fn, proxy_metrics = get_fitness_fn(proxy)
+            self.proxy_metrics = self.planner.plan(proxy_metrics)
     
-    def setup_metrics(self, metrics=['dbsize', 'qphh', 'time']):
-        # Metrics we have at hand to compute fitness
-        
-        metric_fn = {
-            'dbsize': self.benchmark.get_storage_size,
-            'qphh': self.benchmark.get_qphh,
-            'time': self.benchmark.get_runtime,
-        }
-
-        self.metrics = {}
-
-        # Set up metrics we need to use to compute the fitness
-        for metric in metrics: 
-            self.metrics[metric] = metric_fn[metric]
+    def setup_metrics(self, metrics=['qphh']):
+        # Set up the measurements we need to compute the fitness,
+        # {measurement: function} in the order they are run
+        self.metrics = self.planner.plan(list(metrics) + self.record)
 
     def get_state_metrics(self, individual):
+        # Refresh sets consumed by this evaluation are recorded under its genome
+        self.benchmark.evaluation = pack_individual(individual)
         # Set up the database indexes using the provided individual
-        self.benchmark.db.apply_vector(individual)
-        metric_dict = {}
-        for metric, metric_fn in self.metrics.items():            
+        # and keep the time spent on each table's ALTER TABLE
+        try:
+            metric_dict = self.benchmark.db.apply_vector(individual)
+        except RuntimeError as ex:
+            # Penalized like an aborted stream, and never cached
+            logger.warning(f'Individual not applied: {ex}')
+            metric_dict = {'aborted': 1, 'apply_failed': 1}
+            metric_dict.update(self.benchmark.pool.consume_metrics())
+            return metric_dict
+        metrics = self.metrics
+        if self.proxy is not None:
+            metrics = self.rank_by_proxy(metric_dict)
+
+        # Same query plans as a measured configuration, same runtime metrics
+        runtime = [metric for metric in metrics if metric in RUNTIME]
+        plan_fingerprint = None
+        if self.plan_cache is not None and runtime:
+            plan_fingerprint = self.plan_key('qphh' in runtime)
+            reused = self.plan_cache.get(plan_fingerprint, runtime)
+            if reused is not None:
+                logger.info('Query plans already measured, benchmark avoided')
+                metric_dict.update(reused)
+                metric_dict['plan_reused'] = 1
+                metrics = {
+                    metric: metric_fn for metric, metric_fn in metrics.items()
+                    if metric not in RUNTIME
+                }
+                # The indexes are what differs from the measured configuration
+                metrics.setdefault('dbsize', self.planner.providers['dbsize'])
+                plan_fingerprint = None
+
+        if any(metric in self.policy.REPEATED for metric in metrics):
+            self.policy.warm_up(self.benchmark)
+        measured = dict()
+        for metric, metric_fn in metrics.items():            
             logger.debug(f'Computing metric {metric} via {metric_fn}')
-            __result__ = metric_fn()
+            if metric in self.policy.REPEATED:
+                __result__ = self.policy.measure(
+                    metric_fn, self.benchmark,
+                    promising=lambda sample: self.is_promising({**metric_dict, **sample})
+                )
+            else:
+                __result__ = metric_fn()
             logger.debug(f'Computed {metric}. Results {__result__}')
             metric_dict.update(__result__)        
+            if metric in RUNTIME:
+                measured.update(__result__)
+            if metric_dict.get('aborted'):
+                # No need for the remaining metrics of a hopeless individual
+                break
+
+        if plan_fingerprint is not None and not metric_dict.get('aborted'):
+            self.plan_cache.put(plan_fingerprint, runtime, measured)
+
+        # Time spent waiting for database connections
+        metric_dict.update(self.benchmark.pool.consume_metrics())
 
         # Get all the benchmark metrics
         return metric_dict
     
-    def eval_baseline(self, baseline_individual):
+    def plan_key(self, refreshed=False):
+        '''
+            Fingerprint of the query plans of the current configuration.
+            The refresh functions maintain the indexes of the tables they
+            modify whatever the plans, so with refreshed those indexes
+            are part of the key too.
+        '''
+        key = self.benchmark.get_plan_fingerprint()
+        if refreshed:
+            db = self.benchmark.db
+            indexes = [
+                bit for column, bit in zip(db.flat_state, db.current_vector)
+                if column.split('.')[0] in REFRESHED_TABLES
+            ]
+            key = f'{key}/{pack_individual(indexes)}'
+        return key
+
+    def rank_by_proxy(self, metric_dict):
+        '''
+            Computes the proxy metrics and decides whether the individual
+            is promoted to a real measurement. Returns the metrics left
+            to compute: all of them when promoted, only the cheap ones
+            (not repeated by the measurement policy) otherwise.
+        '''
+        for metric, metric_fn in self.proxy_metrics.items():
+            metric_dict.update(metric_fn())
+        remaining = {
+            metric: metric_fn for metric, metric_fn in self.metrics.items()
+            if metric not in self.proxy_metrics
+        }
+        if not hasattr(self, 'baseline_metrics'):
+            # The baseline is always measured
+            return remaining
+
+        proxy_fitness = self.proxy_fn(metric_dict, self.baseline_metrics)
+        metric_dict['proxy_fitness'] = proxy_fitness
+        self.proxy_fitnesses.append(proxy_fitness)
+        promoted = (
+            len(self.proxy_fitnesses) <= self.MIN_PROXY_SAMPLES
+            or proxy_fitness >= np.quantile(self.proxy_fitnesses, 1 - self.promote)
+        )
+        metric_dict['promoted'] = int(promoted)
+        if promoted:
+            return remaining
+        logger.info(f'Not promoted, proxy fitness {proxy_fitness:5.4f}')
+        return {
+            metric: metric_fn for metric, metric_fn in remaining.items()
+            if metric not in self.policy.REPEATED
+        }
+
+    def proxy_estimate(self, proxy_fitness):
+        '''
+            Fitness of an individual that was not promoted, from a linear
+            fit of the measured fitness on the proxy fitness
+        '''
+        if len(self.proxy_pairs) < 3:
+            return self.penalized_fitness()
+        proxy, measured = np.asarray(self.proxy_pairs, dtype=np.float64).T
+        if np.ptp(proxy) == 0:
+            return self.penalized_fitness()
+        slope, intercept = np.polyfit(proxy, measured, 1)
+        return float(slope * proxy_fitness + intercept)
+
+    def proxy_correlation(self):
+        '''
+            Pearson and Spearman correlation between the proxy and the
+            measured fitness of the promoted individuals
+        '''
+        if len(self.proxy_pairs) < 3:
+            return None
+        proxy, measured = np.asarray(self.proxy_pairs, dtype=np.float64).T
+        return {
+            'pearson': float(stats.pearsonr(proxy, measured)[0]),
+            'spearman': float(stats.spearmanr(proxy, measured)[0]),
+            'promoted': len(self.proxy_pairs),
+            'ranked': len(self.proxy_fitnesses),
+        }
+
+    def eval_baseline(self, baseline_individual, metrics=None):
+        '''
+            Metrics may be given when the baseline was measured
+            elsewhere (e.g. by a replica worker)
+        '''
         logger.info('Evaluating baseline individual')
-        metrics = self.get_state_metrics(baseline_individual)
+        if metrics is None:
+            metrics = self.get_state_metrics(baseline_individual)
         self.baseline_metrics = metrics
+        self.update_time_budget(metrics)
+        if self.cache is not None:
+            self.cache.put(baseline_individual, metrics)
         self.history.update(baseline_individual, self.baseline_metrics)
         logger.debug('Baseline metrics {}'.format(self.baseline_metrics))
 
-    def evaluate(self, individual,):
+    def evaluate(self, individual, metrics=None):
+        '''
+            Metrics may be given when they were already measured
+            elsewhere (e.g. by a replica worker)
+        '''
         logger.info('Evaluating individual {}'.format(individual))        
-        
-        # Apply state to the DB and get metrics from benchmark
-        metrics = self.get_state_metrics(individual)
-        logger.debug(f'Metrics: {metrics}')
-
-        # Debug stuff to make sure the current state 
-        # is the same as the provided individual
-        state = self.benchmark.db.get_current_state_vector()
-        logger.debug(f'Current db state: {state}')
+
+        # Reuse the metrics of genomes evaluated before
+        cached = None
+        if metrics is None and self.cache is not None:
+            cached = self.cache.get(individual)
+
+        if cached is not None:
+            metrics = cached
+            logger.info('Metrics restored from the evaluation cache')
+        else:
+            if metrics is None:
+                # Apply state to the DB and get metrics from benchmark
+                metrics = self.get_state_metrics(individual)
+                logger.debug(f'Metrics: {metrics}')
+
+                # Debug stuff to make sure the current state 
+                # is the same as the provided individual
+                state = self.benchmark.db.get_current_state_vector()
+                logger.debug(f'Current db state: {state}')
+            if self.cache is not None:
+                self.cache.put(individual, metrics)
         logger.info(f'Evaluation result: {metrics}')
 
+        self.update_time_budget(metrics)
+
         # Calculate the fitness function using the provided metrics
-        fitness = self.fitness_fn(metrics, self.baseline_metrics)
+        if metrics.get('aborted'):
+            fitness = self.penalized_fitness()
+        elif metrics.get('promoted') == 0:
+            fitness = self.proxy_estimate(metrics['proxy_fitness'])
+        else:
+            fitness = self.fitness_fn(metrics, self.baseline_metrics)
+            if self.worst_fitness is None or fitness < self.worst_fitness:
+                self.worst_fitness = fitness
+            if self.best_fitness is None or fitness > self.best_fitness:
+                self.best_fitness = fitness
+            if cached is None and 'proxy_fitness' in metrics:
+                self.proxy_pairs.append((metrics['proxy_fitness'], fitness))
+                correlation = self.proxy_correlation()
+                if correlation is not None:
+                    logger.info(f'Proxy correlation: {correlation}')
         logger.info(f'Fitness result: {fitness:5.4f}')
         
         # Logging stuff
@@ -73,6 +274,34 @@ class Objective:
         
         return (fitness,)
     
+    def update_time_budget(self, metrics):
+        # The budget follows the fastest complete query stream seen so far
+        if metrics.get('aborted') or 'time' not in metrics:
+            return
+        current_time = float(metrics['time'])
+        if self.best_time is None or current_time < self.best_time:
+            self.best_time = current_time
+            if self.bounded:
+                self.benchmark.time_budget = self.budget_slack * current_time
+                logger.info(f'Query stream time budget set to {self.benchmark.time_budget:.2f}s')
+
+    def is_promising(self, metrics):
+        # Close enough to the elite to be worth repeating the measurement
+        if self.best_fitness is None or not hasattr(self, 'baseline_metrics'):
+            return True
+        try:
+            fitness = self.fitness_fn(metrics, self.baseline_metrics)
+        except KeyError:
+            # Metrics of the fitness not measured yet
+            return True
+        return fitness >= self.best_fitness * (1 - self.policy.elite_margin)
+
+    def penalized_fitness(self):
+        # Aborted individuals rank with the worst complete evaluation
+        if self.worst_fitness is None:
+            return 0.
+        return float(self.worst_fitness)
+
     def fake_eval(self, individual):        
         return (float(10.5),)
 
@@ -113,6 +342,11 @@ def time_squared_fitness(current_metrics, baseline_metrics):
     baseline_time = baseline_metrics['time']
     return np.square(baseline_time/float(current_time))
 
+def plan_cost_fitness(current_metrics, baseline_metrics):
+    current_cost = current_metrics['plan_cost']
+    baseline_cost = baseline_metrics['plan_cost']
+    return baseline_cost/float(current_cost)
+
 # Never use this 
 # this is just for debug purposes 
 def dbsize_fitness(current_metrics, baseline_metrics):
@@ -134,30 +368,31 @@ __fitness__ = {
     'qphh': {
         'function': default_fitness,
         'needed_metrics': [
-            'qphh', 
-            'dbsize',
-            'time'
+            'qphh'
         ]
     },
     'time': {
         'function': time_fitness,
         'needed_metrics': [
-            'time',
-            'dbsize',
+            'time'
         ]
     },
     'time_squared': {
         'function': time_squared_fitness,
         'needed_metrics': [
-            'time',
-            'dbsize'
+            'time'
+        ]
+    },
+    'plan_cost': {
+        'function': plan_cost_fitness,
+        'needed_metrics': [
+            'plan_cost'
         ]
     },
     'dbsize': {
         'function': dbsize_fitness,
         'needed_metrics': [
-            'time',
-            'dbsize',            
+            'index_size'
         ]
     },    
 }
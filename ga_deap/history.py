@@ -1,22 +1,31 @@
 import os
+import json
 import logging
+import struct
 from collections import defaultdict
 
+import numpy as np
+
 import utils
 
 logger = logging.getLogger(__name__)
 
+# generation (uint32) and number of metric values (uint16) of a record
+RECORD_HEADER = struct.Struct('<IH')
+
+
 class History:
+    '''
+        Append-only record of every evaluation.
+
+        Each evaluation is appended to history.bin as a fixed header,
+        the individual packed as bits and one float64 per metric, so
+        recording costs O(1) regardless of the length of the run.
+        Metric names (and their column order) live in history.schema.json,
+        which is only rewritten when a new metric shows up, along with the
+        measurement settings of the run (see experiment.measurement_settings).
+        export_json() writes the nested history.json used by the notebook:
 
-    def __init__(self, path, file_name='history.json', tensorboard=False):
-        utils.ensure_dir(path)        
-        self.path = path        
-        self.filepath = os.path.join(self.path, file_name)
-        self.generation = 0
-        self.history = defaultdict(dict)
-        self.tensorboard = tensorboard
-        self.n_individuals = 0
-        '''
             history = {
                 generation_x: {
                     individual: {
@@ -24,30 +33,222 @@ class History:
                     }
                 }
             }
-        '''
-        logger.info(f'Recording history dump to {self.filepath}')
+    '''
+
+    def __init__(self, path, file_name='history.json', tensorboard=False,
+                 store_name='history.bin', resume=False, settings=None):
+        utils.ensure_dir(path)
+        self.__init_store(path, file_name, store_name)
+        self.tensorboard = tensorboard
+
+        if resume and os.path.exists(self.storepath):
+            self.load()
+        else:
+            for stale in (self.storepath, self.schemapath):
+                if os.path.exists(stale):
+                    os.remove(stale)
+        if settings is not None:
+            self.settings = settings
+        self.store = open(self.storepath, 'ab')
+        logger.info(f'Recording history to {self.storepath}')
 
         if tensorboard:
             from tensorboardX import SummaryWriter
             self.tb_writer = SummaryWriter(self.path)
             logger.debug(f'Using tensorboard at {self.path}')
 
+    def __init_store(self, path, file_name, store_name):
+        self.path = path
+        self.filepath = os.path.join(self.path, file_name)
+        self.storepath = os.path.join(self.path, store_name)
+        self.schemapath = os.path.splitext(self.storepath)[0] + '.schema.json'
+        self.generation = 0
+        self.tensorboard = False
+        self.n_individuals = 0
+
+        # Columns of the store, kept in memory for records()
+        self.state_size = None
+        self.metric_names = []
+        self.settings = None
+        self.metric_index = dict()
+        self.generations = []
+        self.genomes = []
+        self.values = []
+        # Byte offset of each record in the store
+        self.offsets = []
+
+    @classmethod
+    def read(cls, path):
+        '''
+            Read-only History of an earlier run, from its history.bin
+            (or the directory holding it). The store is only opened
+            for reading and a partially written last record is ignored.
+        '''
+        path = os.path.abspath(path)
+        if os.path.isdir(path):
+            path = os.path.join(path, 'history.bin')
+        history = cls.__new__(cls)
+        history.__init_store(os.path.dirname(path), 'history.json', os.path.basename(path))
+        history.load(repair=False)
+        return history
+
+    def __len__(self):
+        return len(self.genomes)
+
+    def __write_schema(self):
+        utils.save_json(self.schemapath, {
+            'state_size': self.state_size,
+            'metrics': self.metric_names,
+            'settings': self.settings
+        })
+
+    def __metric_column(self, metric):
+        if metric not in self.metric_index:
+            self.metric_index[metric] = len(self.metric_names)
+            self.metric_names.append(metric)
+            self.__write_schema()
+        return self.metric_index[metric]
+
+    def load(self, repair=True):
+        '''
+            Reads the records of the store, truncating a partially
+            written last one unless not repair
+        '''
+        with open(self.schemapath, 'r') as f:
+            schema = json.load(f)
+        self.state_size = schema['state_size']
+        self.metric_names = schema['metrics']
+        self.settings = schema.get('settings')
+        self.metric_index = {m: k for k, m in enumerate(self.metric_names)}
+        n_bytes = (self.state_size + 7) // 8
+
+        with open(self.storepath, 'rb') as f:
+            data = f.read()
+        offset = 0
+        while offset + RECORD_HEADER.size <= len(data):
+            generation, n_values = RECORD_HEADER.unpack_from(data, offset)
+            begin = offset + RECORD_HEADER.size
+            end = begin + n_bytes + 8 * n_values
+            if end > len(data):
+                # Partially written record (e.g. after a crash)
+                break
+            self.offsets.append(offset)
+            self.generations.append(generation)
+            self.genomes.append(data[begin:begin + n_bytes])
+            self.values.append(np.frombuffer(data, dtype='<f8', count=n_values,
+                                             offset=begin + n_bytes).copy())
+            offset = end
+
+        self.n_individuals = len(self.genomes)
+        if self.generations:
+            self.generation = self.generations[-1]
+        if offset < len(data) and repair:
+            self.truncate(len(self.genomes), size=offset)
+        logger.info(f'Loaded {len(self)} history records from {self.storepath}')
+
+    def truncate(self, n_records, size=None):
+        '''
+            Drops every record after the first n_records
+        '''
+        if size is None:
+            size = self.offsets[n_records] if n_records < len(self.offsets) else os.path.getsize(self.storepath)
+        if hasattr(self, 'store'):
+            self.store.flush()
+        with open(self.storepath, 'r+b') as f:
+            f.truncate(size)
+        for column in (self.offsets, self.generations, self.genomes, self.values):
+            del column[n_records:]
+        self.n_individuals = len(self.genomes)
+
     def update(self, individual, metrics: dict):
         logger.debug('History - updating metrics')
-        individual = ' '.join([str(x) for x in individual])
+        bits = np.asarray(individual, dtype=np.float64).astype(np.uint8)
+        if self.state_size is None:
+            self.state_size = len(bits)
+            self.__write_schema()
+        genome = np.packbits(bits).tobytes()
+
+        values = np.full(len(self.metric_names), np.nan)
+        for metric, value in metrics.items():
+            column = self.__metric_column(metric)
+            if column >= len(values):
+                values = np.append(values, np.full(column + 1 - len(values), np.nan))
+            values[column] = float(value)
+
+        self.offsets.append(self.store.tell())
+        self.store.write(RECORD_HEADER.pack(self.generation, len(values)))
+        self.store.write(genome)
+        self.store.write(values.astype('<f8').tobytes())
+        self.generations.append(self.generation)
+        self.genomes.append(genome)
+        self.values.append(values)
+
         self.n_individuals += 1
         if self.tensorboard:
-            for metric, value in metrics.items():                                
+            for metric, value in metrics.items():
                 self.tb_writer.add_scalar(f'metrics/{metric.title()}', value, self.n_individuals)
                 logger.debug(f'Writing to tensorboard {metric.title(), value}')
-        self.history[self.generation][individual] = metrics
-    
-    def update_generation(self,):        
+
+    def __unpack(self, k):
+        bits = np.unpackbits(np.frombuffer(self.genomes[k], dtype=np.uint8))
+        individual = bits[:self.state_size].astype(int).tolist()
+        metrics = {
+            self.metric_names[column]: float(value)
+            for column, value in enumerate(self.values[k]) if not np.isnan(value)
+        }
+        return individual, metrics
+
+    def records(self, low_fidelity=False):
+        '''
+            Iterates over (individual, metrics) of all recorded evaluations.
+            Those made on a down-scaled database (see fidelity.py) are
+            left out unless low_fidelity.
+        '''
+        for k in range(len(self)):
+            individual, metrics = self.__unpack(k)
+            if low_fidelity or not metrics.get('low_fidelity'):
+                yield individual, metrics
+
+    def update_generation(self,):
         self.generation += 1
         if self.tensorboard:
             self.tb_writer.add_scalar('train/Generations', self.generation, self.generation)
         logger.debug(f'Updated generation to {self.generation}')
-    
+
     def serialize(self):
-        logger.debug(f'Updating history logs on disk at {self.filepath}')
-        utils.save_json(self.filepath, self.history)
+        # Records are already on disk, only make sure they are flushed
+        self.store.flush()
+
+    def export_json(self, filepath=None):
+        '''
+            Nested history.json of the full fidelity records, those of
+            the down-scaled databases would overwrite them
+        '''
+        filepath = filepath or self.filepath
+        logger.debug(f'Exporting history logs to {filepath}')
+        history = defaultdict(dict)
+        for k in range(len(self)):
+            individual, metrics = self.__unpack(k)
+            if metrics.get('low_fidelity'):
+                continue
+            individual = ' '.join([str(x) for x in individual])
+            history[self.generations[k]][individual] = metrics
+        utils.save_json(filepath, history)
+
+
+def read_records(path):
+    '''
+        Iterates over (individual, metrics) recorded by an earlier run,
+        either in its history.json export or in its history.bin store
+    '''
+    if path.endswith('.json'):
+        with open(path, 'r') as f:
+            history = json.load(f)
+        for generation in history.values():
+            for individual, metrics in generation.items():
+                if metrics.get('low_fidelity'):
+                    continue
+                yield [int(float(x)) for x in individual.split()], metrics
+    else:
+        for record in History.read(path).records():
+            yield record
@@ -0,0 +1,107 @@
+import logging
+
+import numpy as np
+from scipy import stats
+
+logger = logging.getLogger(__name__)
+
+
+class MeasurementPolicy:
+    '''
+        How the benchmark metrics of an individual are sampled.
+
+        After applying the indexes, warmup unmeasured query streams are
+        run. Then the repeated metrics (qphh and time) are measured
+        repetitions times, preparing the buffer pool before each one
+        according to cache_state:
+
+            keep: whatever the previous measurement left behind
+            warm: one unmeasured query stream right before
+            cold: Benchmark.prepare_cache('cold') (see config.COLD_CACHE_COMMAND)
+
+        The samples are aggregated with the median, a trimmed mean or
+        the mean, and the confidence interval of the summary metrics is
+        reported as <metric>_ci_low and <metric>_ci_high.
+
+        In adaptive mode the repetitions are only made when the first
+        sample is within elite_margin of the best fitness so far.
+    '''
+
+    # Metric functions whose results are worth repeating
+    REPEATED = ['qphh', 'time']
+    # Metrics reported with a confidence interval
+    SUMMARY = ['time', 'power', 'throughput', 'qphh']
+
+    def __init__(self, warmup=0, repetitions=1, cache_state='keep',
+                 aggregate='median', trim=0.2, confidence=0.95,
+                 adaptive=False, elite_margin=0.05):
+        if cache_state not in ('keep', 'warm', 'cold'):
+            raise ValueError(f'Unknown cache state {cache_state}')
+        if aggregate not in ('median', 'trimmed_mean', 'mean'):
+            raise ValueError(f'Unknown aggregate {aggregate}')
+        self.warmup = warmup
+        self.repetitions = max(1, repetitions)
+        self.cache_state = cache_state
+        self.aggregate = aggregate
+        self.trim = trim
+        self.confidence = confidence
+        self.adaptive = adaptive
+        self.elite_margin = elite_margin
+        self.n_samples = 0
+        self.n_saved = 0
+
+    def warm_up(self, benchmark):
+        for _ in range(self.warmup):
+            benchmark.run_unmeasured_stream()
+
+    def measure(self, metric_fn, benchmark, promising=None):
+        '''
+            Samples metric_fn and aggregates its results. promising(sample)
+            tells the adaptive mode whether the individual is worth the
+            repetitions.
+        '''
+        samples = []
+        for k in range(self.repetitions):
+            benchmark.prepare_cache(self.cache_state)
+            sample = metric_fn()
+            samples.append(sample)
+            self.n_samples += 1
+            if sample.get('aborted'):
+                # Hopeless individual, one sample is enough
+                break
+            if k == 0 and self.adaptive and promising is not None and not promising(sample):
+                self.n_saved += self.repetitions - 1
+                logger.debug('Far from the elite, not repeating the measurement')
+                break
+        if len(samples) == 1:
+            return samples[0]
+        return self.combine(samples)
+
+    def __aggregate(self, values):
+        if self.aggregate == 'median':
+            return float(np.median(values))
+        if self.aggregate == 'trimmed_mean':
+            return float(stats.trim_mean(values, self.trim))
+        return float(np.mean(values))
+
+    def combine(self, samples):
+        aborted = [sample for sample in samples if sample.get('aborted')]
+        if aborted:
+            # A truncated sample is no measurement of the individual,
+            # which is aborted rather than averaged with it
+            return {**aborted[0], 'repetitions': len(samples)}
+        metrics = dict()
+        for key in samples[0]:
+            values = np.asarray([sample[key] for sample in samples if key in sample], dtype=np.float64)
+            metrics[key] = self.__aggregate(values)
+            if key in self.SUMMARY:
+                # Student's t interval of the mean of the samples
+                half_width = stats.sem(values) * stats.t.ppf((1 + self.confidence) / 2, len(values) - 1)
+                metrics[f'{key}_ci_low'] = metrics[key] - half_width
+                metrics[f'{key}_ci_high'] = metrics[key] + half_width
+        metrics['repetitions'] = len(samples)
+        logger.debug(f'Combined {len(samples)} samples: {metrics}')
+        return metrics
+
+    def stats(self):
+        return {'samples': self.n_samples, 'saved': self.n_saved}
@@ -0,0 +1,73 @@
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+QUERY_METRICS = ['Q%d' % k for k in range(1, 23)]
+
+# Raw measurements of an evaluation, cheapest first, and the metrics each
+# one yields. The names are the ones the Objective and the
+# MeasurementPolicy refer to them by.
+MEASUREMENTS = OrderedDict([
+    # EXPLAIN of the query views, nothing is executed
+    ('plan_cost', ['plan_cost'] + ['%s_cost' % query for query in QUERY_METRICS]),
+    # ANALYZE TABLE and the size of each index
+    ('dbsize', ['data_size', 'index_size']),
+    # One profiled query stream, its per-query latencies are prefixed
+    ('time', ['time', 'aborted'] + ['stream_%s' % query for query in QUERY_METRICS]),
+    # Power test, whose profiled query stream also gives the time and
+    # the per-query latencies, and throughput test
+    ('qphh', ['qphh', 'power', 'throughput', 'time', 'aborted', 'RF1', 'RF2'] + QUERY_METRICS),
+])
+
+
+# Measurements that run queries, their metrics follow the query plans
+RUNTIME = ['time', 'qphh']
+
+
+class MetricPlanner:
+    '''
+        Works out the raw measurements needed for a set of metrics, so
+        each one runs at most once per evaluation: e.g. the qphh fitness
+        only runs the power and throughput tests, its time and per-query
+        latencies come from the power test's query stream.
+    '''
+
+    def __init__(self, benchmark, storage=None):
+        self.providers = {
+            'plan_cost': benchmark.get_plan_cost,
+            # Optional IndexSizeEstimator predicting the storage metrics
+            'dbsize': (
+                benchmark.get_storage_size if storage is None
+                else storage.get_storage_size
+            ),
+            'time': benchmark.get_runtime,
+            'qphh': benchmark.get_qphh,
+        }
+
+    def sources(self, metric):
+        return [name for name, metrics in MEASUREMENTS.items() if metric in metrics]
+
+    def plan(self, metrics):
+        '''
+            Smallest set of measurements yielding all the metrics, as an
+            ordered {measurement: function}. Measurements that are the only
+            source of a metric are taken first, then the cheapest source
+            of each metric still missing.
+        '''
+        chosen = set()
+        for metric in metrics:
+            sources = self.sources(metric)
+            if not sources:
+                raise ValueError(f'No measurement yields the metric {metric}')
+            if len(sources) == 1:
+                chosen.add(sources[0])
+        for metric in metrics:
+            if not any(metric in MEASUREMENTS[name] for name in chosen):
+                chosen.add(self.sources(metric)[0])
+
+        plan = OrderedDict(
+            (name, self.providers[name]) for name in MEASUREMENTS if name in chosen
+        )
+        logger.debug(f'Measurements planned for {list(metrics)}: {list(plan)}')
+        return plan
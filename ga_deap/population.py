@@ -0,0 +1,84 @@
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class PopulationEngine:
+    '''
+        Genetic operators over the whole population at once, held as a
+        (pop_size, state_size) uint8 matrix instead of a list of DEAP
+        individuals. Mirrors the toolbox used by train.py: two-point
+        crossover of consecutive pairs and bit-flip mutation as in
+        algorithms.varAnd, and tournament selection.
+
+        Random numbers come from the global numpy RNG, so they are
+        saved and restored by the checkpoints.
+    '''
+
+    def __init__(self, state_size, cxpb=0.8, mutpb=0.2, indpb=0.05, tournsize=4):
+        self.state_size = state_size
+        self.cxpb = cxpb
+        self.mutpb = mutpb
+        self.indpb = indpb
+        self.tournsize = tournsize
+
+    def random(self, n):
+        return np.random.randint(0, 2, size=(n, self.state_size)).astype(np.uint8)
+
+    def crossover(self, genomes):
+        '''
+            Two-point crossover of pairs (0, 1), (2, 3), ... with
+            probability cxpb, the same cut points as tools.cxTwoPoint
+        '''
+        n_pairs = len(genomes) // 2
+        mates = np.flatnonzero(np.random.rand(n_pairs) < self.cxpb)
+        if len(mates) == 0:
+            return genomes
+        # random.randint(1, size) and (1, size - 1) of tools.cxTwoPoint,
+        # numpy's upper bound is exclusive
+        cx1 = np.random.randint(1, self.state_size + 1, size=len(mates))
+        cx2 = np.random.randint(1, self.state_size, size=len(mates))
+        cx2 = np.where(cx2 >= cx1, cx2 + 1, cx2)
+        cx1, cx2 = np.minimum(cx1, cx2), np.maximum(cx1, cx2)
+        positions = np.arange(self.state_size)
+        swap = (positions >= cx1[:, None]) & (positions < cx2[:, None])
+
+        first, second = genomes[2 * mates], genomes[2 * mates + 1]
+        genomes[2 * mates] = np.where(swap, second, first)
+        genomes[2 * mates + 1] = np.where(swap, first, second)
+        return genomes
+
+    def mutate(self, genomes):
+        # Each mutated individual flips each bit with probability indpb
+        mutants = np.random.rand(len(genomes)) < self.mutpb
+        flips = np.random.rand(*genomes.shape) < self.indpb
+        genomes ^= (flips & mutants[:, None]).astype(np.uint8)
+        return genomes
+
+    def vary(self, genomes):
+        offspring = np.array(genomes, dtype=np.uint8, copy=True)
+        return self.mutate(self.crossover(offspring))
+
+    def select(self, fitness, k):
+        '''
+            Indices of the k winners of tournaments of tournsize
+            individuals drawn with replacement
+        '''
+        fitness = np.asarray(fitness, dtype=np.float64)
+        aspirants = np.random.randint(0, len(fitness), size=(k, self.tournsize))
+        return aspirants[np.arange(k), np.argmax(fitness[aspirants], axis=1)]
+
+    def unique(self, genomes):
+        '''
+            Rows without duplicates and, for each row of genomes,
+            the index of its unique row
+        '''
+        packed = np.packbits(genomes, axis=1)
+        _, first, inverse = np.unique(packed, axis=0, return_index=True, return_inverse=True)
+        return genomes[first], inverse.reshape(-1)
+
+    def best(self, genomes, fitness, k):
+        order = np.argsort(-np.asarray(fitness, dtype=np.float64), kind='stable')[:k]
+        return genomes[order], np.asarray(fitness)[order]
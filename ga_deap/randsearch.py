@@ -3,13 +3,12 @@ import random
 
 import numpy as np
 
-import utils
-from benchmark import Benchmark
-from database import Database
+import experiment
 from deap import algorithms, base, creator, tools
-from fitness import (Objective, fake_metric, get_available_fitness,
-                     get_fitness_fn)
+from fitness import fake_metric
 from history import History
+from population import PopulationEngine
+from scheduler import EvaluationScheduler
 
 
 def get_params():
@@ -17,17 +16,12 @@ def get_params():
 
     parser = argparse.ArgumentParser()
 
-    parser.add_argument('-p', '--pop_size', type=int, default=50)    
-    parser.add_argument('-g', '--generations', type=int, default=100)
-    parser.add_argument('-o', '--outpath', type=str, default='runs/')
-    parser.add_argument('-f', '--fitness', type=str,
-        default='qphh', choices=get_available_fitness())
-    parser.add_argument('--debug', action='store_true')
-    # WARNING: use this only for debugging fast
-    parser.add_argument('--use_fake_eval', action='store_true')
-    parser.add_argument('--use_tensorboard', action='store_true')
-
-    args = parser.parse_args()
+    experiment.add_arguments(parser)
+    # numpy samples the population as a bit matrix without duplicates
+    parser.add_argument('--engine', type=str, default='deap',
+        choices=['deap', 'numpy'])
+
+    args = experiment.check_arguments(parser, parser.parse_args())
     print('\n* * * Arguments * * * ')
     print(args)
     return args
@@ -35,37 +29,31 @@ def get_params():
 
 def train(args):
 
-    # Get the connection string as defined in config.py file 
-    connection_string = utils.get_conn_str()
-
-    # Creates a database object for handling db connections
-    # Queries and index creation
-    database = Database(
-        connection_string=connection_string,
-        reset_indexes=True
-    )
+    # MySQL server or simulated backend
+    database, benchmark = experiment.build_backend(args)
 
     # Number of columns to optimize indexing 
     # (i.e., size of each individual)
     state_size = database.state_size
 
-    # Benchmark object allows running power testes, get storage size
-    # query time and other performance metrics on the database
-    benchmark = Benchmark(database)    
-
     # Record all metrics and save them to disk
     history = History(
         path=args.outpath, 
         file_name='history.json', 
-        tensorboard=args.use_tensorboard
+        tensorboard=args.use_tensorboard,
+        settings=experiment.measurement_settings(args, benchmark)
     )
 
     # Objective allows the fitness evaluation
     # by using the benchmark metrics
-    objective = Objective(
-        benchmark=benchmark, 
-        fitness_name=args.fitness,
-        history=history
+    objective = experiment.build_objective(args, benchmark, history)
+    cache = objective.cache
+
+    # Reorders each generation to minimize the index builds and drops
+    scheduler = EvaluationScheduler(
+        database=database,
+        strategy=args.schedule,
+        is_cached=cache.__contains__ if cache is not None else None
     )
 
     if args.use_fake_eval:
@@ -73,27 +61,47 @@ def train(args):
                  No updates to the database would be made.''')
         objective.get_state_metrics = fake_metric
 
+    # Evaluations run in this process or spread over the replicas
+    evaluator = experiment.build_evaluator(args, objective, database)
+
     # Using the initial state as baseline individual
-    objective.eval_baseline([0] * state_size)
+    evaluator.eval_baseline([0] * state_size)
 
     
     toolbox = base.Toolbox()
 
     # Set up the evaluation of the fitness function
     toolbox.register("evaluate", objective.evaluate)    
+    toolbox.register("map", evaluator.map)
+
+    engine = PopulationEngine(state_size=state_size)
 
     # Train the Genetic Algorithm for some generations
     NGEN = args.generations
     for gen in range(NGEN):
         history.update_generation()
         # Apply mutation and crossover on the population 
-        offspring = np.random.randint(0, 2, size=(args.pop_size, state_size))
-        # Evaluate the fitness of each individual
+        if args.engine == 'numpy':
+            # Duplicated genomes are evaluated once
+            offspring, _ = engine.unique(engine.random(args.pop_size))
+        else:
+            offspring = np.random.randint(0, 2, size=(args.pop_size, state_size))
+        # Evaluate the fitness of each individual,
+        # in the order that requires the least index changes
+        offspring = scheduler.schedule(offspring)
         fits = toolbox.map(toolbox.evaluate, offspring)
         # Log and assign the calculated fitness for each individual
         for fit, ind in zip(fits, offspring):
-            logger.info(f'Evaluated ind {ind}, result: {fit}')                
-        
+            logger.info(f'Evaluated ind {ind}, result: {fit}')
+        if cache is not None:
+            logger.info(f'Evaluation cache: {cache.stats()}')
+
+    experiment.log_stats(objective, evaluator)
+
+    evaluator.close()
+    benchmark.close()
+    # Nested json export of the history for the notebook
+    history.export_json()
     logger.info(f'Done.')
 
 
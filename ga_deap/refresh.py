@@ -0,0 +1,274 @@
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Refresh temp tables read by the refresh function procedures
+# and the dbgen file each one is loaded from
+REFRESH_TABLES = {
+    'rfdelete': 'delete.{}',
+    'orders_temp': 'orders.tbl.u{}',
+    'lineitem_temp': 'lineitem.tbl.u{}',
+}
+# Tables RF1 inserts into and RF2 deletes from
+REFRESHED_TABLES = ('orders', 'lineitem')
+
+
+def count_refresh_sets(path):
+    '''
+        Number of complete refresh sets (1, 2, ...) available in path
+    '''
+    n_sets = 0
+    while all(
+        os.path.exists(os.path.join(path, pattern.format(n_sets + 1)))
+        for pattern in REFRESH_TABLES.values()
+    ):
+        n_sets += 1
+    return n_sets
+
+
+class RefreshPipeline:
+    '''
+        Loads the refresh sets used by the power and throughput tests.
+
+        Upcoming sets are bulk-loaded in a background thread into shadow
+        copies of the refresh temp tables (<table>_stage<slot>) while the
+        current evaluation is running, so activating a set is a single
+        atomic RENAME TABLE swapping the staged tables in. With depth=0
+        the sets are loaded straight into the temp tables when needed.
+
+        Each refresh stream number uses its own set of files: RF1 would
+        insert duplicate keys if a set was applied twice, so running out
+        of the n_sets sets available in path is an error.
+
+        The staging thread is only alive while sets are being staged
+        ahead, suspend() stops it before the process forks.
+    '''
+
+    def __init__(self, pool, path, depth=2):
+        self.pool = pool
+        self.path = path
+        self.depth = depth
+        self.n_sets = count_refresh_sets(path)
+        if self.n_sets == 0:
+            raise FileNotFoundError(f'No refresh files found in {path}')
+
+        self.lock = threading.Lock()
+        # Set number -> future of the slot it is being staged in
+        self.staged = dict()
+        self.free_slots = list(range(depth))
+        # Started by the first prefetch
+        self.executor = None
+        if depth:
+            self.__create_stage_tables()
+        logger.info(f'Refresh pipeline over {self.n_sets} sets of {path}, {depth} staged ahead')
+
+    def file_number(self, number):
+        if not 1 <= number <= self.n_sets:
+            raise FileNotFoundError(
+                f'Refresh set {number} is not available, {self.path} only holds '
+                f'{self.n_sets} sets (generate more with dbgen -U)'
+            )
+        return number
+
+    def __create_stage_tables(self):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            for slot in self.free_slots:
+                for table in REFRESH_TABLES:
+                    cursor.execute(
+                        'CREATE TABLE IF NOT EXISTS %s_stage%d LIKE %s;' % (table, slot, table)
+                    )
+            conn.commit()
+            cursor.close()
+
+    def __load(self, number, slot=None):
+        # Loads the set into the stage tables of slot, or the temp tables
+        suffix = '' if slot is None else '_stage%d' % slot
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            for table, pattern in REFRESH_TABLES.items():
+                filepath = os.path.join(self.path, pattern.format(self.file_number(number)))
+                cursor.execute('TRUNCATE TABLE %s%s;' % (table, suffix))
+                cursor.execute(
+                    "load data local infile '{}' into table {}{} fields terminated by '|' "
+                    "lines terminated by '\n';".format(filepath, table, suffix)
+                )
+            conn.commit()
+            cursor.close()
+        logger.debug(f'Loaded refresh set {number} into {suffix or "the temp tables"}')
+        return slot
+
+    def prefetch(self, numbers):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=1)
+            for number in numbers:
+                if number in self.staged or number > self.n_sets or not self.free_slots:
+                    continue
+                slot = self.free_slots.pop(0)
+                self.staged[number] = self.executor.submit(self.__load, number, slot)
+
+    def __discard(self):
+        # Staged sets that will never be used (e.g. the counter jumped)
+        for number in list(self.staged):
+            self.free_slots.append(self.staged.pop(number).result())
+
+    def activate(self, number):
+        '''
+            Makes refresh set number the content of the refresh temp
+            tables, then starts staging the sets that follow it
+        '''
+        # Fails before touching the temp tables
+        self.file_number(number)
+        if not self.depth:
+            self.__load(number)
+            return
+
+        with self.lock:
+            if number not in self.staged:
+                self.__discard()
+        self.prefetch([number])
+        slot = self.staged[number].result()
+
+        swaps = []
+        for table in REFRESH_TABLES:
+            stage = '%s_stage%d' % (table, slot)
+            swaps += [
+                '%s TO %s_swap' % (table, table),
+                '%s TO %s' % (stage, table),
+                '%s_swap TO %s' % (table, stage),
+            ]
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('RENAME TABLE %s;' % ', '.join(swaps))
+            cursor.close()
+
+        with self.lock:
+            del self.staged[number]
+            # The slot now holds the previous set, reloaded when reused
+            self.free_slots.append(slot)
+        self.prefetch(range(number + 1, number + 1 + self.depth))
+        logger.debug(f'Activated refresh set {number} (file {self.file_number(number)})')
+
+    def suspend(self):
+        '''
+            Waits for the sets being staged and stops the staging thread,
+            so a forked process never inherits it in the middle of a load
+            (holding the logging or connection pool locks). The next
+            prefetch starts a new one.
+        '''
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def close(self):
+        self.suspend()
+
+
+class RefreshAllocator:
+    '''
+        Hands out ranges of refresh stream numbers that never overlap,
+        even between benchmarks running in other threads or processes.
+
+        Allocations are appended to a SQLite ledger (one row per range,
+        with the evaluation and process that consumed it) inside an
+        immediate transaction, which serializes concurrent allocators.
+        refresh_stream_number.txt is kept as a mirror of the next number,
+        and seeds the ledger when it is created.
+    '''
+
+    def __init__(self, path, file_name='refresh_ledger.db',
+                 counter_name='refresh_stream_number.txt', timeout=60.):
+        self.filepath = os.path.join(path, file_name)
+        self.counterpath = os.path.join(path, counter_name)
+        self.timeout = timeout
+        self.owner = f'{socket.gethostname()}:{os.getpid()}'
+        with self.__transaction() as ledger:
+            ledger.execute(
+                'CREATE TABLE IF NOT EXISTS refresh_sets ('
+                'first INTEGER NOT NULL, last INTEGER NOT NULL, '
+                'evaluation TEXT, owner TEXT, allocated_at REAL)'
+            )
+
+    @contextmanager
+    def __transaction(self):
+        # A new connection per call, so it is safe across threads and forks
+        ledger = sqlite3.connect(self.filepath, timeout=self.timeout, isolation_level=None)
+        try:
+            # BEGIN IMMEDIATE takes the write lock up front, so two
+            # allocators can never read the same next number
+            ledger.execute('BEGIN IMMEDIATE')
+            try:
+                yield ledger
+            except BaseException:
+                ledger.execute('ROLLBACK')
+                raise
+            ledger.execute('COMMIT')
+        finally:
+            ledger.close()
+
+    def __next_number(self, ledger):
+        last, = ledger.execute('SELECT MAX(last) FROM refresh_sets').fetchone()
+        if last is not None:
+            return last + 1
+        if os.path.exists(self.counterpath):
+            with open(self.counterpath, 'r') as f:
+                return int(f.read())
+        return 1
+
+    def __write_counter(self, number):
+        tmp_path = self.counterpath + '.%d.tmp' % os.getpid()
+        with open(tmp_path, 'w') as f:
+            f.write('%d' % number)
+        os.replace(tmp_path, self.counterpath)
+
+    def allocate(self, n_sets, evaluation=None):
+        '''
+            Reserves n_sets consecutive refresh stream numbers and
+            returns the first one
+        '''
+        with self.__transaction() as ledger:
+            first = self.__next_number(ledger)
+            ledger.execute(
+                'INSERT INTO refresh_sets VALUES (?, ?, ?, ?, ?)',
+                (first, first + n_sets - 1, evaluation, self.owner, time.time())
+            )
+            self.__write_counter(first + n_sets)
+        logger.debug(f'Allocated refresh sets {first}..{first + n_sets - 1} to {evaluation}')
+        return first
+
+    def skip_to(self, number, evaluation='skipped'):
+        '''
+            Makes sure the next allocation starts at number or later
+        '''
+        with self.__transaction() as ledger:
+            first = self.__next_number(ledger)
+            if first < number:
+                ledger.execute(
+                    'INSERT INTO refresh_sets VALUES (?, ?, ?, ?, ?)',
+                    (first, number - 1, evaluation, self.owner, time.time())
+                )
+                self.__write_counter(number)
+
+    def consumed(self, evaluation=None):
+        '''
+            (first, last, evaluation, owner, allocated_at) of the
+            recorded allocations, optionally of one evaluation only
+        '''
+        with self.__transaction() as ledger:
+            if evaluation is None:
+                rows = ledger.execute('SELECT * FROM refresh_sets ORDER BY first')
+            else:
+                rows = ledger.execute(
+                    'SELECT * FROM refresh_sets WHERE evaluation = ? ORDER BY first', (evaluation,)
+                )
+            return rows.fetchall()
+
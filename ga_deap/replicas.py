@@ -0,0 +1,263 @@
+import logging
+from collections import deque
+from multiprocessing import Process, Queue
+from queue import Empty
+
+import utils
+from cache import pack_individual
+
+logger = logging.getLogger(__name__)
+
+
+def parse_replica(replica):
+    '''
+        'host:port' -> {'host': host, 'port': port}
+    '''
+    host, _, port = replica.partition(':')
+    overrides = {'host': host}
+    if port:
+        overrides['port'] = int(port)
+    return overrides
+
+
+class SerialEvaluator:
+    '''
+        Evaluates the individuals one at a time in the current process,
+        against the database owned by the objective.
+    '''
+
+    def __init__(self, objective):
+        self.objective = objective
+        # Evaluations that can run at the same time
+        self.slots = 1
+        self.pending = deque()
+        self.n_submitted = 0
+
+    def submit(self, individual):
+        ticket = self.n_submitted
+        self.n_submitted += 1
+        self.pending.append((ticket, individual))
+        return ticket
+
+    def collect(self):
+        # Measures the oldest submitted individual
+        ticket, individual = self.pending.popleft()
+        return ticket, self.objective.get_state_metrics(individual)
+
+    def eval_baseline(self, baseline_individual):
+        self.objective.eval_baseline(baseline_individual)
+
+    def measure(self, individuals):
+        return [self.objective.get_state_metrics(ind) for ind in individuals]
+
+    def map(self, func, individuals):
+        return list(map(func, individuals))
+
+    def close(self):
+        pass
+
+
+def replica_worker(replica_id, conn_config, pool_size, database_kwargs,
+                   benchmark_kwargs, fitness_name, policy, record, tasks, results):
+    # Imported here so the parent does not need a connection per replica
+    from benchmark import Benchmark
+    from connection import ConnectionPool
+    from database import Database
+    from fitness import Objective
+
+    pool = ConnectionPool(
+        conn_config=conn_config,
+        size=pool_size,
+        name=f'replica_{replica_id}'
+    )
+    database = Database(pool=pool, reset_indexes=True, **database_kwargs)
+    benchmark = Benchmark(database, **benchmark_kwargs)
+    # Same measurements as the parent objective, history-only metrics included
+    objective = Objective(
+        benchmark=benchmark,
+        fitness_name=fitness_name,
+        policy=policy,
+        record=record
+    )
+    logger.info(f'Replica {replica_id} ready at {conn_config["host"]}:{conn_config.get("port", 3306)}')
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        ticket, individual, time_budget, elite = task
+        # Bounded evaluation budget decided by the parent objective
+        benchmark.time_budget = time_budget
+        if elite is not None:
+            # Adaptive repetitions compare with the parent's best fitness
+            objective.baseline_metrics, objective.best_fitness = elite
+        try:
+            metrics = objective.get_state_metrics(individual)
+            metrics['replica'] = replica_id
+            results.put((ticket, metrics, None))
+        except Exception as ex:
+            logger.exception(f'Replica {replica_id} failed to evaluate {individual}')
+            results.put((ticket, None, repr(ex)))
+    benchmark.close()
+
+
+class ReplicaEvaluator:
+    '''
+        Dispatches the evaluations to a pool of database replicas,
+        each one owned by a worker process holding its own
+        Database and Benchmark. Idle workers take the next pending
+        individual, so the load is balanced across replicas.
+
+        Only the raw metrics are measured by the workers, fitness,
+        cache and history are still handled by the objective here.
+        The baseline is measured on a replica too, so every fitness
+        compares measurements of the same kind of server. The baseline
+        and best fitness go along with each task, for the adaptive
+        repetitions of the measurement policy.
+
+        Waiting for results checks that the workers are still alive.
+        After an error the pending evaluations are dropped: the queued
+        ones are withdrawn and the running ones awaited and discarded.
+    '''
+
+    # Seconds between two liveness checks while waiting for a result
+    POLL_INTERVAL = 5.
+
+    def __init__(self, objective, replicas, pool_size=4,
+                 database_kwargs=None, benchmark_kwargs=None):
+        self.objective = objective
+        self.tasks = Queue()
+        self.results = Queue()
+        self.n_submitted = 0
+        # Tickets submitted and not collected yet
+        self.outstanding = set()
+        # Workers that died since the last drain, each with at most
+        # one evaluation that will never be returned
+        self.n_lost = 0
+        self.workers = []
+        # The workers fork from this process
+        objective.benchmark.suspend_refresh_staging()
+        for replica_id, replica in enumerate(replicas):
+            conn_config = utils.get_conn_dict(**replica)
+            worker = Process(
+                target=replica_worker,
+                args=(replica_id, conn_config, pool_size,
+                      database_kwargs or {}, benchmark_kwargs or {},
+                      objective.fitness_name, objective.policy,
+                      objective.record, self.tasks, self.results)
+            )
+            worker.start()
+            self.workers.append(worker)
+        # Evaluations that can run at the same time
+        self.slots = len(self.workers)
+        logger.info(f'Started {len(self.workers)} replica workers')
+
+    def submit(self, individual):
+        ticket = self.n_submitted
+        self.n_submitted += 1
+        self.outstanding.add(ticket)
+        self.tasks.put((ticket, list(individual), self.objective.benchmark.time_budget, self.__elite()))
+        return ticket
+
+    def __elite(self):
+        # What the workers need to decide on adaptive repetitions
+        objective = self.objective
+        if not objective.policy.adaptive or not hasattr(objective, 'baseline_metrics'):
+            return None
+        return objective.baseline_metrics, objective.best_fitness
+
+    def __remove_dead(self):
+        dead = [worker for worker in self.workers if not worker.is_alive()]
+        for worker in dead:
+            self.workers.remove(worker)
+        self.n_lost += len(dead)
+        self.slots = len(self.workers)
+        return dead
+
+    def __next_result(self):
+        while True:
+            try:
+                return self.results.get(timeout=self.POLL_INTERVAL)
+            except Empty:
+                dead = self.__remove_dead()
+            if dead:
+                self.__drain()
+                exitcodes = [worker.exitcode for worker in dead]
+                raise RuntimeError(
+                    f'{len(dead)} replica workers exited (codes {exitcodes}), '
+                    f'{len(self.workers)} left'
+                )
+
+    def __drain(self):
+        # Queued evaluations are withdrawn (some may already be in a
+        # worker's hands, their results are ignored when they arrive)
+        while True:
+            try:
+                ticket = self.tasks.get_nowait()[0]
+            except Empty:
+                break
+            self.outstanding.discard(ticket)
+        # Running ones are awaited, except those of the dead workers
+        while len(self.outstanding) > self.n_lost and self.workers:
+            try:
+                ticket, _, _ = self.results.get(timeout=self.POLL_INTERVAL)
+                self.outstanding.discard(ticket)
+            except Empty:
+                self.__remove_dead()
+        self.outstanding.clear()
+        self.n_lost = 0
+
+    def collect(self):
+        # Waits for whichever submitted evaluation finishes first
+        while True:
+            ticket, metrics, error = self.__next_result()
+            # Others were dropped by an earlier error
+            if ticket in self.outstanding:
+                break
+        self.outstanding.discard(ticket)
+        if error is not None:
+            self.__drain()
+            raise RuntimeError(f'Replica evaluation failed: {error}')
+        return ticket, metrics
+
+    def eval_baseline(self, baseline_individual):
+        metrics, = self.measure([baseline_individual])
+        self.objective.eval_baseline(baseline_individual, metrics=metrics)
+
+    def measure(self, individuals):
+        # Returns the raw metrics of each individual, in order
+        tickets = [self.submit(individual) for individual in individuals]
+        measured = dict(self.collect() for _ in tickets)
+        return [measured[ticket] for ticket in tickets]
+
+    def map(self, func, individuals):
+        '''
+            Drop-in replacement of toolbox.map for objective.evaluate,
+            which receives the metrics measured by the replicas
+        '''
+        individuals = list(individuals)
+        cache = self.objective.cache
+
+        # Each distinct genome is measured once, cached ones never
+        pending = dict()
+        for individual in individuals:
+            key = pack_individual(individual)
+            if key in pending:
+                continue
+            if cache is not None and individual in cache:
+                continue
+            pending[key] = individual
+
+        measured = dict(zip(pending.keys(), self.measure(list(pending.values()))))
+        return [
+            func(individual, metrics=measured.get(pack_individual(individual)))
+            for individual in individuals
+        ]
+
+    def close(self):
+        self.__remove_dead()
+        for _ in self.workers:
+            self.tasks.put(None)
+        for worker in self.workers:
+            worker.join()
+        logger.info('Replica workers stopped')
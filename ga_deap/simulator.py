@@ -0,0 +1,459 @@
+import hashlib
+import json
+import logging
+from contextlib import contextmanager
+
+import numpy as np
+
+import utils
+from analysis import QUERY_METRICS, latency_table
+from benchmark import Benchmark
+from database import Database
+from history import read_records
+from scipy import stats  # FOR GEOMETRIC MEAN
+
+logger = logging.getLogger(__name__)
+
+# Rows of each TPC-H table at scale factor 1
+TABLE_ROWS = {
+    'customer': 150000,
+    'lineitem': 6001215,
+    'nation': 25,
+    'orders': 1500000,
+    'part': 200000,
+    'partsupp': 800000,
+    'region': 5,
+    'supplier': 10000,
+}
+
+
+class CostModel:
+    '''
+        Deterministic cost of an index configuration, used to simulate
+        the benchmark without a MySQL server:
+
+            latency(metric) = base(metric) + sum(benefit(metric, column))
+            index_size      = base_index_size + sum(index_size(column))
+
+        over the indexed columns, where negative benefits make the query
+        faster (latencies never go below min_fraction of their base).
+        Each index build or drop costs build_time(column) seconds. The
+        throughput streams are slowed down by contention per extra
+        concurrent stream, and noise is the relative standard deviation
+        of the (log-normal) measurement noise.
+    '''
+
+    def __init__(self, columns, base_latency, benefit, index_size, build_time,
+                 base_index_size=0., data_size=0., contention=0.5, noise=0.,
+                 min_fraction=0.05):
+        self.columns = list(columns)
+        self.metrics = list(base_latency.keys())
+        self.base_latency = np.array([base_latency[m] for m in self.metrics], dtype=np.float64)
+        # (n_metrics, n_columns) seconds added by each index
+        self.benefit = np.array([benefit[m] for m in self.metrics], dtype=np.float64)
+        self.index_size = np.asarray(index_size, dtype=np.float64)
+        self.build_time = np.asarray(build_time, dtype=np.float64)
+        self.base_index_size = float(base_index_size)
+        self.data_size = float(data_size)
+        self.contention = float(contention)
+        self.noise = float(noise)
+        self.min_fraction = min_fraction
+
+    def __noise(self, size, rng):
+        if not self.noise or rng is None:
+            return np.ones(size)
+        return np.exp(rng.normal(0., self.noise, size))
+
+    def latencies(self, vector, rng=None):
+        x = np.asarray(vector, dtype=np.float64)
+        latency = self.base_latency + self.benefit @ x
+        latency = np.maximum(latency, self.min_fraction * self.base_latency)
+        latency *= self.__noise(len(latency), rng)
+        return dict(zip(self.metrics, latency.tolist()))
+
+    def storage_size(self, vector):
+        x = np.asarray(vector, dtype=np.float64)
+        return {
+            'data_size': self.data_size,
+            'index_size': self.base_index_size + float(self.index_size @ x),
+        }
+
+    def ddl_time(self, positions, rng=None):
+        seconds = float(self.build_time[list(positions)].sum())
+        return seconds * float(self.__noise(1, rng)[0])
+
+    def throughput_time(self, stream_time, refresh_time, n_streams):
+        # Query streams and the refresh stream run concurrently
+        slowdown = 1. + self.contention * n_streams
+        return max(stream_time, refresh_time) * slowdown
+
+    @classmethod
+    def synthetic(cls, columns, seed=0):
+        '''
+            Random but reproducible model (same seed, same model): every
+            column speeds up a few queries, slows the refresh functions
+            down a bit, and its size and build time follow the table rows
+        '''
+        rng = np.random.RandomState(seed)
+        queries = [m for m in QUERY_METRICS if m.startswith('Q')]
+        refreshes = [m for m in QUERY_METRICS if m.startswith('RF')]
+        rows = np.array([TABLE_ROWS.get(c.split('.')[0], 1e5) for c in columns], dtype=np.float64)
+
+        base_latency, benefit = dict(), dict()
+        for metric in queries:
+            base_latency[metric] = float(rng.lognormal(0., 1.))
+            useful = rng.rand(len(columns)) < 0.15
+            benefit[metric] = (-useful.astype(np.float64) * rng.uniform(0.05, 0.6, len(columns))
+                               * base_latency[metric]).tolist()
+        for metric in refreshes:
+            base_latency[metric] = float(rng.uniform(0.5, 2.))
+            # Every index has to be maintained by the refresh functions
+            benefit[metric] = (rng.uniform(0.005, 0.05, len(columns)) * rows / rows.max()
+                               * base_latency[metric]).tolist()
+
+        return cls(
+            columns=columns,
+            base_latency=base_latency,
+            benefit=benefit,
+            # ~30 bytes per entry, ~1.5us per row to build
+            index_size=rows * 30 / 1024 / 1024 * rng.uniform(0.5, 1.5, len(columns)),
+            build_time=rows * 1.5e-6 * rng.uniform(0.5, 1.5, len(columns)),
+            base_index_size=sum(TABLE_ROWS.values()) * 20 / 1024 / 1024,
+            data_size=sum(TABLE_ROWS.values()) * 150 / 1024 / 1024,
+            contention=0.5,
+            noise=0.05,
+        )
+
+    @classmethod
+    def fit(cls, records, columns, contention=0.5):
+        '''
+            Fits the model to the (individual, metrics) records of an
+            earlier run (see history.read_records) by least squares
+        '''
+        records = list(records)
+        X, Y = latency_table(records)
+        if len(X) == 0:
+            raise ValueError('No per-query latencies in the records to fit a cost model')
+        A = np.hstack([np.ones((len(X), 1)), X])
+
+        base_latency, benefit, residuals = dict(), dict(), []
+        for j, metric in enumerate(QUERY_METRICS):
+            measured = ~np.isnan(Y[:, j])
+            if not measured.any():
+                continue
+            coefficients = np.linalg.lstsq(A[measured], Y[measured, j], rcond=None)[0]
+            base_latency[metric] = max(float(coefficients[0]), 1e-3)
+            benefit[metric] = coefficients[1:].tolist()
+            fitted = A[measured] @ coefficients
+            residuals.append(np.std(Y[measured, j] - fitted) / max(np.mean(Y[measured, j]), 1e-3))
+
+        # Storage, the intercept is the size of the PK/FK indexes
+        sized = [(ind, m) for ind, m in records if 'index_size' in m]
+        index_size, base_index_size = np.zeros(len(columns)), 0.
+        if sized:
+            S = np.hstack([np.ones((len(sized), 1)), np.asarray([ind for ind, _ in sized], dtype=np.float64)])
+            coefficients = np.linalg.lstsq(S, [m['index_size'] for _, m in sized], rcond=None)[0]
+            base_index_size = max(float(coefficients[0]), 0.)
+            index_size = np.maximum(coefficients[1:], 0.)
+        data_size = np.mean([m['data_size'] for _, m in records if 'data_size' in m] or [0.])
+
+        # DDL time per changed index, from consecutive evaluations
+        table_time = dict()
+        for (previous, _), (individual, metrics) in zip(records, records[1:]):
+            changed = np.flatnonzero(np.asarray(previous) != np.asarray(individual))
+            for table in {columns[k].split('.')[0] for k in changed}:
+                n_changed = sum(columns[k].startswith(table + '.') for k in changed)
+                if f'ddl_time_{table}' in metrics:
+                    table_time.setdefault(table, []).append(metrics[f'ddl_time_{table}'] / n_changed)
+        build_time = [float(np.mean(table_time.get(c.split('.')[0], [0.]))) for c in columns]
+
+        logger.info(f'Fitted cost model on {len(X)} evaluations')
+        return cls(
+            columns=columns,
+            base_latency=base_latency,
+            benefit=benefit,
+            index_size=index_size,
+            build_time=build_time,
+            base_index_size=base_index_size,
+            data_size=data_size,
+            contention=contention,
+            noise=float(np.median(residuals)),
+        )
+
+    def to_dict(self):
+        return {
+            'columns': self.columns,
+            'base_latency': dict(zip(self.metrics, self.base_latency.tolist())),
+            'benefit': dict(zip(self.metrics, self.benefit.tolist())),
+            'index_size': self.index_size.tolist(),
+            'build_time': self.build_time.tolist(),
+            'base_index_size': self.base_index_size,
+            'data_size': self.data_size,
+            'contention': self.contention,
+            'noise': self.noise,
+            'min_fraction': self.min_fraction,
+        }
+
+    def scaled(self, factor):
+        '''
+            Model of a copy of the database factor times as large: the
+            latencies, sizes and build times scale with the data
+        '''
+        params = self.to_dict()
+        for key in ('base_latency', 'benefit'):
+            params[key] = {
+                metric: (np.asarray(value) * factor).tolist()
+                for metric, value in params[key].items()
+            }
+        for key in ('index_size', 'build_time'):
+            params[key] = (np.asarray(params[key]) * factor).tolist()
+        params['base_index_size'] *= factor
+        params['data_size'] *= factor
+        return type(self)(**params)
+
+    def save(self, filepath):
+        utils.save_json(filepath, self.to_dict())
+        logger.info(f'Saved cost model to {filepath}')
+
+    @classmethod
+    def load(cls, filepath):
+        with open(filepath, 'r') as f:
+            return cls(**json.load(f))
+
+
+class SimulatedPool:
+    '''
+        Stands for the ConnectionPool of the simulated backend
+    '''
+
+    class NullConnection:
+        def cursor(self):
+            return self
+
+        def commit(self):
+            pass
+
+        def close(self):
+            pass
+
+    @contextmanager
+    def connection(self, setup=()):
+        yield self.NullConnection()
+
+    def consume_metrics(self):
+        return {'conn_acquire_time': 0., 'conn_acquire_count': 0}
+
+
+class SimulatedDatabase(Database):
+    '''
+        Database whose idx_ indexes only exist in memory, DDL takes
+        the time given by the cost model instead of touching MySQL
+    '''
+
+    def __init__(self, model=None, reset_indexes=True, seed=None):
+        self.rng = np.random.RandomState(seed)
+        # 'table.column' of the built idx_ indexes
+        self.indexed = set()
+        super().__init__(pool=SimulatedPool(), reset_indexes=reset_indexes)
+        self.model = model if model is not None else CostModel.synthetic(self.flat_state, seed or 0)
+        if self.model.columns != self.flat_state:
+            raise ValueError('The cost model columns do not match the database columns')
+
+    def get_catalog(self):
+        catalog = {table: dict() for table in sorted(self.tables)}
+        for table in catalog:
+            for column in self.keys.get(table, []):
+                catalog[table].setdefault(column, set()).add(f'key_{column}')
+            for column in self.tables[table]:
+                indexes = catalog[table].setdefault(column, set())
+                if f'{table}.{column}' in self.indexed:
+                    indexes.add(f'idx_{column}')
+        return catalog
+
+    def reset_indexes(self):
+        logger.info('Reset Indexes')
+        self.indexed = set()
+        self.current_vector = np.zeros(self.state_size, dtype=np.int8)
+        return True
+
+    def alter_table(self, table, add=(), drop=(), cursor=None):
+        positions = [self.column_position[f'{table}.{c}'] for c in list(add) + list(drop)]
+        self.ddl_seconds[table] = self.model.ddl_time(positions, self.rng)
+        self.indexed.update(f'{table}.{column}' for column in add)
+        self.indexed.difference_update(f'{table}.{column}' for column in drop)
+        return True
+
+    def apply_state(self, state, only_optimized=True):
+        # Simulated seconds spent on each table's ALTER TABLE
+        self.ddl_seconds = dict()
+        timings = super().apply_state(state, only_optimized)
+        for table, seconds in self.ddl_seconds.items():
+            timings[f'ddl_time_{table}'] = seconds
+        # Scheduler weights follow the model rather than the wall clock
+        for table, columns in self.tables.items():
+            positions = [self.column_position[f'{table}.{c}'] for c in columns]
+            self.build_cost[table] = float(self.model.build_time[positions].mean())
+        timings['ddl_time'] = sum(v for k, v in timings.items() if k != 'ddl_time')
+        return timings
+
+
+class SimulatedBenchmark(Benchmark):
+    '''
+        Benchmark driven by the CostModel of a SimulatedDatabase,
+        returning the same metrics as the TPC-H benchmark.
+        Time budgets and max_query_time abort streams as they would on
+        the server (the query that exceeds them counts until the limit).
+    '''
+
+    def __init__(self, database, max_query_time=None, prestage_depth=2,
+                 scale_factor=None, num_streams=None):
+        # Same arguments as Benchmark, there are no refresh sets to stage
+        super().__init__(
+            database,
+            max_query_time=max_query_time,
+            prestage_depth=prestage_depth,
+            scale_factor=scale_factor,
+            num_streams=num_streams
+        )
+        self.model = database.model
+        self.rng = database.rng
+
+    def __latencies(self):
+        return self.model.latencies(self.db.current_vector, self.rng)
+
+    def __run_stream(self, latencies, bounded=False):
+        profiles, elapsed = dict(), 0.
+        for k in range(1, len(self.QUERIES) + 1):
+            latency = latencies['Q%d' % k]
+            if not bounded or (self.time_budget is None and self.max_query_time is None):
+                profiles['Q%d' % k] = latency
+                continue
+            remaining = float('inf')
+            if self.time_budget is not None:
+                remaining = self.time_budget - elapsed
+                if remaining <= 0:
+                    return profiles, True
+            if self.max_query_time is not None:
+                remaining = min(remaining, self.max_query_time)
+            if latency > remaining:
+                profiles['Q%d_truncated' % k] = remaining
+                return profiles, True
+            profiles['Q%d' % k] = latency
+            elapsed += latency
+        return profiles, False
+
+    def restore_refresh_stream_number(self, number):
+        self.refresh_stream_number = max(self.refresh_stream_number, number)
+
+    def run_unmeasured_stream(self):
+        pass
+
+    def prepare_cache(self, state):
+        # The cost model has no buffer pool
+        pass
+
+    def get_runtime(self):
+        profiles, aborted = self.__run_stream(self.__latencies(), bounded=True)
+        metrics = {'time': np.sum(list(profiles.values())), 'aborted': int(aborted)}
+        metrics.update({f'stream_{query}': value for query, value in profiles.items()})
+        return metrics
+
+    def get_storage_size(self):
+        return self.model.storage_size(self.db.current_vector)
+
+    def get_plan_fingerprint(self):
+        # The optimizer only picks the built indexes that speed a query up
+        queries = [k for k, metric in enumerate(self.model.metrics) if metric.startswith('Q')]
+        picked = (self.model.benefit[queries] < 0) & (np.asarray(self.db.current_vector) > 0)
+        return hashlib.sha1(np.packbits(picked).tobytes()).hexdigest()
+
+    def get_plan_cost(self):
+        # The optimizer's estimate is the latency without noise
+        latencies = self.model.latencies(self.db.current_vector)
+        costs = {'Q%d_cost' % k: latencies['Q%d' % k] for k in range(1, len(self.QUERIES) + 1)}
+        metrics = {'plan_cost': float(sum(costs.values()))}
+        metrics.update(costs)
+        return metrics
+
+    def get_index_sizes(self):
+        # PK/FK indexes as a whole, plus each built idx_ index
+        index_sizes = {('*', 'keys'): self.model.base_index_size}
+        for column, size, indexed in zip(self.model.columns, self.model.index_size, self.db.current_vector):
+            if indexed:
+                table, name = column.split('.')
+                index_sizes[(table, f'idx_{name}')] = float(size)
+        return self.model.data_size, index_sizes
+
+    def get_qphh(self):
+        latencies = self.__latencies()
+        profiles, aborted = self.__run_stream(latencies, bounded=True)
+        profiles['RF1'] = latencies['RF1']
+        profiles['RF2'] = latencies['RF2']
+        self.refresh_stream_number += 1
+
+        power = (3600 / stats.gmean(list(profiles.values()))) * self.SCALE_FACTOR
+        benchmark_time = sum(profiles.values())
+
+        stream_timings = dict()
+        if aborted:
+            throughput, qphh = 0., 0.
+        else:
+            # Each stream gets its own noise
+            streams = [self.__latencies() for _ in range(self.NUM_STREAMS)]
+            stream_times = [sum(s['Q%d' % k] for k in range(1, 23)) for s in streams]
+            refresh_time = sum(s['RF1'] + s['RF2'] for s in streams)
+            elapsed = self.model.throughput_time(max(stream_times), refresh_time, self.NUM_STREAMS)
+            slowdown = elapsed / max(max(stream_times), refresh_time)
+            stream_timings = {
+                'throughput_time': elapsed,
+                'refresh_stream_time': refresh_time * slowdown,
+            }
+            for k, stream_time in enumerate(stream_times, 1):
+                stream_timings['stream%d_time' % k] = stream_time * slowdown
+            throughput = ((self.NUM_STREAMS * 22) / elapsed) * 3600 * self.SCALE_FACTOR
+            qphh = np.sqrt(power * throughput)
+            self.refresh_stream_number += self.NUM_STREAMS
+            benchmark_time += elapsed
+
+        metrics = {
+            'power': power,
+            'throughput': throughput,
+            'qphh': qphh,
+            'time': float(sum(profiles[query] for query in profiles if query.startswith('Q'))),
+            'benchmark_time': benchmark_time,
+            'aborted': int(aborted)
+        }
+        metrics.update(profiles)
+        metrics.update(stream_timings)
+        return metrics
+
+
+def simulated_backend(cost_model=None, fit_history=None, noise=None, seed=None,
+                      max_query_time=None, scale_factor=None, num_streams=None):
+    '''
+        Database and Benchmark of the simulated backend. The cost model is
+        loaded from cost_model, fit from the records of fit_history
+        (history.json or history.bin) or else synthetic.
+    '''
+    model = CostModel.load(cost_model) if cost_model is not None else None
+    database = SimulatedDatabase(model=model, seed=seed)
+    if fit_history is not None:
+        database.model = CostModel.fit(read_records(fit_history), database.flat_state)
+    if noise is not None:
+        database.model.noise = noise
+    benchmark = SimulatedBenchmark(
+        database,
+        max_query_time=max_query_time,
+        scale_factor=scale_factor,
+        num_streams=num_streams
+    )
+    return database, benchmark
+
+
+if __name__ == '__main__':
+    # python simulator.py <history.json|history.bin|run dir> <cost_model.json>
+    import sys
+    logging.basicConfig(format='%(message)s', level=logging.INFO)
+    database = SimulatedDatabase()
+    model = CostModel.fit(read_records(sys.argv[1]), database.flat_state)
+    model.save(sys.argv[2])
@@ -0,0 +1,99 @@
+import logging
+import random
+
+logger = logging.getLogger(__name__)
+
+
+class SteadyState:
+    '''
+        Asynchronous steady-state GA loop.
+
+        Instead of waiting for a whole generation, a new individual is
+        bred and submitted as soon as an evaluator slot frees up, and each
+        finished individual replaces the worst one of the population
+        (if it is better). Every pop_size finished evaluations count as
+        one generation in the history.
+    '''
+
+    def __init__(self, toolbox, objective, evaluator, history,
+                 cxpb=0.8, mutpb=0.2, checkpoint=None):
+        self.toolbox = toolbox
+        self.objective = objective
+        self.evaluator = evaluator
+        self.history = history
+        self.cxpb = cxpb
+        self.mutpb = mutpb
+        # Saved at generation boundaries, in-flight evaluations are redone
+        self.checkpoint = checkpoint
+
+    def breed(self, population):
+        parents = self.toolbox.select(population, k=2)
+        child, other = [self.toolbox.clone(parent) for parent in parents]
+        if random.random() < self.cxpb:
+            self.toolbox.mate(child, other)
+        if random.random() < self.mutpb:
+            self.toolbox.mutate(child)
+        del child.fitness.values
+        return child
+
+    def insert(self, population, individual, pop_size):
+        if len(population) < pop_size:
+            population.append(individual)
+            return True
+        worst = min(range(len(population)), key=lambda k: population[k].fitness)
+        if individual.fitness > population[worst].fitness:
+            population[worst] = individual
+            return True
+        return False
+
+    def run(self, initial, n_evaluations, population=None, n_done=0):
+        '''
+            Evaluates the initial individuals and keeps breeding until
+            n_evaluations are done. A resumed run passes its already
+            evaluated population and number of finished evaluations.
+        '''
+        pop_size = len(initial) if population is None else len(population)
+        initial = list(initial) if population is None else []
+        population = [] if population is None else list(population)
+        in_flight = dict()
+        n_submitted = n_done
+        cache = self.objective.cache
+
+        def complete(individual, metrics=None):
+            nonlocal n_done
+            individual.fitness.values = self.objective.evaluate(individual, metrics=metrics)
+            replaced = self.insert(population, individual, pop_size)
+            logger.info(f'Evaluated ind {individual}, result: {individual.fitness.values}, '
+                        f'{"inserted" if replaced else "discarded"}')
+            n_done += 1
+            if n_done % pop_size == 0 and n_done < n_evaluations:
+                if self.checkpoint is not None:
+                    self.checkpoint.maybe_save(
+                        population, n_done // pop_size, self.history, self.objective
+                    )
+                self.history.update_generation()
+
+        self.history.update_generation()
+        while n_done < n_evaluations:
+            # Keeps every evaluator slot busy
+            while len(in_flight) < self.evaluator.slots and n_submitted < n_evaluations:
+                if initial:
+                    individual = initial.pop(0)
+                elif population:
+                    individual = self.breed(population)
+                else:
+                    # No evaluated parents yet
+                    break
+                n_submitted += 1
+                if cache is not None and individual in cache:
+                    # No database work needed, finish it right away
+                    complete(individual)
+                    continue
+                ticket = self.evaluator.submit(individual)
+                in_flight[ticket] = individual
+
+            if in_flight:
+                ticket, metrics = self.evaluator.collect()
+                complete(in_flight.pop(ticket), metrics)
+
+        return population
@@ -0,0 +1,139 @@
+import logging
+import time
+from multiprocessing import Process, Queue
+from queue import Empty
+
+logger = logging.getLogger(__name__)
+
+# Query streams run concurrently by the throughput test, per scale factor
+# (TPC-H specification, minimum number of streams)
+MIN_STREAMS = {1: 2, 10: 3, 30: 4, 100: 5, 300: 6, 1000: 7, 3000: 8, 10000: 9}
+
+
+def default_num_streams(scale_factor):
+    scales = [scale for scale in sorted(MIN_STREAMS) if scale <= scale_factor]
+    return MIN_STREAMS[scales[-1]] if scales else MIN_STREAMS[1]
+
+
+def read_profiles(cursor, n_executed):
+    '''
+        Durations of the last n_executed profiled statements of the
+        session, i.e. the queries of the stream: {'Q1': seconds, ...}
+    '''
+    cursor.execute("SHOW PROFILES")
+    rows = sorted(cursor.fetchall())[-n_executed:] if n_executed else []
+    profiles = dict()
+    for k, row in enumerate(rows, 1):
+        profiles['Q%d' % k] = float(row[1])
+    return profiles
+
+
+def mark_truncated(profiles):
+    '''
+        Renames the latency of the last query of an aborted stream, which
+        only ran until the abort (e.g. Q7 -> Q7_truncated): it still counts
+        in the stream time, but never as the latency of the query
+    '''
+    if profiles:
+        query = list(profiles)[-1]
+        profiles[f'{query}_truncated'] = profiles.pop(query)
+    return profiles
+
+
+def stream_worker(worker_id, conn_config, session_setup, n_queries, tasks, results):
+    # Imported here, the worker only needs its own connection
+    from connection import ConnectionPool
+
+    # One pooled connection, reused by every stream
+    pool = ConnectionPool(
+        conn_config=conn_config,
+        size=1,
+        name=f'stream_{worker_id}',
+        session_setup=session_setup
+    )
+    # Opens it right away
+    with pool.connection():
+        pass
+
+    while tasks.get() is not None:
+        begin = time.time()
+        try:
+            with pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.callproc("QUERY_STREAM")
+                profiles = read_profiles(cursor, n_queries)
+                cursor.close()
+            results.put((worker_id, profiles, time.time() - begin, None))
+        except Exception as ex:
+            logger.exception(f'Stream worker {worker_id} failed')
+            results.put((worker_id, None, time.time() - begin, repr(ex)))
+
+
+class StreamWorkerPool:
+    '''
+        Persistent processes running the query streams of the throughput
+        test. Each worker keeps its own connection open across
+        evaluations, so a throughput test only sends one message per
+        stream instead of forking the whole Benchmark every time.
+
+        Waiting for the streams checks that the workers are still alive,
+        and a failed stream is only reported once the others finished,
+        so no result is left behind for the next test.
+    '''
+
+    # Seconds between two liveness checks while waiting for the streams
+    POLL_INTERVAL = 5.
+
+    def __init__(self, conn_config, n_workers, session_setup=(), n_queries=22):
+        self.results = Queue()
+        self.tasks = []
+        self.workers = []
+        for worker_id in range(n_workers):
+            tasks = Queue()
+            worker = Process(
+                target=stream_worker,
+                args=(worker_id, conn_config, list(session_setup), n_queries,
+                      tasks, self.results),
+                daemon=True
+            )
+            worker.start()
+            self.tasks.append(tasks)
+            self.workers.append(worker)
+        logger.info(f'Started {n_workers} query stream workers')
+
+    def start(self):
+        # Every worker runs one query stream
+        for tasks in self.tasks:
+            tasks.put(True)
+
+    def wait(self):
+        '''
+            Per-worker (profiles, seconds) of the streams started last
+        '''
+        streams = [None] * len(self.workers)
+        waiting = set(range(len(self.workers)))
+        errors = []
+        while waiting:
+            try:
+                worker_id, profiles, elapsed, error = self.results.get(timeout=self.POLL_INTERVAL)
+            except Empty:
+                for worker_id in sorted(waiting):
+                    worker = self.workers[worker_id]
+                    if not worker.is_alive():
+                        waiting.discard(worker_id)
+                        errors.append(f'worker {worker_id} exited with code {worker.exitcode}')
+                continue
+            waiting.discard(worker_id)
+            if error is not None:
+                errors.append(f'stream {worker_id} failed: {error}')
+            else:
+                streams[worker_id] = (profiles, elapsed)
+        if errors:
+            raise RuntimeError(f'Throughput test query streams: {"; ".join(errors)}')
+        return streams
+
+    def close(self):
+        for tasks in self.tasks:
+            tasks.put(None)
+        for worker in self.workers:
+            worker.join()
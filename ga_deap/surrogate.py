@@ -0,0 +1,125 @@
+import itertools
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class SurrogateModel:
+    '''
+        Cheap fitness model over the index bitvector: a bootstrap ensemble
+        of ridge regressions on the bits and (optionally) their pairwise
+        interactions. The spread of the ensemble is used as uncertainty.
+    '''
+
+    def __init__(self, interactions=True, alpha=1.0, n_models=10, seed=None):
+        self.interactions = interactions
+        self.alpha = alpha
+        self.n_models = n_models
+        self.rng = np.random.RandomState(seed)
+        self.weights = None
+
+    def features(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        columns = [np.ones((len(X), 1)), X]
+        if self.interactions:
+            pairs = list(itertools.combinations(range(X.shape[1]), 2))
+            columns.append(np.stack([X[:, i] * X[:, j] for i, j in pairs], axis=1))
+        return np.hstack(columns)
+
+    def __ridge(self, F, y):
+        penalty = self.alpha * np.eye(F.shape[1])
+        # The intercept is not penalized
+        penalty[0, 0] = 0.
+        return np.linalg.solve(F.T @ F + penalty, F.T @ y)
+
+    def fit(self, X, y):
+        F = self.features(X)
+        y = np.asarray(y, dtype=np.float64)
+        weights = []
+        for _ in range(self.n_models):
+            sample = self.rng.randint(0, len(F), size=len(F))
+            weights.append(self.__ridge(F[sample], y[sample]))
+        self.weights = np.stack(weights, axis=1)
+        return self
+
+    def predict(self, X):
+        predictions = self.features(X) @ self.weights
+        return predictions.mean(axis=1), predictions.std(axis=1)
+
+
+class SurrogateScreen:
+    '''
+        Scores each generation's offspring with a SurrogateModel trained
+        on the evaluations recorded in the history, and only sends the
+        most promising ones (by upper confidence bound, i.e. predicted
+        fitness plus kappa times its uncertainty) to the real benchmark.
+        The remaining ones get the predicted fitness.
+    '''
+
+    def __init__(self, history, model=None, top_k=0.25, kappa=1.0,
+                 min_samples=30, target='fitness'):
+        self.history = history
+        self.model = model if model is not None else SurrogateModel()
+        # Fraction of the (uncached) offspring really evaluated
+        self.top_k = top_k
+        self.kappa = kappa
+        self.min_samples = min_samples
+        self.target = target
+        self.n_real = 0
+        self.n_predicted = 0
+
+    def training_set(self):
+        X, y = [], []
+        for individual, metrics in self.history.records():
+            # The fitness of the individuals the proxy did not promote
+            # is only an estimate
+            if self.target in metrics and metrics.get('promoted') != 0:
+                X.append(individual)
+                y.append(metrics[self.target])
+        return X, y
+
+    def screen(self, individuals, is_cached=None):
+        '''
+            Returns the individuals to evaluate for real and a list of
+            (individual, predicted fitness) for the others
+        '''
+        individuals = list(individuals)
+        X, y = self.training_set()
+        if len(X) < self.min_samples:
+            logger.debug(f'Surrogate needs {self.min_samples} samples, has {len(X)}')
+            return individuals, []
+
+        real, candidates = [], []
+        for individual in individuals:
+            # Cached individuals cost nothing to evaluate
+            if is_cached is not None and is_cached(individual):
+                real.append(individual)
+            else:
+                candidates.append(individual)
+        if not candidates:
+            return real, []
+
+        self.model.fit(X, y)
+        mean, std = self.model.predict([list(ind) for ind in candidates])
+        ucb = mean + self.kappa * std
+        n_real = max(1, int(np.ceil(self.top_k * len(candidates))))
+        order = np.argsort(-ucb)
+
+        promoted = set(order[:n_real].tolist())
+        predicted = []
+        for k, individual in enumerate(candidates):
+            if k in promoted:
+                real.append(individual)
+            else:
+                predicted.append((individual, float(mean[k])))
+
+        self.n_real += n_real
+        self.n_predicted += len(predicted)
+        logger.info(
+            f'Surrogate screening: {n_real} of {len(candidates)} offspring sent to the benchmark, '
+            f'{len(predicted) / len(candidates):.1%} of the real evaluations saved '
+            f'({self.n_predicted} overall)'
+        )
+        return real, predicted
@@ -0,0 +1,1590 @@
+'''
+    Tests on the simulated backend (no MySQL server needed),
+    run from this directory: python -m pytest test.py
+'''
+
+import argparse
+import importlib.util
+import json
+import logging
+import os
+import pickle
+import random
+import re
+import shutil
+import sys
+import tempfile
+import types
+import unittest
+import warnings
+from contextlib import contextmanager
+from multiprocessing import Process
+from unittest import mock
+
+import numpy as np
+
+import analysis
+import config
+import experiment
+import explain
+import replicas
+import streams
+import train
+from benchmark import Benchmark
+from cache import EvaluationCache, PlanCache, pack_individual
+from checkpoint import Checkpoint
+from connection import ConnectionPool, driver_error
+from database import Database
+from deap import base, creator, tools
+from estimator import IndexSizeEstimator
+from fidelity import MultiFidelityEvaluator, build_levels
+from fitness import Objective, __fitness__, get_fitness_fn
+from history import History, read_records
+from measurement import MeasurementPolicy
+from planner import MetricPlanner
+from population import PopulationEngine
+from refresh import RefreshAllocator, RefreshPipeline, count_refresh_sets
+from replicas import SerialEvaluator
+from scheduler import EvaluationScheduler
+from simulator import CostModel, SimulatedDatabase, simulated_backend
+from steady_state import SteadyState
+from surrogate import SurrogateModel, SurrogateScreen
+
+logging.disable(logging.CRITICAL)
+
+
+def simulated(seed=0, **kwargs):
+    # Noise-free, so every measurement of a configuration is the same
+    return simulated_backend(noise=0., seed=seed, **kwargs)
+
+
+def parse_args(*argv):
+    parser = argparse.ArgumentParser()
+    experiment.add_arguments(parser)
+    return experiment.check_arguments(parser, parser.parse_args(list(argv)))
+
+
+def make_toolbox(state_size):
+    # Same operators as train.py
+    if not hasattr(creator, 'Individual'):
+        creator.create('FitnessMax', base.Fitness, weights=(1.0,))
+        creator.create('Individual', list, fitness=creator.FitnessMax)
+    toolbox = base.Toolbox()
+    toolbox.register('attr_bool', random.randint, 0, 1)
+    toolbox.register('individual', tools.initRepeat, creator.Individual, toolbox.attr_bool, n=state_size)
+    toolbox.register('population', tools.initRepeat, list, toolbox.individual)
+    toolbox.register('mate', tools.cxTwoPoint)
+    toolbox.register('mutate', tools.mutFlipBit, indpb=0.1)
+    toolbox.register('select', tools.selTournament, tournsize=3)
+    return toolbox
+
+
+def run_train(outpath, *argv):
+    '''
+        train.py on the noise-free simulated backend,
+        returns the History it recorded
+    '''
+    random.seed(0)
+    np.random.seed(0)
+    argv = ['train.py', '--backend', 'simulated', '--sim_noise', '0', '--sim_seed', '1',
+            '-p', '6', '-o', outpath] + list(argv)
+    # train.py sets its logger up when run as a script, and
+    # creates the DEAP classes again on each run
+    with mock.patch.object(sys, 'argv', argv), \
+            mock.patch.object(train, 'logger', logging.getLogger('train'), create=True), \
+            warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        train.train(train.get_params())
+    return History.read(outpath)
+
+
+class FakePool:
+    '''
+        Stands for the ConnectionPool of a Database, recording the
+        statements it gets. The catalog query returns every optimized
+        column unindexed, plus the given (table, column, index, visible)
+    '''
+
+    class Cursor:
+        def __init__(self, pool):
+            self.pool = pool
+            self.rows = []
+
+        def execute(self, statement, params=None):
+            self.rows = self.pool.execute(statement)
+
+        def callproc(self, name):
+            self.rows = self.pool.execute(f'CALL {name}')
+
+        def fetchall(self):
+            return self.rows
+
+        def close(self):
+            pass
+
+    def __init__(self, indexes=()):
+        self.tables = SimulatedDatabase().tables
+        self.indexes = list(indexes)
+        self.statements = []
+        self.n_catalog_reads = 0
+
+    def execute(self, statement):
+        if 'information_schema' in statement:
+            self.n_catalog_reads += 1
+            return self.catalog_rows()
+        self.statements.append(statement)
+        return []
+
+    def catalog_rows(self):
+        rows = [
+            (table, column, None, None)
+            for table, columns in self.tables.items() for column in columns
+        ]
+        return rows + self.indexes
+
+    @contextmanager
+    def connection(self, setup=()):
+        yield self
+
+    def cursor(self):
+        return self.Cursor(self)
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class DdlPool(FakePool):
+    '''
+        FakePool keeping the idx_ indexes built and dropped by its ALTER
+        TABLE statements, which fail whole when they contain rejected
+    '''
+
+    def __init__(self, rejected):
+        super().__init__()
+        self.rejected = rejected
+
+    def execute(self, statement):
+        if statement.startswith('ALTER TABLE'):
+            if self.rejected in statement:
+                raise Exception(f'Rejected {statement}')
+            table = statement.split()[2]
+            for column in re.findall(r'ADD INDEX idx_(\w+)', statement):
+                self.indexes.append((table, column, f'idx_{column}', 'YES'))
+            for column in re.findall(r'DROP INDEX idx_(\w+)', statement):
+                self.indexes.remove((table, column, f'idx_{column}', 'YES'))
+        return super().execute(statement)
+
+
+class TempDirTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def objective(self, fitness_name='qphh', benchmark=None, **kwargs):
+        if benchmark is None:
+            _, benchmark = simulated()
+        history = History(os.path.join(self.path, 'run'))
+        return Objective(benchmark=benchmark, fitness_name=fitness_name, history=history, **kwargs)
+
+
+class EvaluationCacheTest(TempDirTestCase):
+
+    def test_pack_individual(self):
+        self.assertEqual(pack_individual([0, 1, 1, 0]), '4:60')
+        self.assertEqual(pack_individual(np.array([0., 1., 1., 0.])), '4:60')
+        self.assertNotEqual(pack_individual([0, 1, 1, 0]), pack_individual([0, 1, 1, 0, 0]))
+
+    def test_lru_eviction_and_disk_recovery(self):
+        cache = EvaluationCache('qphh', path=self.path, max_size=2)
+        individuals = [[1, 0, 0], [0, 1, 0], [0, 0, 1]]
+        for k, individual in enumerate(individuals):
+            cache.put(individual, {'qphh': float(k), 'fitness': 1.})
+        self.assertEqual(len(cache.memory), 2)
+        self.assertEqual(len(cache), 3)
+        # Evicted from memory, read back from eval_cache.jsonl
+        self.assertEqual(cache.get([1, 0, 0]), {'qphh': 0.})
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertIsNone(cache.get([1, 1, 0]))
+        self.assertEqual(cache.stats()['misses'], 1)
+
+        reopened = EvaluationCache('qphh', path=self.path)
+        self.assertEqual(len(reopened), 3)
+        self.assertEqual(reopened.get([0, 0, 1]), {'qphh': 2.})
+        self.assertIn([0, 1, 0], reopened)
+
+    def test_settings_are_part_of_the_key(self):
+        cache = EvaluationCache('qphh', path=self.path, settings={'scale_factor': 1})
+        cache.put([1, 0], {'qphh': 1.})
+        other = EvaluationCache('qphh', path=self.path, settings={'scale_factor': 10})
+        self.assertNotIn([1, 0], other)
+        self.assertIsNone(other.get([1, 0]))
+        self.assertIn([1, 0], EvaluationCache('qphh', path=self.path, settings={'scale_factor': 1}))
+
+    def test_warm_start_with_the_same_settings(self):
+        settings = experiment.measurement_settings(parse_args('--apply_strategy', 'visibility'), simulated()[1])
+        self.assertEqual(settings['apply_strategy'], 'visibility')
+        run = os.path.join(self.path, 'run')
+        history = History(run, settings=settings)
+        history.update([1, 0], {'qphh': 1.})
+        history.serialize()
+        self.assertEqual(History.read(run).settings, settings)
+
+        cache = EvaluationCache('qphh', settings=settings)
+        self.assertEqual(cache.warm_start(history.storepath), 1)
+        other = EvaluationCache('qphh', settings={**settings, 'apply_strategy': 'ddl'})
+        self.assertEqual(other.warm_start(history.storepath), 0)
+        # The json export holds no settings, they are assumed identical
+        history.export_json()
+        self.assertEqual(other.warm_start(history.filepath), 1)
+
+    def test_incomplete_metrics_are_not_kept(self):
+        cache = EvaluationCache('time', path=self.path, required=['time'])
+        cache.put([1, 0], {'time': 1., 'aborted': 1.})
+        cache.put([0, 1], {'plan_cost': 1.})
+        cache.put([1, 1], {'time': 1., 'promoted': 0.})
+        self.assertEqual(len(cache), 0)
+        self.assertFalse(os.path.exists(cache.filepath))
+
+    def test_objective_reuses_cached_metrics(self):
+        cache = EvaluationCache('qphh', path=self.path)
+        objective = self.objective(cache=cache)
+        objective.eval_baseline([0] * 22)
+        individual = [1, 0] * 11
+        fitness = objective.evaluate(individual)
+        n_samples = objective.policy.n_samples
+        self.assertEqual(objective.evaluate(list(individual)), fitness)
+        self.assertEqual(objective.policy.n_samples, n_samples)
+        self.assertEqual(cache.hits, 1)
+
+    def test_no_cache_with_fake_metrics(self):
+        args = parse_args('--backend', 'simulated', '-o', self.path, '--use_fake_eval')
+        database, benchmark = experiment.build_backend(args)
+        objective = experiment.build_objective(args, benchmark, History(self.path))
+        self.assertIsNone(objective.cache)
+        self.assertIsNone(objective.plan_cache)
+
+
+class ApplyVectorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = FakePool()
+        self.database = Database(self.pool)
+
+    def vector(self, *columns):
+        vector = np.zeros(self.database.state_size)
+        for column in columns:
+            vector[self.database.column_position[column]] = 1
+        return vector
+
+    def test_only_changed_indexes_are_applied(self):
+        self.database.apply_vector(self.vector('orders.o_clerk'))
+        self.assertEqual(self.pool.statements, ['ALTER TABLE orders ADD INDEX idx_o_clerk (o_clerk);'])
+        self.pool.statements.clear()
+        self.database.apply_vector(self.vector('orders.o_clerk'))
+        self.assertEqual(self.pool.statements, [])
+
+        self.database.apply_vector(self.vector('part.p_mfgr'))
+        self.assertEqual(sorted(self.pool.statements), [
+            'ALTER TABLE orders DROP INDEX idx_o_clerk;',
+            'ALTER TABLE part ADD INDEX idx_p_mfgr (p_mfgr);',
+        ])
+        np.testing.assert_array_equal(self.database.current_vector, self.vector('part.p_mfgr'))
+
+    def test_reset_drops_existing_indexes(self):
+        pool = FakePool([('orders', 'o_clerk', 'idx_o_clerk', 'YES'), ('orders', 'o_orderkey', 'PRIMARY', 'YES')])
+        database = Database(pool)
+        self.assertEqual(pool.statements, ['DROP INDEX idx_o_clerk ON orders;'])
+        np.testing.assert_array_equal(database.current_vector, np.zeros(database.state_size))
+
+        kept = Database(FakePool([('orders', 'o_clerk', 'idx_o_clerk', 'YES')]), reset_indexes=False)
+        np.testing.assert_array_equal(kept.current_vector, self.vector('orders.o_clerk'))
+
+
+class AlterTableTest(TempDirTestCase):
+
+    def test_changes_are_batched_per_table(self):
+        pool = FakePool()
+        database = Database(pool)
+        state = database.vector_to_state(np.zeros(database.state_size))
+        state['customer'].update(c_name=1, c_address=1)
+        state['orders']['o_clerk'] = 1
+        timings = database.apply_state(state)
+        self.assertEqual(sorted(pool.statements), [
+            'ALTER TABLE customer ADD INDEX idx_c_name (c_name), ADD INDEX idx_c_address (c_address);',
+            'ALTER TABLE orders ADD INDEX idx_o_clerk (o_clerk);',
+        ])
+        self.assertEqual(set(timings), {f'ddl_time_{table}' for table in database.tables} | {'ddl_time'})
+        self.assertIn('customer', database.build_cost)
+
+        pool.statements.clear()
+        state['customer'].update(c_name=0, c_comment=1)
+        database.apply_state(state)
+        self.assertEqual(pool.statements, [
+            'ALTER TABLE customer ADD INDEX idx_c_comment (c_comment), DROP INDEX idx_c_name;',
+        ])
+
+    def test_algorithm_and_lock_clauses(self):
+        pool = FakePool()
+        database = Database(pool, alter_algorithm='INPLACE', alter_lock='NONE')
+        database.alter_table('part', add=['p_mfgr'], drop=['p_comment'])
+        self.assertEqual(pool.statements, [
+            'ALTER TABLE part ADD INDEX idx_p_mfgr (p_mfgr), DROP INDEX idx_p_comment, '
+            'ALGORITHM=INPLACE, LOCK=NONE;',
+        ])
+        with self.assertRaises(SystemExit), mock.patch('sys.stderr'):
+            parse_args('--alter_algorithm', 'INSTANT')
+
+    def failing_batch(self, rejected):
+        pool = DdlPool(rejected)
+        database = Database(pool)
+        state = database.vector_to_state(np.zeros(database.state_size))
+        state['customer'].update(c_name=1, c_address=1, c_comment=1)
+        return pool, database, state
+
+    def test_failed_batch_applied_one_by_one(self):
+        pool, database, state = self.failing_batch(rejected=', ')
+        patch, _ = fake_driver()
+        with patch:
+            database.apply_state(state)
+        self.assertEqual(pool.statements, [
+            'ALTER TABLE customer ADD INDEX idx_c_name (c_name);',
+            'ALTER TABLE customer ADD INDEX idx_c_address (c_address);',
+            'ALTER TABLE customer ADD INDEX idx_c_comment (c_comment);',
+        ])
+        np.testing.assert_array_equal(database.current_vector, database.get_materialized_vector())
+        self.assertEqual(database.current_vector.sum(), 3)
+
+    def test_unapplied_index_raises(self):
+        pool, database, state = self.failing_batch(rejected='idx_c_address')
+        patch, _ = fake_driver()
+        with patch, self.assertRaisesRegex(RuntimeError, 'customer.c_address'):
+            database.apply_state(state)
+        # The other indexes of the table were built
+        np.testing.assert_array_equal(database.current_vector, database.get_materialized_vector())
+        self.assertEqual(database.current_vector.sum(), 2)
+
+    def test_unapplied_individual_penalized_not_cached(self):
+        cache = EvaluationCache('qphh', path=self.path)
+        objective = self.objective(cache=cache)
+        objective.eval_baseline([0] * 22)
+        objective.evaluate([1] * 22)
+        with mock.patch.object(objective.benchmark.db, 'apply_vector', side_effect=RuntimeError('idx_c_name')):
+            fitness, = objective.evaluate([0, 1] * 11)
+        self.assertEqual(fitness, objective.penalized_fitness())
+        self.assertNotIn([0, 1] * 11, cache)
+        _, metrics = list(objective.history.records())[-1]
+        self.assertEqual(metrics['apply_failed'], 1)
+
+
+class EvaluationSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.database = SimulatedDatabase(seed=0)
+        rng = np.random.RandomState(0)
+        self.individuals = [list(rng.randint(0, 2, self.database.state_size)) for _ in range(12)]
+
+    def tour_length(self, individuals):
+        scheduler = EvaluationScheduler(self.database)
+        vectors = [self.database.current_vector] + individuals
+        distances = scheduler.distance_matrix(vectors, scheduler.column_weights())
+        return scheduler.path_cost(list(range(len(vectors))), distances)
+
+    def test_distance_is_weighted_hamming(self):
+        distances = EvaluationScheduler.distance_matrix([[0, 0, 1], [1, 0, 0]], np.array([1., 2., 3.]))
+        np.testing.assert_array_equal(distances, [[0., 4.], [4., 0.]])
+
+    def test_schedule_shortens_the_tour(self):
+        for strategy in ('nearest', '2opt'):
+            scheduler = EvaluationScheduler(self.database, strategy=strategy)
+            scheduled = scheduler.schedule(self.individuals)
+            self.assertEqual(sorted(scheduled), sorted(self.individuals))
+            self.assertLess(self.tour_length(scheduled), self.tour_length(self.individuals))
+            self.assertAlmostEqual(scheduler.total_scheduled_cost, self.tour_length(scheduled))
+            self.assertAlmostEqual(scheduler.total_naive_cost, self.tour_length(self.individuals))
+
+        nearest = EvaluationScheduler(self.database, strategy='nearest').schedule(self.individuals)
+        two_opt = EvaluationScheduler(self.database, strategy='2opt').schedule(self.individuals)
+        self.assertLessEqual(self.tour_length(two_opt), self.tour_length(nearest))
+        self.assertEqual(EvaluationScheduler(self.database, strategy='none').schedule(self.individuals),
+                         self.individuals)
+
+    def test_cached_individuals_run_first(self):
+        cached = self.individuals[5]
+        scheduler = EvaluationScheduler(self.database, is_cached=lambda ind: ind == cached)
+        self.assertEqual(scheduler.schedule(self.individuals)[0], cached)
+
+
+def fake_driver(busy=0):
+    '''
+        mysql.connector stand-in: the pool is exhausted for the first
+        busy get_connection() calls, connections record their statements
+    '''
+    errors = types.ModuleType('mysql.connector.errors')
+    errors.PoolError = type('PoolError', (Exception,), {})
+    pooling = types.ModuleType('mysql.connector.pooling')
+    statements = []
+
+    class Connection:
+        def ping(self, reconnect, attempts, delay):
+            statements.append('PING')
+
+        def cursor(self):
+            return types.SimpleNamespace(execute=statements.append, close=lambda: None)
+
+        def close(self):
+            statements.append('CLOSE')
+
+    class MySQLConnectionPool:
+        def __init__(self, pool_name, pool_size, **conn_config):
+            self.busy = busy
+
+        def get_connection(self):
+            if self.busy > 0:
+                self.busy -= 1
+                raise errors.PoolError('Failed getting connection; pool exhausted')
+            return Connection()
+
+    pooling.MySQLConnectionPool = MySQLConnectionPool
+    connector = types.ModuleType('mysql.connector')
+    connector.errors, connector.pooling = errors, pooling
+    connector.Error = Exception
+    mysql = types.ModuleType('mysql')
+    mysql.connector = connector
+    modules = {
+        'mysql': mysql,
+        'mysql.connector': connector,
+        'mysql.connector.errors': errors,
+        'mysql.connector.pooling': pooling,
+    }
+    return mock.patch.dict(sys.modules, modules), statements
+
+
+class ConnectionPoolTest(unittest.TestCase):
+
+    def test_session_setup_and_metrics(self):
+        patch, statements = fake_driver(busy=2)
+        with patch:
+            pool = ConnectionPool({'user': 'tpch'}, session_setup=['SET a = 1'])
+            with pool.connection(['SET PROFILING = 1']):
+                pass
+            self.assertIs(driver_error(), Exception)
+        self.assertEqual(statements, ['PING', 'SET a = 1', 'SET PROFILING = 1', 'CLOSE'])
+        metrics = pool.consume_metrics()
+        self.assertEqual(metrics['conn_acquire_count'], 1)
+        self.assertGreater(metrics['conn_acquire_time'], 0.)
+        self.assertEqual(pool.consume_metrics(), {'conn_acquire_time': 0., 'conn_acquire_count': 0})
+
+    def test_acquire_timeout(self):
+        patch, _ = fake_driver(busy=1000)
+        with patch:
+            pool = ConnectionPool({}, acquire_timeout=0.1)
+            with self.assertRaises(sys.modules['mysql.connector.errors'].PoolError):
+                pool.acquire()
+
+    def test_pickled_pool_reconnects(self):
+        patch, statements = fake_driver()
+        with patch:
+            pool = ConnectionPool({}, size=100)
+            pool.acquire()
+            copy = pickle.loads(pickle.dumps(pool))
+            self.assertIsNone(copy._ConnectionPool__pool)
+            copy.acquire()
+        self.assertEqual(copy.size, ConnectionPool.MAX_SIZE)
+        self.assertEqual(statements.count('PING'), 2)
+
+    @unittest.skipIf(importlib.util.find_spec('mysql'), 'MySQL driver installed')
+    def test_no_driver_needed(self):
+        self.assertEqual(driver_error(), ())
+
+
+class CatalogTest(unittest.TestCase):
+
+    def test_single_round_trip_until_ddl(self):
+        pool = FakePool([
+            ('orders', 'o_orderkey', 'PRIMARY', 'YES'),
+            ('orders', 'o_clerk', 'idx_o_clerk', 'YES'),
+            ('orders', 'o_clerk', 'o_clerk_2', 'YES'),
+        ])
+        database = Database(pool, reset_indexes=False)
+        database.invalidate_catalog()
+        pool.n_catalog_reads = 0
+        state = database.get_current_state()
+        database.get_current_state_vector()
+        database.get_columns('orders')
+        self.assertEqual(pool.n_catalog_reads, 1)
+        self.assertEqual(state['orders']['o_clerk'], 1)
+        self.assertEqual(state['orders']['o_orderkey'], 1)
+        self.assertEqual(state['orders']['o_totalprice'], 0)
+        self.assertEqual(database.get_table_indexed_columns('orders'), ['o_clerk', 'o_clerk', 'o_orderkey'])
+
+        database.alter_table('orders', drop=['o_clerk'])
+        database.get_current_state()
+        self.assertEqual(pool.n_catalog_reads, 2)
+
+
+def fake_replica_worker(replica_id, conn_config, pool_size, database_kwargs,
+                        benchmark_kwargs, fitness_name, policy, record, tasks, results):
+    # Measures sum(individual) and zero record metrics,
+    # fails on all-ones and exits on all-zeros
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        ticket, individual, time_budget, elite = task
+        if not any(individual):
+            os._exit(3)
+        if all(individual):
+            results.put((ticket, None, 'ValueError()'))
+            continue
+        metrics = {'qphh': float(sum(individual)), 'replica': replica_id}
+        metrics.update({metric: 0. for metric in record})
+        results.put((ticket, metrics, None))
+
+
+class ReplicaEvaluatorTest(TempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patch = mock.patch.object(replicas, 'replica_worker', fake_replica_worker)
+        patch.start()
+        self.addCleanup(patch.stop)
+        replicas.ReplicaEvaluator.POLL_INTERVAL = 0.1
+        self.addCleanup(setattr, replicas.ReplicaEvaluator, 'POLL_INTERVAL', 5.)
+        self.cache = EvaluationCache('qphh')
+        self.objective = self.objective(cache=self.cache)
+        self.evaluator = replicas.ReplicaEvaluator(self.objective, [{'host': 'a'}, {'host': 'b:3307'}])
+        self.addCleanup(self.evaluator.close)
+
+    def test_parse_replica(self):
+        self.assertEqual(replicas.parse_replica('db2:3307'), {'host': 'db2', 'port': 3307})
+        self.assertEqual(replicas.parse_replica('db2'), {'host': 'db2'})
+
+    def test_map_measures_each_genome_once(self):
+        self.evaluator.eval_baseline([1, 0, 0, 0])
+        self.assertEqual(self.objective.baseline_metrics['qphh'], 1.)
+        fitnesses = self.evaluator.map(self.objective.evaluate, [[1, 1, 0, 0], [1, 1, 0, 0], [1, 0, 0, 0]])
+        self.assertEqual(fitnesses, [(2.,), (2.,), (1.,)])
+        # The baseline is cached, the duplicate measured once
+        self.assertEqual(self.evaluator.n_submitted, 2)
+
+    def test_failed_evaluation_drains_the_queue(self):
+        for individual in ([1, 1], [1, 0], [0, 1]):
+            self.evaluator.submit(individual)
+        with self.assertRaisesRegex(RuntimeError, 'ValueError'):
+            for _ in range(3):
+                self.evaluator.collect()
+        self.assertEqual(self.evaluator.outstanding, set())
+        self.assertEqual(self.evaluator.measure([[1, 0, 1]])[0]['qphh'], 2.)
+
+    def test_dead_worker(self):
+        self.evaluator.submit([0, 0])
+        with self.assertRaisesRegex(RuntimeError, 'exited'):
+            self.evaluator.collect()
+        self.assertEqual(self.evaluator.slots, 1)
+        self.assertEqual(self.evaluator.measure([[0, 1], [1, 0]])[1]['qphh'], 1.)
+
+    def test_record_metrics_forwarded(self):
+        objective = super().objective(record=['index_size'])
+        evaluator = replicas.ReplicaEvaluator(objective, [{'host': 'a'}])
+        self.addCleanup(evaluator.close)
+        self.assertEqual(evaluator.measure([[1, 0]])[0]['index_size'], 0.)
+
+    def test_features_of_this_process_rejected(self):
+        for option in (['--multi_fidelity'], ['--proxy', 'plan_cost'], ['--plan_cache'], ['--estimate_index_size']):
+            with self.assertRaises(SystemExit), mock.patch('sys.stderr'):
+                parse_args('--replicas', 'db2:3307', *option)
+            with mock.patch.object(config, 'REPLICAS', [{'host': 'db2'}]):
+                with self.assertRaises(SystemExit), mock.patch('sys.stderr'):
+                    parse_args(*option)
+                # Disabled replicas
+                parse_args('--replicas', *option)
+
+
+class SteadyStateTest(TempDirTestCase):
+
+    def test_run(self):
+        random.seed(0)
+        cache = EvaluationCache('qphh')
+        objective = self.objective(cache=cache)
+        evaluator = SerialEvaluator(objective)
+        evaluator.eval_baseline([0] * 22)
+        toolbox = make_toolbox(22)
+        initial = toolbox.population(n=6)
+        engine = SteadyState(toolbox, objective, evaluator, objective.history)
+        population = engine.run(initial, n_evaluations=30)
+
+        self.assertEqual(len(population), 6)
+        # Cached genomes finish without reaching the evaluator
+        self.assertEqual(evaluator.n_submitted + cache.hits, 30)
+        self.assertEqual(len(objective.history), 31)
+        self.assertEqual(objective.history.generation, 5)
+        initial_best = max(ind.fitness.values[0] for ind in initial)
+        self.assertGreaterEqual(max(ind.fitness.values[0] for ind in population), initial_best)
+        self.assertTrue(all(ind.fitness.valid for ind in population))
+
+    def test_insert_replaces_the_worst(self):
+        toolbox = make_toolbox(4)
+        engine = SteadyState(toolbox, None, None, None)
+        population = toolbox.population(n=2)
+        for individual, fitness in zip(population, (1., 3.)):
+            individual.fitness.values = (fitness,)
+        better, worse = toolbox.population(n=2)
+        better.fitness.values, worse.fitness.values = (2.,), (0.5,)
+        self.assertFalse(engine.insert(population, worse, 2))
+        self.assertTrue(engine.insert(population, better, 2))
+        self.assertEqual(sorted(ind.fitness.values[0] for ind in population), [2., 3.])
+
+
+class SurrogateTest(TempDirTestCase):
+
+    WEIGHTS = np.array([3., -1., 0., 2., 0., 1.])
+
+    def setUp(self):
+        super().setUp()
+        rng = np.random.RandomState(0)
+        self.X = rng.randint(0, 2, (60, len(self.WEIGHTS)))
+        self.y = self.X @ self.WEIGHTS + 1.
+
+    def test_model_fits_a_linear_fitness(self):
+        model = SurrogateModel(interactions=False, alpha=1e-6, seed=0).fit(self.X, self.y)
+        mean, std = model.predict([[1, 0, 0, 1, 0, 1], [0, 1, 0, 0, 0, 0]])
+        np.testing.assert_allclose(mean, [7., 0.], atol=1e-3)
+        np.testing.assert_allclose(std, 0., atol=1e-3)
+        with_pairs = SurrogateModel(seed=0)
+        self.assertEqual(with_pairs.features(self.X).shape, (60, 1 + 6 + 15))
+
+    def test_screen(self):
+        history = History(self.path)
+        screen = SurrogateScreen(history, SurrogateModel(seed=0), top_k=0.25, min_samples=40)
+        for individual, fitness in zip(self.X, self.y):
+            history.update(individual, {'fitness': fitness})
+        # Estimated fitnesses are no training data
+        history.update([1] * 6, {'fitness': 100., 'promoted': 0})
+        self.assertEqual(len(screen.training_set()[0]), 60)
+
+        offspring = [list(ind) for ind in np.random.RandomState(1).randint(0, 2, (8, 6))]
+        cached = offspring[-1]
+        real, predicted = screen.screen(offspring, is_cached=lambda ind: ind is cached)
+        self.assertEqual(len(real), 1 + 2)
+        self.assertIs(real[0], cached)
+        self.assertEqual(len(predicted), 5)
+        self.assertEqual((screen.n_real, screen.n_predicted), (2, 5))
+        for individual, fitness in predicted:
+            self.assertAlmostEqual(fitness, np.dot(individual, self.WEIGHTS) + 1., delta=0.5)
+
+        screen.min_samples = 100
+        self.assertEqual(screen.screen(offspring), (offspring, []))
+
+
+class QueryTimeout(Exception):
+    errno = Benchmark.QUERY_TIMEOUT_ERRNO
+
+
+class ProfilingPool(FakePool):
+    '''
+        Every query view takes a second, the one named timeout_at
+        exceeds its time limit
+    '''
+
+    def __init__(self, timeout_at=None):
+        super().__init__()
+        self.timeout_at = timeout_at
+        self.n_profiled = 0
+
+    def execute(self, statement):
+        if statement == 'CALL QUERY_STREAM':
+            self.n_profiled += len(Benchmark.QUERIES)
+        elif statement.startswith('SELECT /*+'):
+            self.n_profiled += 1
+            if statement.endswith(f' {self.timeout_at}'):
+                raise QueryTimeout()
+        elif statement == 'SHOW PROFILES':
+            return [(k, 1., '') for k in range(1, self.n_profiled + 1)]
+        return super().execute(statement)
+
+
+class BoundedEvaluationTest(TempDirTestCase):
+
+    def test_query_stream_without_limits(self):
+        pool = ProfilingPool()
+        metrics = Benchmark(Database(pool)).get_runtime()
+        self.assertEqual(metrics['aborted'], 0)
+        self.assertEqual(metrics['time'], 22.)
+        self.assertIn('CALL QUERY_STREAM', pool.statements)
+
+    def test_max_query_time(self):
+        pool = ProfilingPool(timeout_at='query7')
+        patch, _ = fake_driver()
+        with patch:
+            metrics = Benchmark(Database(pool), max_query_time=5).get_runtime()
+        self.assertEqual(metrics['aborted'], 1)
+        self.assertEqual(metrics['time'], 7.)
+        self.assertIn('stream_Q7_truncated', metrics)
+        self.assertNotIn('stream_Q7', metrics)
+        self.assertIn('SELECT /*+ MAX_EXECUTION_TIME(5000) */ * FROM query1', pool.statements)
+
+    def test_simulated_time_budget(self):
+        _, benchmark = simulated()
+        complete = benchmark.get_runtime()
+        benchmark.time_budget = complete['time'] / 2
+        metrics = benchmark.get_runtime()
+        self.assertEqual(metrics['aborted'], 1)
+        self.assertAlmostEqual(metrics['time'], complete['time'] / 2)
+        truncated = [metric for metric in metrics if metric.endswith('_truncated')]
+        self.assertEqual(len(truncated), 1)
+
+        benchmark.time_budget = None
+        benchmark.max_query_time = 1e-3
+        self.assertEqual(benchmark.get_runtime()['aborted'], 1)
+
+    def test_aborted_evaluations_get_the_worst_fitness(self):
+        objective = self.objective('time', bounded=True, budget_slack=1.1)
+        objective.eval_baseline([0] * 22)
+        budget = objective.benchmark.time_budget
+        self.assertAlmostEqual(budget, 1.1 * objective.baseline_metrics['time'])
+        fitness, = objective.evaluate([1] * 22)
+        self.assertLessEqual(objective.benchmark.time_budget, budget)
+
+        self.assertEqual(objective.worst_fitness, fitness)
+
+        objective.benchmark.time_budget = 1e-3
+        self.assertEqual(objective.evaluate([0, 1] * 11), (fitness,))
+
+
+class QueryAttributionTest(unittest.TestCase):
+
+    def test_read_profiles(self):
+        cursor = FakePool.Cursor(ProfilingPool())
+        cursor.pool.n_profiled = 30
+        profiles = streams.read_profiles(cursor, 3)
+        self.assertEqual(profiles, {'Q1': 1., 'Q2': 1., 'Q3': 1.})
+        self.assertEqual(streams.read_profiles(cursor, 0), {})
+        self.assertEqual(list(streams.mark_truncated(profiles)), ['Q1', 'Q2', 'Q3_truncated'])
+
+    def test_column_effects(self):
+        rng = np.random.RandomState(0)
+        X = rng.randint(0, 2, (40, 4))
+        effect = np.array([-0.5, 0., 0.2, 0.])
+        records = [(list(x), {'Q1': 2. + x @ effect, 'stream_Q2': 1. - 0.3 * x[0]}) for x in X]
+        # Records without any latency are left out
+        records.append(([1, 1, 1, 1], {'qphh': 1.}))
+
+        X_table, Y = analysis.latency_table(records, ['Q1', 'Q2', 'Q3'])
+        self.assertEqual(X_table.shape, (40, 4))
+        self.assertTrue(np.isnan(Y[:, 2]).all())
+
+        effects = analysis.column_effects(records, ['a', 'b', 'c', 'd'], ['Q1', 'Q2', 'Q3'])
+        self.assertEqual(set(effects), {'Q1', 'Q2'})
+        np.testing.assert_allclose(list(effects['Q1'].values()), effect, atol=1e-9)
+        self.assertAlmostEqual(effects['Q2']['a'], -0.3)
+        self.assertEqual(analysis.prunable_columns(effects), ['b', 'd'])
+
+
+class HistoryTest(TempDirTestCase):
+
+    RECORDS = [
+        ([0, 1, 1, 0, 0, 0, 0, 0, 1], {'qphh': 10., 'time': 2.5}),
+        ([1, 1, 1, 1, 1, 1, 1, 1, 1], {'qphh': 20.}),
+        ([0, 0, 0, 0, 0, 0, 0, 0, 0], {'qphh': 5., 'index_size': 1.5, 'low_fidelity': 1.}),
+    ]
+
+    def record(self, history):
+        for individual, metrics in self.RECORDS:
+            history.update(individual, metrics)
+            history.update_generation()
+        history.serialize()
+
+    def test_binary_round_trip(self):
+        history = History(self.path)
+        self.record(history)
+        self.assertEqual(list(history.records(low_fidelity=True)), self.RECORDS)
+        self.assertEqual(list(history.records()), self.RECORDS[:2])
+
+        resumed = History(self.path, resume=True)
+        self.assertEqual(list(resumed.records(low_fidelity=True)), self.RECORDS)
+        self.assertEqual(resumed.generations, [0, 1, 2])
+        self.assertEqual(list(read_records(history.storepath)), self.RECORDS[:2])
+        # A new run starts from scratch
+        self.assertEqual(len(History(self.path)), 0)
+
+    def test_truncated_tail_recovery(self):
+        history = History(self.path)
+        self.record(history)
+        size = os.path.getsize(history.storepath)
+        with open(history.storepath, 'ab') as f:
+            # Header and half the genome of a record cut by a crash
+            f.write(b'\x03\x00\x00\x00\x02\x00\xff')
+
+        read = History.read(self.path)
+        self.assertEqual(len(read), 3)
+        self.assertEqual(os.path.getsize(history.storepath), size + 7)
+
+        resumed = History(self.path, resume=True)
+        self.assertEqual(os.path.getsize(history.storepath), size)
+        resumed.update([1, 0, 0, 0, 0, 0, 0, 0, 0], {'time': 1.})
+        resumed.serialize()
+        records = list(History.read(history.storepath).records(low_fidelity=True))
+        self.assertEqual(records[-1], ([1, 0, 0, 0, 0, 0, 0, 0, 0], {'time': 1.}))
+
+        resumed.truncate(1)
+        self.assertEqual(list(History(self.path, resume=True).records()), self.RECORDS[:1])
+
+    def test_export_json(self):
+        history = History(self.path)
+        self.record(history)
+        history.export_json()
+        with open(history.filepath, 'r') as f:
+            exported = json.load(f)
+        self.assertEqual(exported, {
+            '0': {'0 1 1 0 0 0 0 0 1': {'qphh': 10., 'time': 2.5}},
+            '1': {'1 1 1 1 1 1 1 1 1': {'qphh': 20.}},
+        })
+        self.assertEqual(list(read_records(history.filepath)), self.RECORDS[:2])
+
+
+class CheckpointTest(TempDirTestCase):
+
+    def fitnesses(self, history):
+        # Order within a generation follows the scheduler
+        records = zip(history.generations, history.records())
+        return sorted((generation, individual, metrics.get('fitness', 0.)) for generation, (individual, metrics) in records)
+
+    def test_resume(self):
+        for option, mode in (('--mode', 'generational'), ('--mode', 'steady_state'), ('--engine', 'numpy')):
+            full = run_train(os.path.join(self.path, mode, 'full'), '-g', '4', option, mode)
+            outpath = os.path.join(self.path, mode, 'stopped')
+            run_train(outpath, '-g', '2', option, mode)
+            resumed = run_train(outpath, '-g', '4', option, mode, '--resume')
+            self.assertEqual(self.fitnesses(resumed), self.fitnesses(full))
+
+    def test_save_and_load(self):
+        objective = self.objective()
+        objective.eval_baseline([0] * 22)
+        objective.evaluate([1] * 22)
+        objective.benchmark.refresh_stream_number = 7
+        checkpoint = Checkpoint(self.path, frequency=2)
+        checkpoint.maybe_save(['population'], 1, objective.history, objective)
+        self.assertFalse(checkpoint.exists())
+        checkpoint.maybe_save(['population'], 2, objective.history, objective, extra={'key': 1})
+        self.assertTrue(checkpoint.exists())
+        expected = random.random()
+
+        # Evaluations after the checkpoint are dropped on resume
+        objective.evaluate([0, 1] * 11)
+        objective.history.serialize()
+        history = History(objective.history.path, resume=True)
+        restored = self.objective()
+        population, generation, extra = checkpoint.load(history, restored)
+        self.assertEqual((population, generation, extra), (['population'], 2, {'key': 1}))
+        self.assertEqual(len(history), 2)
+        self.assertEqual(random.random(), expected)
+        self.assertEqual(restored.baseline_metrics, objective.baseline_metrics)
+        self.assertEqual(restored.best_fitness, objective.best_fitness)
+        self.assertEqual(restored.benchmark.refresh_stream_number, 7)
+
+
+class SimulatorTest(TempDirTestCase):
+
+    def model(self, columns):
+        # Linear over the whole bitvector, the build time only depends on the table
+        rng = np.random.RandomState(0)
+        metrics = analysis.QUERY_METRICS
+        tables = sorted({column.split('.')[0] for column in columns})
+        return CostModel(
+            columns=columns,
+            base_latency={metric: 10. for metric in metrics},
+            benefit={metric: (-0.3 * rng.rand(len(columns))).tolist() for metric in metrics},
+            index_size=rng.rand(len(columns)),
+            build_time=[0.1 * (1 + tables.index(column.split('.')[0])) for column in columns],
+            base_index_size=5.,
+            data_size=100.,
+        )
+
+    def test_synthetic_model(self):
+        database, benchmark = simulated_backend(seed=3)
+        self.assertEqual(CostModel.synthetic(database.flat_state, 3).to_dict(), database.model.to_dict())
+        database.model.noise = 0.
+        empty = benchmark.get_runtime()['time']
+        database.apply_vector(np.ones(database.state_size))
+        self.assertLess(benchmark.get_runtime()['time'], empty)
+        self.assertGreater(benchmark.get_storage_size()['index_size'], database.model.base_index_size)
+        self.assertEqual(database.get_current_state_vector().sum(), database.state_size)
+
+        model = CostModel.synthetic(database.flat_state[:-1])
+        with self.assertRaises(ValueError):
+            SimulatedDatabase(model=model)
+
+    def test_fit_recovers_the_model(self):
+        database = SimulatedDatabase()
+        database.model = model = self.model(database.flat_state)
+        rng = np.random.RandomState(1)
+        records = []
+        for individual in rng.randint(0, 2, (80, database.state_size)):
+            metrics = database.apply_vector(individual)
+            metrics.update(model.latencies(individual))
+            metrics.update(model.storage_size(individual))
+            records.append((individual.tolist(), metrics))
+
+        fitted = CostModel.fit(records, database.flat_state)
+        np.testing.assert_allclose(fitted.base_latency, model.base_latency)
+        np.testing.assert_allclose(fitted.benefit, model.benefit, atol=1e-9)
+        np.testing.assert_allclose(fitted.index_size, model.index_size, atol=1e-9)
+        np.testing.assert_allclose(fitted.build_time, model.build_time)
+        self.assertAlmostEqual(fitted.data_size, 100.)
+        self.assertAlmostEqual(fitted.noise, 0.)
+
+        filepath = os.path.join(self.path, 'cost_model.json')
+        fitted.save(filepath)
+        self.assertEqual(CostModel.load(filepath).to_dict(), fitted.to_dict())
+        with self.assertRaises(ValueError):
+            CostModel.fit([([0] * 22, {'qphh': 1.})], database.flat_state)
+
+    def test_scaled(self):
+        database = SimulatedDatabase()
+        model = self.model(database.flat_state)
+        individual = np.ones(database.state_size)
+        doubled = model.scaled(2.)
+        for metric, latency in model.latencies(individual).items():
+            self.assertAlmostEqual(doubled.latencies(individual)[metric], 2 * latency)
+        self.assertAlmostEqual(doubled.storage_size(individual)['index_size'],
+                               2 * model.storage_size(individual)['index_size'])
+
+
+class PopulationEngineTest(TempDirTestCase):
+
+    def test_crossover_cut_points_match_cx_two_point(self):
+        np.random.seed(0)
+        random.seed(0)
+        engine = PopulationEngine(state_size=5, cxpb=1.)
+        n = 20000
+        genomes = np.tile(np.array([[0] * 5, [1] * 5], dtype=np.uint8), (n, 1))
+        children = engine.crossover(genomes)
+        # Each child is the complement of its sibling, and the swapped
+        # segment is contiguous
+        np.testing.assert_array_equal(children[::2] ^ children[1::2], 1)
+        ours = [tuple(row) for row in children[::2]]
+
+        theirs = []
+        for _ in range(n):
+            first, second = [0] * 5, [1] * 5
+            tools.cxTwoPoint(first, second)
+            theirs.append(tuple(first))
+        for segment in set(ours) | set(theirs):
+            self.assertAlmostEqual(ours.count(segment) / n, theirs.count(segment) / n, delta=0.015)
+
+    def test_mutate_and_select(self):
+        np.random.seed(0)
+        genomes = np.zeros((4, 6), dtype=np.uint8)
+        np.testing.assert_array_equal(PopulationEngine(6, mutpb=1., indpb=1.).mutate(genomes.copy()), 1)
+        np.testing.assert_array_equal(PopulationEngine(6, mutpb=0., indpb=1.).mutate(genomes.copy()), 0)
+
+        engine = PopulationEngine(6, tournsize=40)
+        winners = engine.select([1., 5., 3.], k=10)
+        np.testing.assert_array_equal(winners, 1)
+
+    def test_unique_and_best(self):
+        engine = PopulationEngine(3)
+        genomes = np.array([[1, 0, 1], [0, 0, 0], [1, 0, 1]], dtype=np.uint8)
+        unique, inverse = engine.unique(genomes)
+        self.assertEqual(len(unique), 2)
+        np.testing.assert_array_equal(unique[inverse], genomes)
+        best, fitness = engine.best(genomes, [2., 3., 1.], k=2)
+        np.testing.assert_array_equal(best, genomes[[1, 0]])
+        np.testing.assert_array_equal(fitness, [3., 2.])
+
+    def test_train_with_the_numpy_engine(self):
+        history = run_train(self.path, '-g', '3', '--engine', 'numpy')
+        # Duplicated offspring are evaluated once
+        self.assertLessEqual(len(history), 1 + 3 * 6)
+        self.assertEqual(history.generation, 3)
+        self.assertTrue(all('fitness' in metrics for _, metrics in list(history.records())[1:]))
+
+
+class RefreshPipelineTest(TempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for number in (1, 2, 3):
+            for name in ('delete.%d', 'orders.tbl.u%d', 'lineitem.tbl.u%d'):
+                open(os.path.join(self.path, name % number), 'w').close()
+        # Incomplete set
+        open(os.path.join(self.path, 'delete.4'), 'w').close()
+        self.pool = FakePool()
+
+    def loads(self):
+        return [s.split()[4].strip("'") for s in self.pool.statements if s.startswith('load data')]
+
+    def renames(self):
+        return [s for s in self.pool.statements if s.startswith('RENAME')]
+
+    def test_staged_sets_are_swapped_in(self):
+        self.assertEqual(count_refresh_sets(self.path), 3)
+        pipeline = RefreshPipeline(self.pool, self.path, depth=2)
+        self.addCleanup(pipeline.close)
+        pipeline.activate(1)
+        rename, = self.renames()
+        self.assertTrue(rename.startswith(
+            'RENAME TABLE rfdelete TO rfdelete_swap, rfdelete_stage0 TO rfdelete, '
+            'rfdelete_swap TO rfdelete_stage0, '
+        ))
+
+        pipeline.suspend()
+        self.assertIsNone(pipeline.executor)
+        # Sets 2 and 3 are staged ahead, 4 does not exist
+        self.assertEqual(sorted(pipeline.staged), [2, 3])
+        self.assertEqual(len(self.loads()), 9)
+        pipeline.activate(2)
+        pipeline.activate(3)
+        self.assertEqual(len(self.loads()), 9)
+
+        with self.assertRaises(FileNotFoundError):
+            pipeline.activate(4)
+        self.assertEqual(len(self.renames()), 3)
+
+    def test_without_staging(self):
+        pipeline = RefreshPipeline(self.pool, self.path, depth=0)
+        pipeline.activate(2)
+        self.assertEqual(self.loads(), [
+            os.path.join(self.path, name) for name in ('delete.2', 'orders.tbl.u2', 'lineitem.tbl.u2')
+        ])
+        self.assertIn('TRUNCATE TABLE orders_temp;', self.pool.statements)
+        self.assertIsNone(pipeline.executor)
+        with self.assertRaises(FileNotFoundError):
+            RefreshPipeline(self.pool, os.path.join(self.path, 'empty'))
+
+
+def allocate_refresh_sets(path, n_allocations):
+    allocator = RefreshAllocator(path)
+    for k in range(n_allocations):
+        allocator.allocate(1 + k % 3, evaluation=f'{os.getpid()}/{k}')
+
+
+class RefreshAllocatorTest(TempDirTestCase):
+
+    def test_ranges(self):
+        with open(os.path.join(self.path, 'refresh_stream_number.txt'), 'w') as f:
+            f.write('5')
+        allocator = RefreshAllocator(self.path)
+        self.assertEqual(allocator.allocate(1, 'power'), 5)
+        self.assertEqual(allocator.allocate(3, 'throughput'), 6)
+        allocator.skip_to(20)
+        allocator.skip_to(10)
+        self.assertEqual(RefreshAllocator(self.path).allocate(2), 20)
+        with open(allocator.counterpath, 'r') as f:
+            self.assertEqual(f.read(), '22')
+
+        ranges = [(first, last, evaluation) for first, last, evaluation, _, _ in allocator.consumed()]
+        self.assertEqual(ranges, [(5, 5, 'power'), (6, 8, 'throughput'), (9, 19, 'skipped'), (20, 21, None)])
+        self.assertEqual(len(allocator.consumed('throughput')), 1)
+
+    def test_concurrent_allocations_never_overlap(self):
+        workers = [Process(target=allocate_refresh_sets, args=(self.path, 20)) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual([worker.exitcode for worker in workers], [0] * 4)
+
+        ranges = RefreshAllocator(self.path).consumed()
+        self.assertEqual(len(ranges), 80)
+        numbers = [n for first, last, _, _, _ in ranges for n in range(first, last + 1)]
+        self.assertEqual(numbers, list(range(1, len(numbers) + 1)))
+
+
+class MeasurementPolicyTest(TempDirTestCase):
+
+    class Samples:
+        # Benchmark handing out the given samples one by one
+        def __init__(self, *samples):
+            self.samples = list(samples)
+            self.prepared = []
+
+        def prepare_cache(self, state):
+            self.prepared.append(state)
+
+        def next(self):
+            return self.samples.pop(0)
+
+    def test_combine(self):
+        samples = [{'time': 1., 'Q1': 1.}, {'time': 2., 'Q1': 3.}, {'time': 9., 'Q1': 2.}]
+        metrics = MeasurementPolicy().combine(samples)
+        self.assertEqual((metrics['time'], metrics['Q1'], metrics['repetitions']), (2., 2., 3))
+        self.assertLess(metrics['time_ci_low'], 4.)
+        self.assertGreater(metrics['time_ci_high'], 4.)
+        self.assertNotIn('Q1_ci_low', metrics)
+        self.assertEqual(MeasurementPolicy(aggregate='mean').combine(samples)['time'], 4.)
+        self.assertEqual(MeasurementPolicy(aggregate='trimmed_mean', trim=0.34).combine(samples)['time'], 2.)
+        with self.assertRaises(ValueError):
+            MeasurementPolicy(cache_state='hot')
+
+    def test_combine_aborted(self):
+        ok = {'time': 10., 'aborted': 0}
+        truncated = {'time': 0.4, 'aborted': 1, 'Q7_truncated': 0.1}
+        for samples in ([ok, ok, truncated], [ok, truncated]):
+            metrics = MeasurementPolicy().combine(samples)
+            self.assertEqual(metrics, {**truncated, 'repetitions': len(samples)})
+        self.assertEqual(MeasurementPolicy().combine([ok, ok])['aborted'], 0.)
+
+    def test_measure(self):
+        policy = MeasurementPolicy(repetitions=3, cache_state='warm')
+        benchmark = self.Samples({'time': 3.}, {'time': 1.}, {'time': 2.})
+        self.assertEqual(policy.measure(benchmark.next, benchmark)['time'], 2.)
+        self.assertEqual(benchmark.prepared, ['warm'] * 3)
+
+        # Aborted streams and those far from the elite are not repeated
+        benchmark = self.Samples({'time': 3., 'aborted': 1})
+        self.assertEqual(policy.measure(benchmark.next, benchmark), {'time': 3., 'aborted': 1})
+        adaptive = MeasurementPolicy(repetitions=3, adaptive=True)
+        benchmark = self.Samples({'time': 3.})
+        self.assertEqual(adaptive.measure(benchmark.next, benchmark, promising=lambda sample: False), {'time': 3.})
+        self.assertEqual(adaptive.stats(), {'samples': 1, 'saved': 2})
+
+    def test_objective_repetitions(self):
+        _, benchmark = simulated_backend(seed=0)
+        objective = self.objective('time', benchmark=benchmark, policy=MeasurementPolicy(repetitions=5))
+        objective.eval_baseline([0] * 22)
+        metrics = objective.baseline_metrics
+        self.assertEqual(metrics['repetitions'], 5)
+        self.assertLess(metrics['time_ci_low'], metrics['time'])
+        self.assertLess(metrics['time'], metrics['time_ci_high'])
+
+    def test_cache_state(self):
+        pool = FakePool()
+        benchmark = Benchmark(Database(pool))
+        benchmark.prepare_cache('warm')
+        self.assertEqual(pool.statements[-1], 'CALL QUERY_STREAM')
+        with mock.patch.object(config, 'COLD_CACHE_COMMAND', None):
+            with self.assertRaises(ValueError):
+                benchmark.prepare_cache('cold')
+            with self.assertRaises(SystemExit), mock.patch('sys.stderr'):
+                parse_args('--cache_state', 'cold')
+            self.assertEqual(parse_args('--cache_state', 'cold', '--backend', 'simulated').cache_state, 'cold')
+        with mock.patch.object(config, 'COLD_CACHE_COMMAND', 'true'):
+            benchmark.prepare_cache('cold')
+        self.assertEqual(pool.statements[-1], 'FLUSH TABLES')
+
+
+def fake_stream_worker(worker_id, conn_config, session_setup, n_queries, tasks, results):
+    # Fails the streams of worker conn_config['fail'], exits if conn_config['exit']
+    while tasks.get() is not None:
+        if worker_id == conn_config.get('exit'):
+            os._exit(2)
+        if worker_id == conn_config.get('fail'):
+            results.put((worker_id, None, 0., 'OperationalError()'))
+        else:
+            results.put((worker_id, {'Q1': float(os.getpid())}, 1., None))
+
+
+class StreamWorkerPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        patch = mock.patch.object(streams, 'stream_worker', fake_stream_worker)
+        patch.start()
+        self.addCleanup(patch.stop)
+        streams.StreamWorkerPool.POLL_INTERVAL = 0.1
+        self.addCleanup(setattr, streams.StreamWorkerPool, 'POLL_INTERVAL', 5.)
+
+    def test_default_num_streams(self):
+        self.assertEqual([streams.default_num_streams(sf) for sf in (0.1, 1, 10, 50, 100000)], [2, 2, 3, 4, 9])
+        _, benchmark = simulated(scale_factor=10)
+        self.assertEqual(benchmark.NUM_STREAMS, 3)
+        _, benchmark = simulated(num_streams=5)
+        self.assertIn('stream5_time', benchmark.get_qphh())
+
+    def test_workers_are_reused(self):
+        pool = streams.StreamWorkerPool({}, n_workers=3)
+        self.addCleanup(pool.close)
+        pool.start()
+        first = pool.wait()
+        pool.start()
+        second = pool.wait()
+        self.assertEqual(first, second)
+        self.assertEqual([profiles['Q1'] for profiles, _ in first], [worker.pid for worker in pool.workers])
+
+    def test_errors_are_reported_after_every_stream(self):
+        pool = streams.StreamWorkerPool({'fail': 0, 'exit': 2}, n_workers=3)
+        self.addCleanup(pool.close)
+        pool.start()
+        with self.assertRaisesRegex(RuntimeError, 'stream 0 failed: OperationalError.*worker 2 exited with code 2'):
+            pool.wait()
+        # Nothing left behind for the next test
+        self.assertTrue(pool.results.empty())
+
+
+class IndexSizeEstimatorTest(TempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.database, self.benchmark = simulated()
+        self.vectors = np.random.RandomState(0).randint(0, 2, (40, self.database.state_size))
+
+    def storage_size(self, vector):
+        return self.database.model.storage_size(vector)
+
+    def test_calibrate_and_predict(self):
+        filepath = os.path.join(self.path, 'index_catalog.json')
+        estimator = IndexSizeEstimator(self.benchmark, filepath)
+        self.assertIsNone(estimator.predict(self.vectors[0]))
+        estimator.calibrate()
+        self.assertEqual(estimator.stats(), {'predicted': 0, 'measured': self.database.state_size})
+        np.testing.assert_allclose([estimator.build_time[c] for c in self.database.flat_state],
+                                   self.database.model.build_time)
+        np.testing.assert_array_equal(self.database.current_vector, 0)
+
+        loaded = IndexSizeEstimator(self.benchmark, filepath)
+        for vector in self.vectors:
+            self.assertAlmostEqual(loaded.predict(vector)['index_size'], self.storage_size(vector)['index_size'])
+
+        self.database.apply_strategy = 'visibility'
+        hidden = IndexSizeEstimator(self.benchmark)
+        hidden.calibrate()
+        self.assertEqual(hidden.build_time, {})
+
+    def test_get_storage_size(self):
+        estimator = IndexSizeEstimator(self.benchmark, verify_every=2)
+        self.database.apply_vector(self.vectors[0])
+        self.assertNotIn('index_size_estimated', estimator.get_storage_size())
+        # Measured again after verify_every predictions
+        sizes = [estimator.get_storage_size() for _ in range(3)]
+        self.assertEqual([metrics.get('index_size_estimated') for metrics in sizes], [1, 1, None])
+        self.assertAlmostEqual(sizes[-1]['index_size_error'], 0.)
+        self.database.apply_vector(np.zeros(self.database.state_size))
+        self.assertEqual(estimator.get_storage_size()['index_size_estimated'], 1)
+        self.database.apply_vector(np.ones(self.database.state_size))
+        self.assertNotIn('index_size_estimated', estimator.get_storage_size())
+        self.assertEqual(estimator.stats(), {'predicted': 3, 'measured': 3})
+
+    def test_fit(self):
+        records = [(vector.tolist(), self.storage_size(vector)) for vector in self.vectors]
+        estimator = IndexSizeEstimator(self.benchmark)
+        estimator.fit(records[:self.database.state_size])
+        self.assertIsNone(estimator.predict(self.vectors[0]))
+        estimator.fit(records)
+        for vector in np.random.RandomState(1).randint(0, 2, (10, self.database.state_size)):
+            self.assertAlmostEqual(estimator.predict(vector)['index_size'], self.storage_size(vector)['index_size'])
+
+    def test_estimate_index_size_records_it(self):
+        args = parse_args('--backend', 'simulated', '--estimate_index_size')
+        self.assertEqual(args.record_metrics, ['index_size'])
+
+
+class SizesPool(FakePool):
+    '''
+        Every idx_ index of indexes takes 1MB, the PK 10MB
+    '''
+
+    def execute(self, statement):
+        if 'innodb_index_stats' in statement:
+            idx = [(table, index, 1.) for table, _, index, _ in self.indexes]
+            return idx + [('orders', 'o_custkey', 10.)]
+        if 'DATA_LENGTH' in statement:
+            return [(100.,)]
+        return super().execute(statement)
+
+
+class VisibilityTest(unittest.TestCase):
+
+    HIDDEN = [('orders', 'o_clerk', 'idx_o_clerk', 'NO'), ('part', 'p_mfgr', 'idx_p_mfgr', 'YES')]
+
+    def test_candidates_are_built_hidden(self):
+        pool = FakePool([('orders', 'o_clerk', 'idx_o_clerk', 'YES'), ('orders', 'o_comment', 'idx_o_comment', 'YES')])
+        database = Database(pool, apply_strategy='visibility')
+        orders, = [statement for statement in pool.statements if statement.startswith('ALTER TABLE orders')]
+        self.assertEqual(orders, (
+            'ALTER TABLE orders DROP INDEX idx_o_comment, ALTER INDEX idx_o_clerk INVISIBLE, '
+            'ADD INDEX idx_o_orderpriority (o_orderpriority) INVISIBLE, '
+            'ADD INDEX idx_o_shippriority (o_shippriority) INVISIBLE, '
+            'ADD INDEX idx_o_totalprice (o_totalprice) INVISIBLE;'
+        ))
+        self.assertEqual(len(pool.statements), len(database.tables))
+
+        pool.statements.clear()
+        state = database.vector_to_state(np.zeros(database.state_size))
+        state['orders'].update(o_clerk=1, o_totalprice=1)
+        database.apply_state(state)
+        state['orders']['o_clerk'] = 0
+        database.apply_state(state)
+        self.assertEqual(pool.statements, [
+            'ALTER TABLE orders ALTER INDEX idx_o_clerk VISIBLE, ALTER INDEX idx_o_totalprice VISIBLE;',
+            'ALTER TABLE orders ALTER INDEX idx_o_clerk INVISIBLE;',
+        ])
+        with self.assertRaises(ValueError):
+            Database(FakePool(), apply_strategy='drop')
+
+    def test_hidden_indexes_are_not_used(self):
+        pool = SizesPool(self.HIDDEN)
+        database = Database(pool, reset_indexes=False, apply_strategy='visibility')
+        self.assertEqual(database.get_invisible_indexes(), {('orders', 'idx_o_clerk')})
+        self.assertEqual(database.get_current_state()['orders']['o_clerk'], 0)
+        self.assertEqual(database.get_current_state()['part']['p_mfgr'], 1)
+        self.assertEqual(database.current_vector.sum(), 1)
+
+        data_size, index_sizes = Benchmark(database).get_index_sizes()
+        self.assertEqual(data_size, 100.)
+        self.assertEqual(index_sizes, {('part', 'idx_p_mfgr'): 1., ('orders', 'o_custkey'): 10.})
+        # Without the strategy, every index is visible
+        self.assertEqual(Database(FakePool(self.HIDDEN), reset_indexes=False).current_vector.sum(), 2)
+
+    def test_refresh_metrics_warning(self):
+        with mock.patch.object(experiment.logger, 'warning') as warning:
+            parse_args('--apply_strategy', 'visibility', '-f', 'time')
+            warning.assert_not_called()
+            parse_args('--apply_strategy', 'visibility', '-f', 'time', '--record_metrics', 'RF1')
+            warning.assert_called_once()
+
+
+def plan(key, rows=100, cost=10.):
+    return {'query_block': {
+        'select_id': 1,
+        'cost_info': {'query_cost': str(cost)},
+        'table': {
+            'table_name': 'orders', 'access_type': 'ref' if key else 'ALL', 'key': key,
+            'possible_keys': ['idx_o_clerk'], 'rows_examined_per_scan': rows, 'filtered': '10.00',
+            'cost_info': {'read_cost': '1.0', 'eval_cost': '2.0'},
+        },
+    }}
+
+
+class ExplainPool(FakePool):
+    '''
+        EXPLAIN of query k costs k, the plans use idx_o_clerk when built
+    '''
+
+    def __init__(self):
+        super().__init__()
+        self.n_explained = 0
+        self.key = None
+
+    def execute(self, statement):
+        if statement.startswith('EXPLAIN'):
+            self.n_explained += 1
+            k = int(statement.split('query')[-1])
+            return [(json.dumps(plan(self.key, cost=k)),)]
+        if 'ADD INDEX idx_o_clerk' in statement:
+            self.key = 'idx_o_clerk'
+        return super().execute(statement)
+
+
+class ExplainTest(TempDirTestCase):
+
+    def test_query_cost(self):
+        self.assertEqual(explain.query_cost(plan(None, cost=12.5)), 12.5)
+        union = {'query_block': {'union_result': {'query_specifications': [plan(None, cost=1.), plan(None, cost=2.)]}}}
+        self.assertEqual(explain.query_cost(union), 3.)
+        self.assertEqual(explain.parse_plan([(json.dumps(union),)]), union)
+
+    def test_normalize_plan_and_fingerprint(self):
+        self.assertEqual(explain.normalize_plan(plan('idx_o_clerk')), {'query_block': {
+            'select_id': 1,
+            'table': {'table_name': 'orders', 'access_type': 'ref', 'key': 'idx_o_clerk'},
+        }})
+        same = explain.fingerprint({'Q1': plan('idx_o_clerk', rows=5, cost=1.), 'Q2': plan(None)})
+        self.assertEqual(explain.fingerprint({'Q2': plan(None, rows=7), 'Q1': plan('idx_o_clerk')}), same)
+        self.assertNotEqual(explain.fingerprint({'Q1': plan(None), 'Q2': plan(None)}), same)
+        self.assertNotEqual(explain.fingerprint({'Q1': plan('idx_o_clerk')}), same)
+
+    def test_plan_cost(self):
+        pool = ExplainPool()
+        database = Database(pool)
+        benchmark = Benchmark(database)
+        metrics = benchmark.get_plan_cost()
+        self.assertEqual(metrics['plan_cost'], sum(range(1, 23)))
+        self.assertEqual(metrics['Q22_cost'], 22.)
+        # Plans are explained again once the indexes change
+        fingerprint = benchmark.get_plan_fingerprint()
+        self.assertEqual(pool.n_explained, 22)
+        vector = np.zeros(database.state_size)
+        vector[database.column_position['orders.o_clerk']] = 1
+        database.apply_vector(vector)
+        self.assertNotEqual(benchmark.get_plan_fingerprint(), fingerprint)
+        self.assertEqual(pool.n_explained, 44)
+
+    def test_proxy_promotion(self):
+        objective = self.objective('qphh', proxy='plan_cost', promote=0.25)
+        objective.eval_baseline([0] * 22)
+        self.assertIn('plan_cost', objective.baseline_metrics)
+        individuals = np.random.RandomState(0).randint(0, 2, (40, 22)).tolist()
+        for individual in individuals:
+            objective.evaluate(individual)
+        records = list(objective.history.records())[1:]
+        promoted = [metrics for _, metrics in records if metrics['promoted']]
+        estimated = [metrics for _, metrics in records if not metrics['promoted']]
+        self.assertEqual(len(promoted) + len(estimated), 40)
+        self.assertLess(len(promoted), 20)
+        self.assertTrue(all('qphh' in metrics for metrics in promoted))
+        self.assertFalse(any('qphh' in metrics for metrics in estimated))
+        self.assertEqual(objective.proxy_correlation()['promoted'], len(promoted))
+        self.assertGreater(objective.proxy_correlation()['spearman'], 0.)
+
+
+class MultiFidelityTest(TempDirTestCase):
+
+    FIDELITIES = [{'scale_factor': 0.1, 'seed': 1}, {'scale_factor': 0.3, 'seed': 2}]
+
+    def setUp(self):
+        super().setUp()
+        self.individuals = np.random.RandomState(0).randint(0, 2, (27, 22)).tolist()
+
+    def evaluator(self, *argv):
+        args = parse_args('--backend', 'simulated', '--sim_noise', '0', '-o', self.path, '--multi_fidelity', *argv)
+        database, benchmark = experiment.build_backend(args)
+        objective = experiment.build_objective(args, benchmark, History(self.path))
+        with mock.patch.object(config, 'FIDELITIES', self.FIDELITIES):
+            evaluator = experiment.build_evaluator(args, objective, database)
+        evaluator.eval_baseline([0] * 22)
+        return objective, evaluator
+
+    def test_map_promotion_counts(self):
+        objective, evaluator = self.evaluator()
+        self.assertIsInstance(evaluator, MultiFidelityEvaluator)
+        # Duplicates are measured once
+        fitnesses = evaluator.map(objective.evaluate, self.individuals + self.individuals[:3])
+        self.assertEqual(evaluator.stats(), {0.1: 27, 0.3: 9, 1: 3})
+        self.assertEqual(fitnesses[-3:], fitnesses[:3])
+
+        history = objective.history
+        self.assertEqual(len(history), 1 + 27 + 9 + 3)
+        full = list(history.records())[1:]
+        self.assertEqual([metrics['fidelity'] for _, metrics in full], [1.] * 3)
+        # Eliminated individuals rank below the promoted ones
+        promoted = [metrics['fitness'] for _, metrics in full]
+        promoted_keys = {pack_individual(individual) for individual, _ in full}
+        eliminated = [fitness for individual, (fitness,) in zip(self.individuals, fitnesses)
+                      if pack_individual(individual) not in promoted_keys]
+        self.assertEqual(len(eliminated), 24)
+        self.assertLessEqual(max(eliminated), min(promoted))
+
+        # Cached individuals skip every level
+        evaluator.map(objective.evaluate, [individual for individual, _ in full])
+        self.assertEqual(evaluator.stats(), {0.1: 27, 0.3: 9, 1: 3})
+
+    def test_levels_share_benchmark_settings(self):
+        _, evaluator = self.evaluator('--max_query_time', '5', '--num_streams', '3')
+        for level in evaluator.levels:
+            self.assertEqual(level.objective.benchmark.max_query_time, 5.)
+            self.assertEqual(level.objective.benchmark.NUM_STREAMS, 3)
+
+    def test_scaled_levels(self):
+        database, _ = simulated()
+        levels = build_levels(self.FIDELITIES, 'time', model=database.model, model_scale_factor=2.)
+        self.assertEqual([level.scale_factor for level in levels], [0.1, 0.3])
+        for level in levels:
+            level.eval_baseline([0] * 22)
+        self.assertAlmostEqual(levels[1].objective.baseline_metrics['time'],
+                               3 * levels[0].objective.baseline_metrics['time'])
+        _, fitness = levels[0].measure([1] * 22)
+        self.assertEqual(levels[0].objective.best_fitness, fitness)
+
+    def test_aborted_streams_penalized(self):
+        database, _ = simulated()
+        level = build_levels(self.FIDELITIES[:1], 'time', model=database.model)[0]
+        level.objective.benchmark.max_query_time = 0.5
+        # The baseline would abort, it is measured again unbounded
+        level.eval_baseline([0] * 22)
+        self.assertEqual(level.objective.baseline_metrics['aborted'], 0)
+        self.assertEqual(level.objective.benchmark.max_query_time, 0.5)
+
+        # Aborted streams rank with the worst complete one measured before
+        complete, n_aborted = [], 0
+        for individual in np.random.RandomState(0).randint(0, 2, (20, 22)).tolist():
+            metrics, fitness = level.measure(individual)
+            if metrics['aborted']:
+                self.assertEqual(fitness, min(complete, default=0.))
+                n_aborted += 1
+            else:
+                complete.append(fitness)
+        self.assertTrue(complete and n_aborted)
+        self.assertEqual(len(level.aborted), n_aborted)
+
+
+class MetricPlannerTest(TempDirTestCase):
+
+    PLANS = {
+        'qphh': ['qphh'],
+        'time': ['time'],
+        'time_squared': ['time'],
+        'plan_cost': ['plan_cost'],
+        'dbsize': ['dbsize'],
+    }
+
+    def setUp(self):
+        super().setUp()
+        _, self.benchmark = simulated()
+        self.planner = MetricPlanner(self.benchmark)
+
+    def test_plan_of_every_fitness(self):
+        self.assertEqual(set(__fitness__), set(self.PLANS))
+        for fitness_name, measurements in self.PLANS.items():
+            plan = self.planner.plan(get_fitness_fn(fitness_name)[1])
+            self.assertEqual(list(plan), measurements)
+            self.assertEqual(plan[measurements[0]], self.planner.providers[measurements[0]])
+
+    def test_shared_measurements(self):
+        self.assertEqual(list(self.planner.plan(['qphh', 'time', 'Q3', 'RF1'])), ['qphh'])
+        self.assertEqual(list(self.planner.plan(['time', 'index_size'])), ['dbsize', 'time'])
+        self.assertEqual(list(self.planner.plan(['stream_Q1', 'qphh'])), ['time', 'qphh'])
+        self.assertEqual(list(self.planner.plan(['Q1_cost', 'index_size', 'plan_cost'])), ['plan_cost', 'dbsize'])
+        with self.assertRaises(ValueError):
+            self.planner.plan(['latency'])
+
+    def test_each_measurement_runs_once(self):
+        for fitness_name, measurements in self.PLANS.items():
+            with mock.patch.object(self.benchmark, 'get_runtime', wraps=self.benchmark.get_runtime) as runtime, \
+                    mock.patch.object(self.benchmark, 'get_qphh', wraps=self.benchmark.get_qphh) as qphh:
+                objective = self.objective(fitness_name, benchmark=self.benchmark, record=['index_size'])
+                objective.eval_baseline([0] * 22)
+                fitness, = objective.evaluate([1, 0] * 11)
+            self.assertEqual(runtime.call_count, 2 * ('time' in measurements))
+            self.assertEqual(qphh.call_count, 2 * ('qphh' in measurements))
+            self.assertGreater(fitness, 0.)
+            self.assertIn('index_size', objective.baseline_metrics)
+
+
+class PlanCacheTest(TempDirTestCase):
+
+    def test_entries(self):
+        cache = PlanCache(self.path, settings={'scale_factor': 1})
+        self.assertIsNone(cache.get('abc', ['time']))
+        cache.put('abc', ['time'], {'time': 3, 'stream_Q1': 1.})
+        cache.put('abc', ['time'], {'time': 4})
+        self.assertEqual(cache.get('abc', ['time']), {'time': 3., 'stream_Q1': 1.})
+        # Only the metrics of the same measurements
+        self.assertIsNone(cache.get('abc', ['qphh']))
+        self.assertEqual(cache.stats(), {'benchmarks_avoided': 1, 'benchmarks_run': 2, 'plans': 1})
+
+        self.assertEqual(PlanCache(self.path, settings={'scale_factor': 1}).get('abc', ['time'])['time'], 3.)
+        self.assertIsNone(PlanCache(self.path, settings={'scale_factor': 10}).get('abc', ['time']))
+
+    def test_objective_reuses_runtime_metrics(self):
+        for fitness_name in ('time', 'qphh'):
+            _, benchmark = simulated()
+            objective = self.objective(fitness_name, benchmark=benchmark,
+                                       plan_cache=PlanCache(), record=['index_size'])
+            positions = benchmark.db.column_position
+            # Indexes no query plan picks, one on a table of the refresh functions
+            model = benchmark.model
+            queries = [k for k, metric in enumerate(model.metrics) if metric.startswith('Q')]
+            for column in ('supplier.s_phone', 'orders.o_clerk'):
+                model.benefit[queries, positions[column]] = 0.
+            objective.eval_baseline([0] * 22)
+
+            for column, reused in (('supplier.s_phone', 1), ('orders.o_clerk', int(fitness_name == 'time'))):
+                individual = [0] * 22
+                individual[positions[column]] = 1
+                objective.evaluate(individual)
+                _, metrics = list(objective.history.records())[-1]
+                self.assertEqual(metrics.get('plan_reused', 0), reused)
+                # The storage is measured, never reused
+                self.assertGreater(metrics['index_size'], objective.baseline_metrics['index_size'])
+                if reused:
+                    self.assertEqual(metrics['time'], objective.baseline_metrics['time'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,13 +3,17 @@ import random
 
 import numpy as np
 
-import utils
-from benchmark import Benchmark
-from database import Database
+import analysis
+import experiment
+from cache import pack_individual
+from checkpoint import Checkpoint
 from deap import algorithms, base, creator, tools
-from fitness import (Objective, fake_metric, get_available_fitness,
-                     get_fitness_fn)
+from fitness import fake_metric
 from history import History
+from population import PopulationEngine
+from scheduler import EvaluationScheduler
+from steady_state import SteadyState
+from surrogate import SurrogateScreen
 
 
 def get_params():
@@ -17,21 +21,33 @@ def get_params():
 
     parser = argparse.ArgumentParser()
 
-    parser.add_argument('-p', '--pop_size', type=int, default=50)
+    experiment.add_arguments(parser)
     parser.add_argument('-e', '--elite_size', type=int, default=4)
-    parser.add_argument('-g', '--generations', type=int, default=100)
     parser.add_argument('-m', '--mutation_rate', type=float, default=0.05)
     parser.add_argument('--mutation_prob', type=float, default=0.2)
     parser.add_argument('--crossover_prob', type=float, default=0.8)
-    parser.add_argument('-o', '--outpath', type=str, default='runs/')
-    parser.add_argument('-f', '--fitness', type=str,
-        default='qphh', choices=get_available_fitness())
-    parser.add_argument('--debug', action='store_true')
-    # WARNING: use this only for debugging fast
-    parser.add_argument('--use_fake_eval', action='store_true') 
-    parser.add_argument('--use_tensorboard', action='store_true') 
-
-    args = parser.parse_args()
+    # Checkpoints are saved to the outpath every checkpoint_freq generations
+    parser.add_argument('--checkpoint_freq', type=int, default=1)
+    parser.add_argument('--resume', action='store_true',
+        help='continue the run saved in the outpath checkpoint')
+    # steady_state breeds a new individual whenever an evaluation finishes
+    parser.add_argument('--mode', type=str, default='generational',
+        choices=['generational', 'steady_state'])
+    # numpy keeps the population in a bit matrix with batched operators
+    parser.add_argument('--engine', type=str, default='deap',
+        choices=['deap', 'numpy'])
+    # Surrogate pre-screening of the offspring (generational mode)
+    parser.add_argument('--surrogate', action='store_true')
+    parser.add_argument('--surrogate_top_k', type=float, default=0.25,
+        help='fraction of the offspring sent to the real benchmark')
+    parser.add_argument('--surrogate_kappa', type=float, default=1.0)
+    parser.add_argument('--surrogate_min_samples', type=int, default=30)
+
+    args = experiment.check_arguments(parser, parser.parse_args())
+    if args.engine == 'numpy' and args.mode != 'generational':
+        parser.error('--engine numpy only supports the generational mode')
+    if args.multi_fidelity and args.mode != 'generational':
+        parser.error('--multi_fidelity only supports the generational mode')
     print('\n* * * Arguments * * * ')
     print(args)
     return args
@@ -39,41 +55,57 @@ def get_params():
 
 def train(args):
 
-    # Get the connection string as defined in config.py file 
-    connection_string = utils.get_conn_str()
-
-    # Creates a database object for handling db connections
-    # Queries and index creation
-    database = Database(
-        connection_string=connection_string,
-        reset_indexes=True
-    )
+    # MySQL server or simulated backend
+    database, benchmark = experiment.build_backend(args)
 
     # Number of columns to optimize indexing 
     # (i.e., size of each individual)
     state_size = database.state_size
 
-    # Benchmark object allows running power testes, get storage size
-    # query time and other performance metrics on the database
-    benchmark = Benchmark(database)    
+    # Periodic snapshots of the run, used by --resume
+    checkpoint = Checkpoint(path=args.outpath, frequency=args.checkpoint_freq)
+    resume = args.resume and checkpoint.exists()
+    if args.resume and not resume:
+        logger.warning(f'No checkpoint found at {checkpoint.filepath}, starting a new run')
 
     # Record all metrics and save them to disk
     history = History(
         path=args.outpath, 
         file_name='history.json', 
-        tensorboard=args.use_tensorboard
+        tensorboard=args.use_tensorboard,
+        resume=resume,
+        settings=experiment.measurement_settings(args, benchmark)
     )
 
     # Objective allows the fitness evaluation
     # by using the benchmark metrics
-    objective = Objective(
-        benchmark=benchmark, 
-        fitness_name=args.fitness,
-        history=history
+    objective = experiment.build_objective(args, benchmark, history)
+    cache = objective.cache
+
+    # Reorders each generation to minimize the index builds and drops
+    scheduler = EvaluationScheduler(
+        database=database,
+        strategy=args.schedule,
+        is_cached=cache.__contains__ if cache is not None else None
     )
 
+    # Only the most promising offspring are benchmarked for real
+    surrogate = None
+    if args.surrogate:
+        surrogate = SurrogateScreen(
+            history=history,
+            top_k=args.surrogate_top_k,
+            kappa=args.surrogate_kappa,
+            min_samples=args.surrogate_min_samples
+        )
+
+    # Evaluations run in this process or spread over the replicas
+    evaluator = experiment.build_evaluator(args, objective, database)
+
     # Using the initial state as baseline individual
-    objective.eval_baseline([0] * state_size)
+    # (a resumed run restores it from the checkpoint)
+    if not resume:
+        evaluator.eval_baseline([0] * state_size)
 
     if args.use_fake_eval:
         print('''ATTENTION: You are using fake metric values!.
@@ -93,6 +125,7 @@ def train(args):
 
     # Set up the evaluation of the fitness function
     toolbox.register("evaluate", objective.evaluate)
+    toolbox.register("map", evaluator.map)
     # Set up the crossover strategy
     toolbox.register("mate", tools.cxTwoPoint)
     # Set up the mutation strategy and rate
@@ -101,32 +134,123 @@ def train(args):
     toolbox.register("select", tools.selTournament, tournsize=args.elite_size)
 
     # Set up the number of individuals in the population
-    population = toolbox.population(n=args.pop_size)
+    if args.engine == 'numpy':
+        engine = PopulationEngine(
+            state_size=state_size,
+            cxpb=args.crossover_prob,
+            mutpb=args.mutation_prob,
+            indpb=args.mutation_rate,
+            tournsize=args.elite_size
+        )
+        # Genomes and their fitness (unknown before the first generation)
+        population = (engine.random(args.pop_size), None)
+    else:
+        population = toolbox.population(n=args.pop_size)
+
+    # Already evaluated population, RNG states, etc. of a stopped run
+    start_gen = 0
+    if resume:
+        population, start_gen, _ = checkpoint.load(history, objective)
 
     # Train the Genetic Algorithm for some generations
     NGEN = args.generations
-    for gen in range(NGEN):
-        history.update_generation()
-        # Apply mutation and crossover on the population 
-        offspring = algorithms.varAnd(
-            population, toolbox,
+    if args.mode == 'steady_state':
+        # Same evaluation budget as the generational loop
+        steady_state = SteadyState(
+            toolbox=toolbox,
+            objective=objective,
+            evaluator=evaluator,
+            history=history,
             cxpb=args.crossover_prob,
             mutpb=args.mutation_prob,
+            checkpoint=checkpoint
         )
-        # Evaluate the fitness of each individual
-        fits = toolbox.map(toolbox.evaluate, offspring)
-        # Log and assign the calculated fitness for each individual
-        for fit, ind in zip(fits, offspring):
-            logger.info(f'Evaluated ind {ind}, result: {fit}')
-            ind.fitness.values = fit
-        # Select the individuals with best fitness values
-        population = toolbox.select(offspring, k=len(population))
+        population = steady_state.run(
+            population,
+            n_evaluations=NGEN * args.pop_size,
+            population=population if resume else None,
+            n_done=start_gen * args.pop_size
+        )
+    elif args.engine == 'numpy':
+        genomes, fitness = population
+        for gen in range(start_gen, NGEN):
+            history.update_generation()
+            # Crossover and mutation of the whole population at once
+            offspring = engine.vary(genomes)
+            # Duplicated genomes are evaluated once
+            unique, inverse = engine.unique(offspring)
+            pending = list(unique)
+            fitness_of = dict()
+            if surrogate is not None:
+                # The others get the fitness predicted by the surrogate
+                pending, predicted = surrogate.screen(pending, scheduler.is_cached)
+                for ind, fit in predicted:
+                    fitness_of[pack_individual(ind)] = fit
+            # Evaluate the fitness of each individual,
+            # in the order that requires the least index changes
+            pending = scheduler.schedule(pending)
+            fits = toolbox.map(toolbox.evaluate, pending)
+            for fit, ind in zip(fits, pending):
+                logger.info(f'Evaluated ind {ind.tolist()}, result: {fit}')
+                fitness_of[pack_individual(ind)] = fit[0]
+            offspring_fitness = np.array(
+                [fitness_of[pack_individual(ind)] for ind in unique]
+            )[inverse]
+            # Select the individuals with best fitness values
+            selected = engine.select(offspring_fitness, k=len(genomes))
+            genomes, fitness = offspring[selected], offspring_fitness[selected]
+            population = (genomes, fitness)
+            if cache is not None:
+                logger.info(f'Evaluation cache: {cache.stats()}')
+            checkpoint.maybe_save(population, gen + 1, history, objective)
+    else:
+        for gen in range(start_gen, NGEN):
+            history.update_generation()
+            # Apply mutation and crossover on the population 
+            offspring = algorithms.varAnd(
+                population, toolbox,
+                cxpb=args.crossover_prob,
+                mutpb=args.mutation_prob,
+            )
+            pending = offspring
+            if surrogate is not None:
+                # The others get the fitness predicted by the surrogate
+                pending, predicted = surrogate.screen(offspring, scheduler.is_cached)
+                for ind, fit in predicted:
+                    ind.fitness.values = (fit,)
+            # Evaluate the fitness of each individual,
+            # in the order that requires the least index changes
+            pending = scheduler.schedule(pending)
+            fits = toolbox.map(toolbox.evaluate, pending)
+            # Log and assign the calculated fitness for each individual
+            for fit, ind in zip(fits, pending):
+                logger.info(f'Evaluated ind {ind}, result: {fit}')
+                ind.fitness.values = fit
+            # Select the individuals with best fitness values
+            population = toolbox.select(offspring, k=len(population))
+            if cache is not None:
+                logger.info(f'Evaluation cache: {cache.stats()}')
+            checkpoint.maybe_save(population, gen + 1, history, objective)
     
     # At the end of the training procedure 
     # report the top-10 individuals found
-    top10 = tools.selBest(population, k=10)
+    if args.engine == 'numpy':
+        top10 = [
+            (ind.tolist(), float(fit)) for ind, fit in zip(*engine.best(*population, k=10))
+        ]
+    else:
+        top10 = tools.selBest(population, k=10)
     logger.info(f'Best individuals found: {top10}')
 
+    # Which indexes help which queries, according to all the evaluations
+    analysis.report(analysis.column_effects(history.records(), database.flat_state))
+
+    experiment.log_stats(objective, evaluator)
+
+    evaluator.close()
+    benchmark.close()
+    # Nested json export of the history for the notebook
+    history.export_json()
 
 
 if __name__ == '__main__':    
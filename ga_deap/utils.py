@@ -12,8 +12,9 @@ def get_conn_str():
     return conn_str
 
 
-def get_conn_dict():
-    return {
+def get_conn_dict(**overrides):
+    # Overrides allow pointing to other servers (e.g. replicas)
+    conn_dict = {
         'user': config.UID, 
         'password': config.PWD, 
         'host': config.SERVER, 
@@ -21,6 +22,8 @@ def get_conn_dict():
         'auth_plugin': 'mysql_native_password',
         'allow_local_infile': 1
     }
+    conn_dict.update(overrides)
+    return conn_dict
 
 
 def ensure_dir(directory):